@@ -18,24 +18,35 @@
 ##    License along with this library; if not, write to the Free Software
 ##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import copy
 import urllib
 import urllib2
+import httplib
+import time
 
 import logging
-import simplejson
-import cgi
-from scapi.MultipartPostHandler import MultipartPostHandler
-from inspect import isclass
 import urlparse
-from scapi.authentication import BasicAuthenticator
-from scapi.util import escape
+import threading
+import weakref
+from scapi.util import escape, read_body, LazyModule, NullHandler
+from scapi.concurrency import run_concurrently, SingleFlight, DEFAULT_WORKERS
+from scapi.metrics import Instrumentation
+from scapi.transport import HTTPTransport
+
+# these are only needed for some requests, so
+# we don't pay for importing them up front
+simplejson = LazyModule("simplejson")
+cgi = LazyModule("cgi")
 
-logging.basicConfig()
 logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
 
 USE_PROXY = False
 """
 Something like http://127.0.0.1:10000/
+
+USE_PROXY, PROXY and the token-urls below are the defaults
+for ApiConnectors, which can be given their own values.
 """
 PROXY = ''
 
@@ -54,7 +65,7 @@ The url Soundcould offers to make users authorize a concrete request token.
 """
 AUTHORIZATION_URL = 'http://api.sandbox-soundcloud.com/oauth/authorize'
 
-__all__ = ['SoundCloudAPI', 'USE_PROXY', 'PROXY', 'REQUEST_TOKEN_URL', 'ACCESS_TOKEN_URL', 'AUTHORIZATION_URL']
+__all__ = ['SoundCloudAPI', 'USE_PROXY', 'PROXY', 'REQUEST_TOKEN_URL', 'ACCESS_TOKEN_URL', 'AUTHORIZATION_URL', 'save_all']
 
 
 class NoResultFromRequest(Exception):
@@ -95,7 +106,7 @@ class ApiConnector(object):
 
     """
     SoundClound imposes a maximum on the number of returned items. This value is that
-    maximum.
+    maximum, and the size of the pages if the connector has no page_size.
     """
     LIST_LIMIT = 50
 
@@ -104,13 +115,16 @@ class ApiConnector(object):
     """
     LIST_OFFSET_PARAMETER = 'offset'
     """
-    The query-parameter that is used to request results being limited to a certain amount.
-    
-    Currently this is of no use and just for completeness sake.
+    The query-parameter that is used to request results being limited to a certain amount,
+    see the page_size-parameter of the constructor.
     """
     LIST_LIMIT_PARAMETER = 'limit'
 
-    def __init__(self, host, user=None, password=None, authenticator=None, base="", collapse_scope=True):
+    def __init__(self, host, user=None, password=None, authenticator=None, base="", collapse_scope=True,
+                 identity_map=False, cache_redirects=False, proxy=None, request_token_url=None,
+                 access_token_url=None, authorization_url=None, transport=None, retry=None,
+                 rate_limiter=None, circuit_breaker=None, coalesce_gets=False, compression=True,
+                 fields_parameter=None, page_size=None):
         """
         Constructor for the API-Singleton. Use it once with parameters, and then the
         subsequent calls internal to the API will work.
@@ -124,14 +138,201 @@ class ApiConnector(object):
         @param password: if the user is given, you have to give a password as well
         @type authenticator: OAuthAuthenticator | BasicAuthenticator
         @param authenticator: the authenticator to use, see L{scapi.authentication}
+        @type identity_map: bool
+        @param identity_map: if True, resources with the same KIND and id are only
+                instantiated once per connector, see L{_resource}
+        @type cache_redirects: bool
+        @param cache_redirects: if True, the See-Other redirects of GET-requests are
+                remembered, and later requests go to the final location directly.
+        @type proxy: str
+        @param proxy: the HTTP-proxy to use, something like http://127.0.0.1:10000/.
+                Defaults to L{PROXY} if L{USE_PROXY} is set.
+        @type request_token_url: str
+        @param request_token_url: defaults to L{REQUEST_TOKEN_URL}
+        @type access_token_url: str
+        @param access_token_url: defaults to L{ACCESS_TOKEN_URL}
+        @type authorization_url: str
+        @param authorization_url: defaults to L{AUTHORIZATION_URL}
+        @param transport: performs the requests, defaults to a L{scapi.transport.HTTPTransport}.
+                See L{scapi.transport} for recording and replaying requests.
+        @type retry: scapi.retry.RetryPolicy
+        @param retry: if given, failed calls are retried according to it. Otherwise
+                all errors are raised immediately.
+        @type rate_limiter: scapi.ratelimit.RateLimiter
+        @param rate_limiter: if given, calls wait for their turn according to it
+        @type circuit_breaker: scapi.breaker.CircuitBreaker
+        @param circuit_breaker: if given, calls to failing endpoints fail fast
+        @type coalesce_gets: bool
+        @param coalesce_gets: if True, identical GETs running at the same time share
+                a single request, see L{scapi.concurrency.SingleFlight}
+        @type compression: bool
+        @param compression: if True, gzip- or deflate-compressed responses are accepted
+        @type fields_parameter: str
+        @param fields_parameter: the query-parameter the server accepts a comma-separated
+                list of fields with, if any. Projections are always applied
+                when decoding, see L{Scope.with_fields}.
+        @type page_size: int
+        @param page_size: the number of items to request per page of lists. Calls can
+                override it with __limit__. Pages larger than L{LIST_LIMIT} might
+                be capped by the server - the connector then learns the actual
+                maximum of each route, and uses that.
         """
         self.host = host
+        if proxy is None and USE_PROXY:
+            proxy = PROXY
+        self.proxy = proxy
+        self.request_token_url = request_token_url or REQUEST_TOKEN_URL
+        self.access_token_url = access_token_url or ACCESS_TOKEN_URL
+        self.authorization_url = authorization_url or AUTHORIZATION_URL
+        self.cache_redirects = cache_redirects
+        self.transport = transport or HTTPTransport()
+        self.retry = retry
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.compression = compression
+        self.fields_parameter = fields_parameter
+        self.page_size = page_size
+        # the maximum page-sizes of the routes, as far as we know them
+        self._page_caps = {}
+        # the largest page-sizes the routes are known not to cap
+        self._page_sizes_served = {}
+        self._flights = None
+        if coalesce_gets:
+            self._flights = SingleFlight()
+        self._routes = {}
+        # add sinks to this to measure the calls, see scapi.metrics
+        self.instrumentation = Instrumentation()
+        if circuit_breaker is not None:
+            circuit_breaker.add_listener(lambda key, state: self.instrumentation.state_changed("circuit", key, state))
+        self._redirects = {}
+        self._redirect_lock = threading.Lock()
+        self.redirect_round_trips_saved = 0
+        self._authenticator = None
         if authenticator is not None:
             self.authenticator = authenticator
         elif user is not None and password is not None:
+            from scapi.authentication import BasicAuthenticator
             self.authenticator = BasicAuthenticator(user, password)
         self._base = base
         self.collapse_scope = collapse_scope
+        self._identity_map = None
+        if identity_map:
+            self._identity_map = weakref.WeakValueDictionary()
+            self._identity_lock = threading.Lock()
+
+    def _route(self, scopes, method, argcount):
+        """
+        Return the compiled L{Route} for invoking method in scopes of the
+        same KINDs as the given ones, with argcount positional arguments.
+        """
+        key = self.host, self.collapse_scope, tuple([sc.KIND for sc in scopes]), method, argcount
+        route = self._routes.get(key)
+        if route is None:
+            route = self._routes[key] = Route(self, scopes, method, argcount)
+        return route
+
+    def _page_size_served(self, name, page_size):
+        """
+        Remember that the route of the given name served a page of page_size items
+        without capping it, so that shorter pages are known to be the last ones.
+        """
+        if self._page_sizes_served.get(name, 0) < page_size:
+            self._page_sizes_served[name] = page_size
+
+    def _probe_page_cap(self, name, count, items):
+        """
+        Yield the items of the page following a page of count items, which
+        was shorter than requested. If there are any, the server capped the
+        page-size to count, which is remembered for the route of the given name.
+        Otherwise the page was the last one, and the route serves at least count items.
+        """
+        probed = False
+        for item in items or ():
+            if not probed and name not in self._page_caps:
+                logger.info("Learned the maximum page-size of %s: %i", name, count)
+                self._page_caps[name] = count
+            probed = True
+            yield item
+        if not probed:
+            self._page_size_served(name, count)
+
+    def _get_authenticator(self):
+        return self._authenticator
+
+    def _set_authenticator(self, authenticator):
+        # the redirects might depend on who we are - think of /me
+        self._authenticator = authenticator
+        self.forget_redirects()
+
+    authenticator = property(_get_authenticator, _set_authenticator)
+
+    def forget_redirects(self):
+        """
+        Clear the cache of redirects, see the cache_redirects-parameter
+        of the constructor.
+        """
+        self._redirect_lock.acquire()
+        try:
+            self._redirects.clear()
+        finally:
+            self._redirect_lock.release()
+
+    def _cached_redirect(self, url):
+        return self._redirects.get(url)
+
+    def _remember_redirect(self, url, location):
+        self._redirect_lock.acquire()
+        try:
+            if location is None:
+                self._redirects.pop(url, None)
+            else:
+                self._redirects[url] = location
+        finally:
+            self._redirect_lock.release()
+
+    def _redirect_saved(self):
+        self._redirect_lock.acquire()
+        try:
+            self.redirect_round_trips_saved += 1
+        finally:
+            self._redirect_lock.release()
+
+    def _resource(self, cls, data, scope, path_stack=None):
+        """
+        Create a resource of the given class.
+
+        If the identity-map is enabled, and there is already a living
+        instance with the same KIND and id, that instance is returned
+        instead - with the passed data merged into it, and living in the
+        passed scope from now on.
+
+        @param cls: the resource-class, usually taken from L{RESTBase.REGISTRY}
+        @param data: the resource's data
+        @type data: dict
+        @param scope: the scope the resource lives in
+        @type scope: scapi.Scope
+        @param path_stack: the path_stack, see L{RESTBase.__init__}
+        @return: the resource
+        @rtype: RESTBase
+        """
+        identity_map = self._identity_map
+        if identity_map is None:
+            return cls(data, scope, path_stack)
+        id = RESTBase._extract_id(data, path_stack)
+        if id is None:
+            return cls(data, scope, path_stack)
+        key = cls.KIND, id
+        self._identity_lock.acquire()
+        try:
+            res = identity_map.get(key)
+            if res is None:
+                res = cls(data, scope, path_stack)
+                identity_map[key] = res
+            else:
+                res._merge(data, scope)
+            return res
+        finally:
+            self._identity_lock.release()
 
     def normalize_method(self, method):
         """ 
@@ -169,13 +370,11 @@ class ApiConnector(object):
         Please note the None passed as  token & secret to the authenticator.
         """
         if url is None:
-            url = REQUEST_TOKEN_URL
+            url = self.request_token_url
         req = urllib2.Request(url)
         self.authenticator.augment_request(req, None)
-        handlers = []
-        if USE_PROXY:
-            handlers.append(urllib2.ProxyHandler({'http' : PROXY}))
-        opener = urllib2.build_opener(*handlers)
+        context = RequestContext(self)
+        opener = urllib2.build_opener(*context.proxy_handlers())
         handle = opener.open(req, None)
         info = handle.info()
         content = handle.read()
@@ -202,7 +401,7 @@ class ApiConnector(object):
 
         Please note the values passed as token & secret to the authenticator.
         """
-        return self.fetch_request_token(ACCESS_TOKEN_URL)
+        return self.fetch_request_token(self.access_token_url)
 
     def get_request_token_authorization_url(self, token):
         """
@@ -218,32 +417,242 @@ class ApiConnector(object):
         >>> authorization_url = sca.get_request_token_authorization_url(token)
         >>> webbrowser.open(authorization_url)
         """
-        return "%s?oauth_token=%s" % (AUTHORIZATION_URL, token)
+        return "%s?oauth_token=%s" % (self.authorization_url, token)
+
+
+
+class Route(object):
+    """
+    The compiled url-template for invoking a method within a certain
+    shape of scopes, e.g. the contacts of a user. Only the ids of the
+    scopes and the arguments need to be filled in for a concrete call.
+    """
+
+    def __init__(self, connector, scopes, method, argcount):
+        """
+        @param connector: the connector whose host and base are used
+        @type connector: ApiConnector
+        @param scopes: the scopes the method is invoked in
+        @type scopes: tuple<RESTBase>
+        @param method: the method-name
+        @type method: str
+        @param argcount: the number of positional arguments
+        @type argcount: int
+        """
+        self.host = connector.host
+        self.collapse_scope = connector.collapse_scope
+        if self.collapse_scope:
+            scopes = scopes[-1:]
+        self._scope_count = len(scopes)
+        # ensure the method has a trailing /
+        if method[-1] != "/":
+            method = method + "/"
+        method = method.replace("%", "%%") + "/".join(["%s"] * argcount)
+        self._method_template = method
+        scope = "".join(["%s/%%s/" % sc.KIND.replace("%", "%%") for sc in scopes])
+        prefix = "http://%s/%s" % (connector.host, connector._base)
+        self._url_template = prefix.replace("%", "%%") + scope + method
+        # the template with all the variable parts replaced by *
+        self.name = (scope + method).replace("%%", "%").replace("%s", "*")
+
+    def url(self, ids, args):
+        """
+        @param ids: the ids of all the scopes, as strings
+        @type ids: tuple<str>
+        @param args: the positional arguments
+        @type args: tuple
+        @return: the url without query-string
+        @rtype: str
+        """
+        if self._scope_count:
+            args = ids[-self._scope_count:] + args
+        return self._url_template % args
+
+    def method(self, args):
+        """
+        @return: the method including the arguments
+        @rtype: str
+        """
+        return self._method_template % args
+
+    def __repr__(self):
+        return "<Route %s>" % self.name
+
+
+class SCRequest(urllib2.Request):
+    """
+    The urllib2.Request used for all API-calls. It overloads the get_method-method
+    to return a custom method like "PUT", and knows how to sign itself and requests
+    to locations we are redirected to.
+    """
+
+    def __init__(self, url, connector, parameters=None, alternate_http_method=None):
+        """
+        @param url: the destination url
+        @param connector: the connector whose authenticator signs the request
+        @type connector: ApiConnector
+        @param parameters: the POST-parameters to use.
+        @type parameters: None|dict<str, basestring|list<basestring>>
+        @param alternate_http_method: an alternate HTTP-method to use
+        @type alternate_http_method: str
+        """
+        urllib2.Request.__init__(self, url)
+        self.connector = connector
+        self.parameters = parameters
+        self.alternate_http_method = alternate_http_method
+
+    @classmethod
+    def create(cls, url, connector, parameters=None, queryparams=None, alternate_http_method=None, use_multipart=False):
+        """
+        Create a request, enhanced with the current authenticators authorization
+        scheme headers.
+
+        @param queryparams: the queryparams to use
+        @type queryparams: None|dict<str, basestring|list<basestring>>
+        @param use_multipart: if True, the parameters aren't part of the signature
+        @type use_multipart: bool
+        @return: the fully equipped request
+        @rtype: SCRequest
+        """
+        req = cls(url, connector, parameters, alternate_http_method)
+        all_params = {}
+        if parameters is not None:
+            all_params.update(parameters)
+        if queryparams is not None:
+            all_params.update(queryparams)
+        if not all_params:
+            all_params = None
+        req.augment_request(all_params, use_multipart)
+        req.add_header("Accept", "application/json")
+        if connector.compression:
+            req.add_header("Accept-Encoding", "gzip, deflate")
+        return req
+
+    def get_method(self):
+        if self.alternate_http_method is not None:
+            return self.alternate_http_method
+        return urllib2.Request.get_method(self)
+
+    def has_data(self):
+        return self.parameters is not None
+
+    def augment_request(self, params, use_multipart=False):
+        self.connector.authenticator.augment_request(self, params, use_multipart)
+
+    def recreate_request(self, location):
+        """
+        Create a new, freshly signed GET-request for the given location.
+        """
+        return self.create(location, self.connector)
+
 
+class RequestContext(object):
+    """
+    The state of a single request. Everything that is specific to one
+    request lives here, instead of the handlers or the L{ApiConnector} - which
+    makes it safe to share connectors and scopes between threads.
+    """
+
+    def __init__(self, connector):
+        """
+        @param connector: the connector the request is performed with
+        @type connector: ApiConnector
+        """
+        self.connector = connector
+        self.proxy = connector.proxy
+        self.redirects = []
+        # the measurements, if the connector is instrumented
+        self.record = connector.instrumentation.start()
+
+    @property
+    def location(self):
+        """
+        The location of the last redirect, or None if there was none.
+        """
+        if self.redirects:
+            return self.redirects[-1]
+        return None
+
+    def proxy_handlers(self):
+        """
+        @return: the urllib2-handlers needed for using our proxy, if any
+        @rtype: list<urllib2.BaseHandler>
+        """
+        if self.proxy:
+            return [urllib2.ProxyHandler({'http' : self.proxy})]
+        return []
+
+    def handlers(self):
+        """
+        @return: the urllib2-handlers needed to perform an API-call
+        @rtype: list<urllib2.BaseHandler>
+        """
+        handlers = [SCRedirectHandler(self)] + self.proxy_handlers()
+        if self.record is not None:
+            handlers.append(TimingHTTPHandler(self.record))
+        return handlers
+
+
+class _TimingHTTPConnection(httplib.HTTPConnection):
+    record = None
+
+    def connect(self):
+        started = time.time()
+        httplib.HTTPConnection.connect(self)
+        self.record.add_timing("connect", started)
+
+
+class TimingHTTPHandler(urllib2.HTTPHandler):
+    """
+    A urllib2-Handler measuring the time it takes to establish connections.
+    """
+
+    def __init__(self, record):
+        urllib2.HTTPHandler.__init__(self)
+        self.record = record
+
+    def _connection(self, host, **kwargs):
+        connection = _TimingHTTPConnection(host, **kwargs)
+        connection.record = self.record
+        return connection
+
+    def http_open(self, req):
+        return self.do_open(self._connection, req)
 
  
 class SCRedirectHandler(urllib2.HTTPRedirectHandler):
     """
     A urllib2-Handler to deal with the redirects the RESTful API of SC uses.
+
+    The locations we are redirected to are stored in the L{RequestContext}.
     """
-    alternate_method = None
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def alternate_method(self):
+        return self.context.location
 
     def http_error_303(self, req, fp, code, msg, hdrs):
         """
         In case of return-code 303 (See-other), we have to store the location we got
         because that will determine the actual type of resource returned.
         """
-        self.alternate_method = hdrs['location']
+        self.context.redirects.append(hdrs['location'])
         # for oauth, we need to re-create the whole header-shizzle. This
         # does it - it recreates a full url and signs the request
-        new_url = self.alternate_method
+        new_url = hdrs['location']
 #         if USE_PROXY:
 #             import pdb; pdb.set_trace()
 #             old_url = req.get_full_url()
 #             protocol, host, _, _, _, _ = urlparse.urlparse(old_url)
 #             new_url = urlparse.urlunparse((protocol, host, self.alternate_method, None, None, None))
-        req = req.recreate_request(new_url)
-        return urllib2.HTTPRedirectHandler.http_error_303(self, req, fp, code, msg, hdrs)
+        new_req = req.recreate_request(new_url)
+        # newer urllib2-versions expect a timeout on the request
+        if hasattr(req, "timeout"):
+            new_req.timeout = req.timeout
+        return urllib2.HTTPRedirectHandler.http_error_303(self, new_req, fp, code, msg, hdrs)
 
     def http_error_201(self, req, fp, code, msg, hdrs):
         """
@@ -257,6 +666,19 @@ class SCRedirectHandler(urllib2.HTTPRedirectHandler):
             raise NoResultFromRequest()
         return self.http_error_303(req, fp, 303, msg, hdrs)
 
+def _project(res, fields):
+    """
+    Strip all but the given fields from the decoded resource(s).
+    """
+    if fields is None:
+        return res
+    if isinstance(res, dict):
+        return dict((key, value) for key, value in res.iteritems() if key in fields)
+    if isinstance(res, list):
+        return [_project(item, fields) for item in res]
+    return res
+
+
 class Scope(object):
     """
     The basic means to query and create resources. The Scope uses the L{ApiConnector} to
@@ -281,6 +703,12 @@ class Scope(object):
     >>> list(user.contacts())
     [<scapi.Contact object at 0x12345>, ...]
 
+    If only some fields of the resources are needed, a projection keeps the
+    resources small. It can be declared for a call, or for all calls of a scope:
+
+    >>> tracks = scope.tracks(__fields__=["title", "user_id"])
+    >>> tracks = scope.with_fields("title", "user_id").tracks()
+
     """
     def __init__(self, connector, scope=None, parent=None):
         """
@@ -302,17 +730,36 @@ class Scope(object):
             scope = parent._scope + scope
         self._scope = scope
         self._connector = connector
+        # the compiled routes, and the ids to fill in
+        self._routes = {}
+        self._scope_ids = None
+        # the projection of the resources returned, see with_fields
+        self._fields = None
 
     def _get_connector(self):
         return self._connector
 
+    def with_fields(self, *fields):
+        """
+        Create a copy of this scope projecting the resources its calls
+        return to the given fields. The id is always kept.
+
+        If the connector has a fields_parameter, the projection is sent to
+        the server, too.
+
+        @return: the projecting scope
+        @rtype: Scope
+        """
+        scope = Scope(self._connector)
+        scope._scope = self._scope
+        scope._fields = fields
+        return scope
+
     def _create_request(self, url, connector, parameters, queryparams, alternate_http_method=None, use_multipart=False):
         """
         This method returnes the urllib2.Request to perform the actual HTTP-request.
 
-        We return a subclass that overload the get_method-method to return a custom method like "PUT".
-        Additionally, the request is enhanced with the current authenticators authorization scheme
-        headers.
+        See L{SCRequest.create}.
 
         @param url: the destination url
         @param connector: our connector-instance
@@ -323,35 +770,9 @@ class Scope(object):
         @param alternate_http_method: an alternate HTTP-method to use
         @type alternate_http_method: str
         @return: the fully equipped request
-        @rtype: urllib2.Request
+        @rtype: SCRequest
         """
-        class MyRequest(urllib2.Request):
-            def get_method(self):
-                if alternate_http_method is not None:
-                    return alternate_http_method
-                return urllib2.Request.get_method(self)
-
-            def has_data(self):
-                return parameters is not None
-
-            def augment_request(self, params, use_multipart=False):
-                connector.authenticator.augment_request(self, params, use_multipart)
-
-            @classmethod
-            def recreate_request(cls, location):
-                return self._create_request(location, connector, None, None)
-        
-        req = MyRequest(url)
-        all_params = {}
-        if parameters is not None:
-            all_params.update(parameters)
-        if queryparams is not None:
-            all_params.update(queryparams)
-        if not all_params:
-            all_params = None
-        req.augment_request(all_params, use_multipart)
-        req.add_header("Accept", "application/json")
-        return req
+        return SCRequest.create(url, connector, parameters, queryparams, alternate_http_method, use_multipart)
 
     def _create_query_string(self, queryparams):
         """
@@ -366,7 +787,11 @@ class Scope(object):
             return ""
         h = []
         for key, values in queryparams.iteritems():
-            if isinstance(values, (int, long, float)):
+            if isinstance(values, (int, long)):
+                # numbers never need escaping
+                h.append("%s=%i" % (key, values))
+                continue
+            if isinstance(values, float):
                 values = str(values)
             if isinstance(values, basestring):
                 values = [values]
@@ -375,6 +800,40 @@ class Scope(object):
                 h.append("%s=%s" % (key, escape(v)))
         return "?" + "&".join(h)
 
+    def _route(self, method, argcount):
+        """
+        @return: the route for invoking method with argcount arguments in this scope
+        @rtype: Route
+        """
+        connector = self._connector
+        key = method, argcount
+        route = self._routes.get(key)
+        if route is None or route.host != connector.host or route.collapse_scope != connector.collapse_scope:
+            route = self._routes[key] = connector._route(self._scope, method, argcount)
+        return route
+
+    def _url(self, method, args, queryparams):
+        """
+        Create the url for invoking a method within this scope.
+
+        @param method: the method-name, e.g. "tracks"
+        @type method: str
+        @param args: the positional arguments of the call, e.g. the id of a track
+        @type args: tuple
+        @param queryparams: the queryparams to use
+        @type queryparams: None|dict<str, basestring|list<basestring>>
+        @return: the url, the method including the arguments, e.g. "tracks/1", and the route
+        @rtype: tuple(str, str, Route)
+        """
+        route = self._route(method, len(args))
+        ids = self._scope_ids
+        if ids is None:
+            ids = self._scope_ids = tuple([str(sc.id) for sc in self._scope])
+        url = route.url(ids, args)
+        if queryparams:
+            url += self._create_query_string(queryparams)
+        return url, route.method(args), route
+
     def _call(self, method, *args, **kwargs):
         """
         The workhorse. It's complicated, convoluted and beyond understanding of a mortal being.
@@ -382,22 +841,43 @@ class Scope(object):
         You have been warned.
         """
 
+        _original_kwargs = dict(kwargs)
+        connector = self._get_connector()
         queryparams = {}
-        __offset__ = ApiConnector.LIST_LIMIT
+        offset = 0
         if "__offset__" in kwargs:
             offset = kwargs.pop("__offset__")
-            queryparams['offset'] = offset
-            __offset__ = offset + ApiConnector.LIST_LIMIT
+            queryparams[ApiConnector.LIST_OFFSET_PARAMETER] = offset
 
         # create a closure to invoke this method again with a greater offset
         _cl_method = method
         _cl_args = tuple(args)
-        _cl_kwargs = {}
-        _cl_kwargs.update(kwargs)
-        _cl_kwargs["__offset__"] = __offset__
-        def continue_list_fetching():
-            return self._call(method, *_cl_args, **_cl_kwargs)
-        connector = self._get_connector()
+        _cl_kwargs = dict(kwargs)
+        def continue_list_fetching(count):
+            """
+            Fetch the items following a page of count items, if there are any.
+            """
+            if not count:
+                return ()
+            kwargs = dict(_cl_kwargs, __offset__=offset + count)
+            cap = connector._page_caps.get(route.name)
+            if count >= page_size:
+                connector._page_size_served(route.name, page_size)
+                return self._call(_cl_method, *_cl_args, **kwargs)
+            if cap is not None and count >= cap:
+                return self._call(_cl_method, *_cl_args, **kwargs)
+            if not limited or cap is not None or count < connector._page_sizes_served.get(route.name, 0):
+                # the route serves pages longer than this one, so it's the last
+                return ()
+            # the server might not allow pages as large as we asked for, so
+            # we have to find out whether this really was the last page
+            return connector._probe_page_cap(route.name, count, self._call(_cl_method, *_cl_args, **kwargs))
+        limit = kwargs.pop("__limit__", None) or connector.page_size
+        fields = kwargs.pop("__fields__", self._fields)
+        if fields is not None:
+            fields = frozenset(fields) | frozenset(["id"])
+            if connector.fields_parameter is not None:
+                queryparams[connector.fields_parameter] = ",".join(sorted(fields))
         def filelike(v):
             if isinstance(v, file):
                 return True
@@ -413,30 +893,154 @@ class Scope(object):
             fileargs = dict((key, value) for key, value in urlparams.iteritems() if filelike(value))
             use_multipart = bool(fileargs)
 
-        # ensure the method has a trailing /
-        if method[-1] != "/":
-            method = method + "/"
-        if args:
-            method = "%s%s" % (method, "/".join(str(a) for a in args))
-
-        scope = ''
-        if self._scope:
-            scopes = self._scope
-            if connector.collapse_scope:
-                scopes = scopes[-1:]
-            scope = "/".join([sc._scope() for sc in scopes]) + "/"
-        url = "http://%(host)s/%(base)s%(scope)s%(method)s%(queryparams)s" % dict(host=connector.host, method=method, base=connector._base, scope=scope, queryparams=self._create_query_string(queryparams))
-
-        # we need to install SCRedirectHandler
+        # the size of the pages, if the result is a list
+        page_size = ApiConnector.LIST_LIMIT
+        limited = False
+        if limit is not None and urlparams is None and alternate_http_method is None:
+            limited = True
+            cap = connector._page_caps.get(self._route(method, len(args)).name)
+            page_size = limit if cap is None else min(limit, cap)
+            queryparams[ApiConnector.LIST_LIMIT_PARAMETER] = page_size
+
+        url, method, route = self._url(method, args, queryparams)
+
+        # only plain GETs are candidates for redirect-caching
+        cacheable = connector.cache_redirects and urlparams is None \
+                    and alternate_http_method is None \
+                    and not [key for key in queryparams if key != ApiConnector.LIST_LIMIT_PARAMETER]
+        cached_location = None
+        if cacheable:
+            cached_location = connector._cached_redirect(url)
+            if cached_location is not None:
+                logger.debug("Using cached redirect: %s -> %s", url, cached_location)
+
+        # the handlers contain SCRedirectHandler
         # to gather possible See-Other redirects
         # so that we can exchange our method
-        redirect_handler = SCRedirectHandler()
-        handlers = [redirect_handler]
-        if USE_PROXY:
-            handlers.append(urllib2.ProxyHandler({'http' : PROXY}))
-        req = self._create_request(url, connector, urlparams, queryparams, alternate_http_method, use_multipart)
+        context = RequestContext(connector)
+        record = context.record
+        retry = connector.retry
+        http_method = alternate_http_method or ("GET" if urlparams is None else "POST")
+        if record is not None:
+            record.http_method = http_method
+        limiter = connector.rate_limiter
+        if limiter is not None:
+            identity = getattr(connector.authenticator, "identity", None)
+            budget = limiter.budget(http_method, use_multipart)
+        breaker = connector.circuit_breaker
+        circuit = connector.host, route.name
+        def fetch():
+            attempt = 1
+            while True:
+                if breaker is not None:
+                    breaker.before(circuit)
+                if limiter is not None:
+                    try:
+                        limiter.acquire(identity, budget)
+                    except:
+                        # the call isn't made, so it mustn't take the probe of a half-open circuit
+                        if breaker is not None:
+                            breaker.cancel(circuit)
+                        raise
+                try:
+                    fetched = self._fetch(context, url, method, urlparams, queryparams, alternate_http_method,
+                                          use_multipart, cacheable, cached_location)
+                    if breaker is not None:
+                        breaker.success(circuit)
+                    if limiter is not None:
+                        limiter.succeeded(identity, budget)
+                    if retry is not None:
+                        retry.succeeded(attempt)
+                    return fetched
+                except Exception, e:
+                    if breaker is not None:
+                        breaker.failure(circuit, e)
+                    if limiter is not None:
+                        limiter.failed(identity, budget, e)
+                    if retry is None or not retry.retry(http_method, use_multipart, e, attempt):
+                        raise
+                    # the next attempt is signed anew by _fetch
+                    attempt += 1
+                    context.redirects = []
+                    if record is not None:
+                        record.retries += 1
+        try:
+            return self._perform(context, url, urlparams, alternate_http_method, cached_location,
+                                 fetch, continue_list_fetching, fields)
+        except Exception, e:
+            if cached_location is not None and isinstance(e, urllib2.HTTPError):
+                # the redirect might be stale, so try again the long way. That
+                # call is recorded by itself, as the only one.
+                connector._remember_redirect(url, None)
+                record = None
+                return self._call(_cl_method, *_cl_args, **_original_kwargs)
+            if record is not None:
+                record.error = e
+            raise
+        finally:
+            if record is not None:
+                record.endpoint = route.name
+                connector.instrumentation.emit(record)
+
+    def _perform(self, context, url, urlparams, alternate_http_method, cached_location,
+                 fetch, continue_list_fetching, fields=None):
+        """
+        Perform the request prepared by L{_call} using fetch, and map the result.
+
+        If the connector coalesces GETs, identical ones running at the same time
+        share a single request and decoded result - but every caller gets its own
+        domain-objects. Only the first caller invokes fetch, so only its attempts
+        are rate-limited and reported to the circuit-breaker and retry-policy.
+
+        @param fetch: a callable performing the request, with retries, and returning
+               the result of L{_fetch}
+        @param fields: if given, the fields of the resources to keep
+        """
+        connector = context.connector
+        record = context.record
+        flights = connector._flights
+        if flights is not None and urlparams is None and alternate_http_method is None:
+            key = cached_location or url, getattr(connector.authenticator, "identity", None)
+            fetched, shared = flights.do(key, fetch)
+            if shared and fetched is not None:
+                res, method = fetched
+                fetched = copy.deepcopy(_project(res, fields)), method
+            if record is not None:
+                record.coalesced = shared
+        else:
+            fetched = fetch()
+        if fetched is None:
+            return None
+        res, method = fetched
+        if record is not None:
+            started = time.time()
+        res = self._map(_project(res, fields), method, continue_list_fetching)
+        if record is not None:
+            record.add_timing("map", started)
+        return res
+
+    def _fetch(self, context, url, method, urlparams, queryparams, alternate_http_method,
+               use_multipart, cacheable, cached_location):
+        """
+        Perform the request, and decode the result.
+
+        @return: None for GETs of missing resources, or the decoded
+                 result and the method, which might have changed through
+                 a redirect.
+        @rtype: None | tuple(object, str)
+        """
+        connector = context.connector
+        record = context.record
+        if record is not None:
+            started = time.time()
+        handlers = context.handlers()
+        req = self._create_request(cached_location or url, connector, urlparams, queryparams,
+                                   alternate_http_method, use_multipart)
 
         http_method = req.get_method()
+        if record is not None:
+            record.http_method = http_method
+            started = record.add_timing("signing", started)
         if urlparams is not None:
             logger.debug("Posting url: %s, method: %s", url, http_method)
         else:
@@ -444,41 +1048,53 @@ class Scope(object):
 
             
         if use_multipart:
+            from scapi.MultipartPostHandler import MultipartPostHandler
             handlers.extend([MultipartPostHandler])            
         else:
             if urlparams is not None:
                 urlparams = urllib.urlencode(urlparams.items(), True)
-        opener = urllib2.build_opener(*handlers)
         try:
-            handle = opener.open(req, urlparams)
+            handle = connector.transport.open(context, req, urlparams, handlers)
         except NoResultFromRequest:
             return None
         except urllib2.HTTPError, e:
-            if http_method == "GET" and e.code == 404:
+            if record is not None:
+                record.status = e.code
+                record.redirects = len(context.redirects)
+            if cached_location is None and http_method == "GET" and e.code == 404:
                 return None
             raise
 
+        if record is not None:
+            now = time.time()
+            record.timings["ttfb"] = now - started - record.timings.get("connect", 0.0)
+            started = now
+            record.status = getattr(handle, "code", None)
+            record.redirects = len(context.redirects)
         info = handle.info()
         ct = info['Content-Type']
-        content = handle.read()
+        content, received = read_body(handle, info.get('Content-Encoding'))
+        if record is not None:
+            record.bytes_received = received
+            record.bytes_decoded = len(content)
+            started = record.add_timing("read", started)
         logger.debug("Request Content:\n%s", content)
-        if redirect_handler.alternate_method is not None:
-            method = connector.normalize_method(redirect_handler.alternate_method)
+        location = context.location
+        if cached_location is not None and location is None:
+            location = cached_location
+            connector._redirect_saved()
+        elif cacheable and location is not None:
+            connector._remember_redirect(url, location)
+        if location is not None:
+            method = connector.normalize_method(location)
             logger.debug("Method changed through redirect to: <%s>", method)
 
         try:
             if "application/json" in ct:
-                content = content.strip()
-                if not content:
-                    content = "{}"
-                try:
-                    res = simplejson.loads(content)
-                except:
-                    logger.error("Couldn't decode returned json")
-                    logger.error(content)
-                    raise
-                res = self._map(res, method, continue_list_fetching)
-                return res
+                res = self._decode(content)
+                if record is not None:
+                    record.add_timing("decode", started)
+                return res, method
             elif len(content) <= 1:
                 # this might be the famous SeeOtherSpecialCase which means that
                 # all that matters is just the method
@@ -487,6 +1103,20 @@ class Scope(object):
         finally:
             handle.close()
 
+    def _decode(self, content):
+        """
+        Decode the JSON-content of a response.
+        """
+        content = content.strip()
+        if not content:
+            content = "{}"
+        try:
+            return simplejson.loads(content)
+        except:
+            logger.error("Couldn't decode returned json")
+            logger.error(content)
+            raise
+
     def _map(self, res, method, continue_list_fetching):
         """
         This method will take the JSON-result of a HTTP-call and return our domain-objects.
@@ -494,6 +1124,7 @@ class Scope(object):
         It's also deep magic, don't look.
         """
         pathparts = reversed(method.split("/"))
+        connector = self._get_connector()
         stack = []
         for part in pathparts:
             stack.append(part)
@@ -501,17 +1132,17 @@ class Scope(object):
                 cls = RESTBase.REGISTRY[part]
                 # multiple objects
                 if isinstance(res, list):
+                    # the page is mapped right away, so that it's part of the
+                    # call's "map"-timing - only the following pages are lazy
+                    resources = [connector._resource(cls, item, self, stack) for item in res]
                     def result_gen():
-                        count = 0
-                        for item in res:
-                            yield cls(item, self, stack)
-                            count += 1
-                        if count == ApiConnector.LIST_LIMIT:
-                            for item in continue_list_fetching():
-                                yield item
+                        for resource in resources:
+                            yield resource
+                        for item in continue_list_fetching(len(resources)):
+                            yield item
                     return result_gen()
                 else:
-                    return cls(res, self, stack)
+                    return connector._resource(cls, res, self, stack)
         logger.debug("don't know how to handle result")
         logger.debug(res)
         return res
@@ -529,6 +1160,9 @@ class Scope(object):
 
          - invoking remove(resource) on it will DELETE the resource from it's container. Also only usable on collections.
 
+         - extend(resources), remove_many(resources) and sync_to(resources) are the bulk-versions of the above,
+           performing the requests concurrently.
+
          TODO: describe the latter 
         """
         scope = self
@@ -553,6 +1187,43 @@ class Scope(object):
 
             def remove(selfish, resource):
                 self._call(_name, str(resource.id), _alternate_http_method="DELETE")
+
+            def extend(selfish, resources, workers=DEFAULT_WORKERS):
+                """
+                Append all the resources, using at most workers concurrent requests.
+
+                @return: the outcome for every resource
+                @rtype: list<scapi.concurrency.Outcome>
+                """
+                return run_concurrently(selfish.append, resources, workers)
+
+            def remove_many(selfish, resources, workers=DEFAULT_WORKERS):
+                """
+                Remove all the resources, using at most workers concurrent requests.
+
+                @return: the outcome for every resource
+                @rtype: list<scapi.concurrency.Outcome>
+                """
+                return run_concurrently(selfish.remove, resources, workers)
+
+            def sync_to(selfish, resources, workers=DEFAULT_WORKERS):
+                """
+                Make the collection contain exactly the given resources. Only
+                the missing resources are appended, and only the superfluous
+                ones are removed.
+
+                @return: the outcomes of appending and of removing
+                @rtype: tuple(list<scapi.concurrency.Outcome>, list<scapi.concurrency.Outcome>)
+                """
+                current = set(self._call(_name) or [])
+                wanted = set()
+                to_append = []
+                for resource in resources:
+                    if resource not in wanted and resource not in current:
+                        to_append.append(resource)
+                    wanted.add(resource)
+                to_remove = [resource for resource in current if resource not in wanted]
+                return selfish.extend(to_append, workers), selfish.remove_many(to_remove, workers)
                 
         if _name in RESTBase.ALL_DOMAIN_CLASSES:
             cls = RESTBase.ALL_DOMAIN_CLASSES[_name]
@@ -583,14 +1254,66 @@ class Scope(object):
         return base + "/" + str(scopes[-1])
 
 
-# maybe someday I'll make that work.
-# class RESTBaseMeta(type):
-#     def __new__(self, name, bases, d):
-#         clazz = type(name, bases, d)
-#         if 'KIND' in d:
-#             kind = d['KIND']
-#             RESTBase.REGISTRY[kind] = clazz
-#         return clazz
+_MISSING = object()
+
+
+class EditSession(object):
+    """
+    The context-manager returned by L{RESTBase.edit}.
+    """
+
+    def __init__(self, resource):
+        self._resource = resource
+
+    def __enter__(self):
+        return self._resource
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self._resource.save()
+        else:
+            self._resource.discard()
+
+
+def save_all(resources, workers=DEFAULT_WORKERS):
+    """
+    Save all the resources with unsaved changes concurrently, see
+    L{RESTBase.save}. The edit-sessions of the resources without
+    changes are ended, too.
+
+    @param resources: the resources to save
+    @type resources: list<RESTBase>
+    @type workers: int | scapi.concurrency.AdaptiveLimit
+    @param workers: the maximum number of concurrent requests
+    @return: the outcomes of saving the dirty resources
+    @rtype: list<scapi.concurrency.Outcome>
+    """
+    dirty = []
+    for resource in resources:
+        if resource.is_dirty():
+            dirty.append(resource)
+        else:
+            # doesn't send anything
+            resource.save()
+    return run_concurrently(lambda resource: resource.save(), dirty, workers)
+
+
+class RESTBaseMeta(type):
+    """
+    This registers all the RESTBase subclasses declaring
+    a KIND, under their KIND and ALIASES.
+    """
+
+    def __init__(cls, name, bases, d):
+        type.__init__(cls, name, bases, d)
+        if d.get('KIND') is not None:
+            RESTBase.REGISTRY[cls.KIND] = cls
+            RESTBase.ALL_DOMAIN_CLASSES[name] = cls
+            for alias in cls.ALIASES:
+                RESTBase.REGISTRY[alias] = cls
+            if cls.__module__ == __name__:
+                __all__.append(name)
+
 
 class RESTBase(object):
     """
@@ -598,6 +1321,8 @@ class RESTBase(object):
 
     
     """
+    __metaclass__ = RESTBaseMeta
+
     REGISTRY = {}
     
     ALL_DOMAIN_CLASSES = {}
@@ -609,30 +1334,89 @@ class RESTBase(object):
     def __init__(self, data, scope, path_stack=None):
         self.__data = data
         self.__scope = scope
+        # hydrated nested resources and the child-scope are
+        # cached, so that repeated attribute access is cheap
+        self.__cache = {}
+        self.__child_scope = None
+        # simple properties set during an edit-session, see edit()
+        self.__editing = False
+        self.__dirty = {}
+        self.__original = {}
         # try and see if we can/must create an id out of our path
         logger.debug("path_stack: %r", path_stack)
+        id = self._extract_id(data, path_stack)
+        if id is not None:
+            self.__data['id'] = id
+            # the key used for hashing & equality
+            self.__key = self.KIND, id
+        else:
+            # without an id, a resource is only equal to itself
+            self.__key = object()
+
+    @staticmethod
+    def _extract_id(data, path_stack):
+        """
+        Return the id of a resource, either taken from the path_stack
+        or from the data. If there is none, None is returned.
+        """
         if path_stack:
             try:
-                id = int(path_stack[0])
-                self.__data['id'] = id
+                return int(path_stack[0])
             except ValueError:
                 pass
+        return data.get('id')
 
     def __getattr__(self, name):
+        cache = self.__cache
+        if name in cache:
+            return cache[name]
         if name in self.__data:
             obj = self.__data[name]
             if name in RESTBase.REGISTRY:
+                cls = RESTBase.REGISTRY[name]
+                connector = self.__scope._get_connector()
                 if isinstance(obj, dict):
-                    obj = RESTBase.REGISTRY[name](obj, self.__scope)
+                    obj = connector._resource(cls, obj, self.__scope)
                 elif isinstance(obj, list):
-                    obj = [RESTBase.REGISTRY[name](o, self.__scope) for o in obj]
+                    obj = [connector._resource(cls, o, self.__scope) for o in obj]
                 else:
                     logger.warning("Found %s in our registry, but don't know what to do with"\
                                    "the object.")
+                cache[name] = obj
             return obj
-        scope = Scope(self.__scope._get_connector(), scope=self, parent=self.__scope)
+        scope = self.__child_scope
+        if scope is None:
+            scope = Scope(self.__scope._get_connector(), scope=self, parent=self.__scope)
+            self.__child_scope = scope
         return getattr(scope, name)
 
+    def _invalidate(self):
+        """
+        Drop the hydrated nested resources, so that they are re-created
+        from our data on the next access.
+        """
+        self.__cache.clear()
+
+    def _merge(self, data, scope=None):
+        """
+        Merge newer data into this resource. Properties with unsaved changes
+        keep them - the newer data is what L{discard} restores.
+
+        @param scope: if given, the scope the resource lives in from now on. Without
+               collapse_scope, the URIs of its child-scopes depend on it.
+        """
+        if data is not self.__data:
+            for key, value in data.iteritems():
+                if key in self.__dirty:
+                    if key in self.__original:
+                        self.__original[key] = value
+                else:
+                    self.__data[key] = value
+        if scope is not None and scope is not self.__scope:
+            self.__scope = scope
+            self.__child_scope = None
+        self._invalidate()
+
     def __setattr__(self, name, value):
         """
         This method is used to set a property, a resource or a list of resources as property of the resource the
@@ -683,12 +1467,90 @@ class RESTBase(object):
             elif isinstance(value, RESTBase):
                 # we got a single instance, so make that an argument
                 self.__scope._call(self.KIND, self.id, name, **value._as_arguments())
+            elif self.__editing:
+                # we have a simple property, but defer sending it
+                # until the edit-session is over
+                if name not in self.__original:
+                    self.__original[name] = self.__data.get(name, _MISSING)
+                self.__dirty[name] = value
+                self.__data[name] = value
             else:
                 # we have a simple property
                 parameter_name = "%s[%s]" % (self._singleton(), name)
                 kwargs = {"_alternate_http_method" : "PUT",
                           parameter_name : self._convert_value(value)}
                 self.__scope._call(self.KIND, self.id, **kwargs)
+            self._invalidate()
+
+    def edit(self):
+        """
+        Start an edit-session. Simple properties set during the session
+        are recorded, and sent using one single PUT when L{save} is invoked.
+
+        The returned object can be used as context-manager, which saves the
+        resource if the block succeeds, and discards the changes otherwise:
+
+        >>> with track.edit():
+        ...     track.title = "new_title"
+        ...     track.genre = "new_genre"
+
+        Or explicitly:
+
+        >>> track.edit()
+        >>> track.title = "new_title"
+        >>> track.genre = "new_genre"
+        >>> track.save()
+
+        @return: the edit-session
+        @rtype: EditSession
+        """
+        self.__editing = True
+        return EditSession(self)
+
+    def is_dirty(self):
+        """
+        @return: True if there are recorded changes not yet saved.
+        @rtype: bool
+        """
+        return bool(self.__dirty)
+
+    def save(self):
+        """
+        End the edit-session, and send all recorded changes to the server
+        using one PUT. If the PUT fails, the changes stay recorded, so
+        saving can be retried.
+        """
+        self.__editing = False
+        if not self.__dirty:
+            return
+        singleton = self._singleton()
+        kwargs = {"_alternate_http_method" : "PUT"}
+        for name, value in self.__dirty.iteritems():
+            kwargs["%s[%s]" % (singleton, name)] = self._convert_value(value)
+        self.__scope._call(self.KIND, self.id, **kwargs)
+        self.__dirty = {}
+        self.__original = {}
+
+    def discard(self):
+        """
+        End the edit-session, and restore the properties recorded
+        during it to their former values.
+        """
+        self.__editing = False
+        for name, value in self.__original.iteritems():
+            if value is _MISSING:
+                del self.__data[name]
+            else:
+                self.__data[name] = value
+        self.__dirty = {}
+        self.__original = {}
+        self._invalidate()
+
+    def _as_dict(self):
+        """
+        Return a copy of the resource's data, e.g. for storing it.
+        """
+        return copy.deepcopy(self.__data)
 
     def _as_arguments(self):        
         """
@@ -798,7 +1660,7 @@ class RESTBase(object):
         return "\n".join(res)
 
     def __hash__(self):
-        return hash("%s%i" % (self.KIND, self.id))
+        return hash(self.__key)
 
     def __eq__(self, other):
         """
@@ -806,10 +1668,11 @@ class RESTBase(object):
 
         Resources are considered equal if the have the same kind and id.
         """
+        if self is other:
+            return True
         if not isinstance(other, RESTBase):
             return False        
-        res = self.KIND == other.KIND and self.id == other.id
-        return res
+        return self.__key == other.__key
 
     def __ne__(self, other):
         return not self == other
@@ -845,18 +1708,3 @@ class Playlist(RESTBase):
     A playlist/set domain object/resource
     """
     KIND = 'playlists'
-
-
-# this registers all the RESTBase subclasses.
-# One day using a metaclass will make this a tad
-# less ugly.
-def register_classes():
-    g = {}
-    g.update(globals())
-    for name, cls in [(k, v) for k, v in g.iteritems() if isclass(v) and issubclass(v, RESTBase) and not v == RESTBase]:
-        RESTBase.REGISTRY[cls.KIND] = cls
-        RESTBase.ALL_DOMAIN_CLASSES[cls.__name__] = cls
-        for alias in cls.ALIASES:
-            RESTBase.REGISTRY[alias] = cls
-        __all__.append(name)
-register_classes()
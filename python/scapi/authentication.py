@@ -137,6 +137,8 @@ class OAuthAuthenticator(object):
         self._consumer, self._token, self._secret = consumer, token, secret
         self._consumer_secret = consumer_secret
         self._signature_method = signature_method
+        # who we are, e.g. for rate-limiting
+        self.identity = "%s:%s" % (consumer, token)
         random.seed()
 
 
@@ -179,6 +181,7 @@ class BasicAuthenticator(object):
     def __init__(self, user, password, consumer, consumer_secret):
         self._base64string = base64.encodestring("%s:%s" % (user, password))[:-1]
         self._x_auth_header = 'OAuth oauth_consumer_key="%s" oauth_consumer_secret="%s"' % (consumer, consumer_secret)
+        self.identity = "%s:%s" % (consumer, user)
 
     def augment_request(self, req, parameters):
         req.add_header("Authorization", "Basic %s" % self._base64string)
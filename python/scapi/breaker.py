@@ -0,0 +1,202 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Circuit-breakers, so that calls to a failing endpoint fail fast instead of
+piling up:
+
+>>> breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+>>> sca = scapi.Scope(scapi.ApiConnector(host=API_HOST, authenticator=authenticator,
+...                                      circuit_breaker=breaker))
+
+There is a circuit per host and route, e.g. ("api.soundcloud.com", "tracks/*").
+After failure_threshold consecutive failures, the circuit opens, and calls
+raise L{CircuitOpen} without being sent. Once reset_timeout has passed, a
+few probes are let through (half-open). If they succeed, the circuit closes
+again, otherwise it stays open for another reset_timeout.
+
+The state-changes are reported to the sinks of the connector's
+L{scapi.metrics.Instrumentation}.
+"""
+
+import time
+import socket
+import httplib
+import urllib2
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit is open.
+    """
+
+    def __init__(self, key, retry_at):
+        Exception.__init__(self, "Circuit for %s is open" % (key,))
+        self.key = key
+        self.retry_at = retry_at
+
+
+class _Circuit(object):
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+
+
+class CircuitBreaker(object):
+    """
+    Keeps the circuits of all endpoints. A breaker can be shared between connectors.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_probes=1, clock=time.time):
+        """
+        @type failure_threshold: int
+        @param failure_threshold: the number of consecutive failures opening a circuit
+        @type reset_timeout: float
+        @param reset_timeout: the seconds an open circuit waits before probing
+        @type half_open_probes: int
+        @param half_open_probes: the number of concurrent probes of a half-open circuit
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self.listeners = []
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """
+        @param listener: a callable invoked with the key and the new state of
+               every circuit changing its state
+        """
+        self.listeners.append(listener)
+
+    def is_failure(self, exception):
+        """
+        Only failures of the server count, not those of our calls - a
+        404 doesn't indicate an outage.
+        """
+        if isinstance(exception, urllib2.HTTPError):
+            return exception.code >= 500
+        return isinstance(exception, (urllib2.URLError, httplib.HTTPException, socket.error))
+
+    def _transition(self, key, circuit, state):
+        # invoked with the lock held, the listeners are notified afterwards
+        logger.info("Circuit for %s changes from %s to %s", key, circuit.state, state)
+        circuit.state = state
+        if state == OPEN:
+            circuit.opened_at = self.clock()
+        elif state == CLOSED:
+            circuit.failures = 0
+        circuit.probes = 0
+        return state
+
+    def _notify(self, key, state):
+        if state is not None:
+            for listener in self.listeners:
+                listener(key, state)
+
+    def _synchronized(self, key, func):
+        self._lock.acquire()
+        try:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit()
+            return func(circuit)
+        finally:
+            self._lock.release()
+
+    def before(self, key):
+        """
+        Invoked before calling the endpoint.
+
+        @raise CircuitOpen: if the call mustn't be made
+        """
+        def before(circuit):
+            changed = None
+            if circuit.state == OPEN:
+                retry_at = circuit.opened_at + self.reset_timeout
+                if self.clock() < retry_at:
+                    raise CircuitOpen(key, retry_at)
+                changed = self._transition(key, circuit, HALF_OPEN)
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_probes:
+                    raise CircuitOpen(key, None)
+                circuit.probes += 1
+            return changed
+        self._notify(key, self._synchronized(key, before))
+
+    def cancel(self, key):
+        """
+        Invoked if the call wasn't made after all, e.g. because it was rate-limited.
+        A half-open circuit gets the probe back.
+        """
+        def cancel(circuit):
+            if circuit.state == HALF_OPEN and circuit.probes > 0:
+                circuit.probes -= 1
+        self._synchronized(key, cancel)
+
+    def success(self, key):
+        def success(circuit):
+            circuit.failures = 0
+            if circuit.state != CLOSED:
+                return self._transition(key, circuit, CLOSED)
+        self._notify(key, self._synchronized(key, success))
+
+    def failure(self, key, exception):
+        """
+        Invoked if calling the endpoint failed with the exception.
+        """
+        if not self.is_failure(exception):
+            return self.success(key)
+        def failure(circuit):
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or \
+                   (circuit.state == CLOSED and circuit.failures >= self.failure_threshold):
+                return self._transition(key, circuit, OPEN)
+        self._notify(key, self._synchronized(key, failure))
+
+    def state(self, key):
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            return CLOSED
+        return circuit.state
+
+    def states(self):
+        """
+        @return: the states of all circuits
+        @rtype: dict<tuple(str, str), str>
+        """
+        self._lock.acquire()
+        try:
+            return dict((key, circuit.state) for key, circuit in self._circuits.iteritems())
+        finally:
+            self._lock.release()
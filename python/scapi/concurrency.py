@@ -0,0 +1,287 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys
+import time
+import threading
+import Queue
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+"""
+The number of worker-threads used if nothing else is specified.
+"""
+
+
+class Outcome(object):
+    """
+    The outcome of invoking a function for a single item, as
+    returned by L{run_concurrently}.
+    """
+
+    def __init__(self, item, result=None, exc_info=None):
+        self.item = item
+        self.result = result
+        self.exc_info = exc_info
+
+    @property
+    def ok(self):
+        return self.exc_info is None
+
+    @property
+    def exception(self):
+        if self.exc_info is None:
+            return None
+        return self.exc_info[1]
+
+    def __repr__(self):
+        if self.ok:
+            return "<Outcome %r: %r>" % (self.item, self.result)
+        return "<Outcome %r failed: %r>" % (self.item, self.exception)
+
+
+class AdaptiveLimit(object):
+    """
+    A concurrency-limit adapting itself to the observed latency, to be
+    passed as workers to L{run_concurrently} - and thus to all batch-operations
+    like extend or L{scapi.save_all}.
+
+    The latencies and errors are evaluated per window of invocations. The limit
+    is raised by one (additive increase) as long as the 95th percentile
+    of the latencies stays within tolerance of the baseline, and it was
+    actually used. If the latency rises beyond that, or too many invocations
+    fail, the server is apparently overloaded, and the limit is multiplied
+    by backoff (multiplicative decrease).
+
+    The baseline follows lower latencies right away, and higher ones slowly,
+    so that after a lasting shift of the latency the limit settles again
+    instead of staying at min_limit.
+
+    A limit can be shared between several batches running at the same time,
+    and also be reused for later ones.
+    """
+
+    def __init__(self, initial=DEFAULT_WORKERS, min_limit=1, max_limit=32, window=20,
+                 tolerance=1.5, backoff=0.7, error_threshold=0.1, drift=0.2, on_change=None):
+        """
+        @type initial: int
+        @param initial: the limit to start with
+        @param min_limit: the lower bound of the limit
+        @param max_limit: the upper bound of the limit, which is also the number of threads used
+        @type window: int
+        @param window: the number of invocations evaluated together
+        @type tolerance: float
+        @param tolerance: the factor by which the latency may exceed the baseline
+        @type backoff: float
+        @param backoff: the factor applied to the limit when backing off
+        @type error_threshold: float
+        @param error_threshold: the fraction of failed invocations that makes us back off
+        @type drift: float
+        @param drift: the fraction of the difference the baseline moves towards
+               a higher latency per window
+        @param on_change: if given, a callable invoked with every new limit, e.g. to report it
+               with L{scapi.metrics.StatsdSink.gauge}
+        """
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.error_threshold = error_threshold
+        self.drift = drift
+        self.on_change = on_change
+        # the 95th percentile of the latencies considered normal
+        self.baseline = None
+        self.in_flight = 0
+        self._max_in_flight = 0
+        self._latencies = []
+        self._errors = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until an invocation may start.
+        """
+        self._condition.acquire()
+        try:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self.in_flight)
+        finally:
+            self._condition.release()
+
+    def release(self, latency, ok=True):
+        """
+        Report the end of an invocation.
+
+        @param latency: the seconds the invocation took
+        @param ok: False if the invocation failed
+        """
+        self._condition.acquire()
+        try:
+            self.in_flight -= 1
+            self._latencies.append(latency)
+            if not ok:
+                self._errors += 1
+            if len(self._latencies) >= self.window:
+                self._adapt()
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def _adapt(self):
+        latencies = sorted(self._latencies)
+        p95 = latencies[int(round((len(latencies) - 1) * 0.95))]
+        error_rate = float(self._errors) / len(latencies)
+        limit = self.limit
+        if self.baseline is None or p95 < self.baseline:
+            self.baseline = p95
+        overloaded = error_rate > self.error_threshold or p95 > self.baseline * self.tolerance
+        if p95 > self.baseline:
+            # an exponentially weighted moving average, so that it only
+            # follows a lasting rise
+            self.baseline += self.drift * (p95 - self.baseline)
+        if overloaded:
+            limit = max(self.min_limit, int(limit * self.backoff))
+        elif self._max_in_flight >= limit:
+            limit = min(self.max_limit, limit + 1)
+        self._latencies = []
+        self._errors = 0
+        self._max_in_flight = self.in_flight
+        if limit != self.limit:
+            logger.debug("Concurrency-limit changed from %i to %i (p95 %.3f, errors %.2f)",
+                         self.limit, limit, p95, error_rate)
+            self.limit = limit
+            if self.on_change is not None:
+                self.on_change(limit)
+
+
+def run_concurrently(func, items, workers=DEFAULT_WORKERS):
+    """
+    Invoke func for every item, using at most workers threads.
+
+    Exceptions are not propagated, but recorded in the
+    resulting outcomes.
+
+    @param func: the callable, invoked with a single item
+    @param items: the items
+    @type workers: int | AdaptiveLimit
+    @param workers: the maximum number of concurrent invocations, or an
+           L{AdaptiveLimit} determining it
+    @return: the outcomes, in the order of the items
+    @rtype: list<Outcome>
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    tasks = Queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+    limit = None
+    if isinstance(workers, AdaptiveLimit):
+        limit = workers
+        workers = limit.max_limit
+
+    def work():
+        while True:
+            try:
+                index, item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            if limit is not None:
+                limit.acquire()
+                started = time.time()
+            try:
+                outcomes[index] = Outcome(item, func(item))
+            except Exception:
+                logger.debug("Invocation for %r failed", item, exc_info=True)
+                outcomes[index] = Outcome(item, exc_info=sys.exc_info())
+            if limit is not None:
+                limit.release(time.time() - started, outcomes[index].ok)
+
+    threads = [threading.Thread(target=work) for _ in xrange(min(workers, len(items)))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent invocations for the same key: while one is
+    running, others for the same key wait for it, and share its result.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Invoke func, unless there is already an invocation running for
+        the key. Exceptions are raised to all waiting callers.
+
+        @return: the result, and whether it was shared with other callers. A shared
+                 result must be treated as immutable, as the callers get the same object.
+        @rtype: tuple(object, bool)
+        """
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+        finally:
+            self._lock.release()
+        if not leader:
+            flight.done.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            return flight.result, True
+        try:
+            flight.result = func()
+        except:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._flights[key]
+                followers = flight.followers
+            finally:
+                self._lock.release()
+            flight.done.set()
+        return flight.result, followers > 0
@@ -0,0 +1,326 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+A crawler for the social graph, following the contacts of users
+breadth-first:
+
+>>> edges = open("edges.tsv", "a")
+>>> crawler = Crawler(sca, seeds=[1234], workers=8, checkpoint="crawl.json",
+...                   on_edge=lambda user_id, contact_id: edges.write("%i\\t%i\\n" % (user_id, contact_id)))
+>>> crawler.crawl()
+
+The users already discovered are kept in a compact L{IdSet}, or - if the
+ids are too sparse for that - a L{BloomFilter}. Together with the frontier,
+they are written to the checkpoint regularly. If the checkpoint exists when
+crawling starts, the crawl resumes from it instead of the seeds. The contacts
+of users being expanded when the checkpoint was written are fetched again,
+so after a resume some edges might be reported twice. Users whose contacts
+couldn't be fetched are retried after a resume.
+"""
+
+import os
+import math
+import base64
+import hashlib
+import threading
+import logging
+from collections import deque
+
+import scapi
+from scapi.util import LazyModule
+from scapi.concurrency import DEFAULT_WORKERS
+
+simplejson = LazyModule("simplejson")
+
+logger = logging.getLogger(__name__)
+
+
+class IdSet(object):
+    """
+    A set of non-negative integer ids, using a single bit per possible id.
+    Compact for densely distributed ids, like those of users.
+    """
+
+    KIND = "ids"
+
+    def __init__(self, bits=None):
+        self._bits = bytearray(bits or "")
+
+    def add(self, id):
+        """
+        @return: True if the id wasn't contained before
+        @rtype: bool
+        """
+        index, mask = id >> 3, 1 << (id & 7)
+        if index >= len(self._bits):
+            self._bits.extend("\0" * max(index + 1 - len(self._bits), len(self._bits)))
+        if self._bits[index] & mask:
+            return False
+        self._bits[index] |= mask
+        return True
+
+    def __contains__(self, id):
+        index = id >> 3
+        return index < len(self._bits) and bool(self._bits[index] & (1 << (id & 7)))
+
+    def state(self):
+        return dict(kind=self.KIND, bits=base64.b64encode(str(self._bits)))
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(base64.b64decode(state["bits"]))
+
+
+class BloomFilter(object):
+    """
+    A probabilistic set of ids. Its size only depends on the expected number of
+    ids, not their values - but with the given probability, ids are regarded as
+    contained although they aren't. A crawler using it misses that fraction of
+    users.
+    """
+
+    KIND = "bloom"
+
+    def __init__(self, capacity, error_rate=0.001, bits=None):
+        """
+        @type capacity: int
+        @param capacity: the expected number of ids
+        @type error_rate: float
+        @param error_rate: the probability of false positives at capacity
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self._bits = bytearray(bits or "\0" * ((self.size + 7) // 8))
+
+    def _positions(self, id):
+        digest = hashlib.md5(str(id)).hexdigest()
+        a, b = int(digest[:16], 16), int(digest[16:], 16)
+        return [(a + i * b) % self.size for i in xrange(self.hashes)]
+
+    def add(self, id):
+        """
+        @return: True if the id wasn't contained before
+        @rtype: bool
+        """
+        added = False
+        for position in self._positions(id):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        return added
+
+    def __contains__(self, id):
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(id))
+
+    def state(self):
+        return dict(kind=self.KIND, capacity=self.capacity, error_rate=self.error_rate,
+                    bits=base64.b64encode(str(self._bits)))
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["capacity"], state["error_rate"], base64.b64decode(state["bits"]))
+
+
+def _load_seen(state):
+    return dict((cls.KIND, cls) for cls in (IdSet, BloomFilter))[state["kind"]].from_state(state)
+
+
+class Crawler(object):
+    """
+    Crawls the contacts of users breadth-first, starting with the seeds.
+    """
+
+    def __init__(self, root, seeds, workers=DEFAULT_WORKERS, max_depth=None, max_users=None,
+                 seen=None, checkpoint=None, checkpoint_interval=100, on_edge=None):
+        """
+        @param root: the root-scope
+        @type root: scapi.Scope
+        @param seeds: the ids of the users to start with
+        @type workers: int
+        @param workers: the number of users whose contacts are fetched concurrently
+        @type max_depth: int
+        @param max_depth: if given, users further away from the seeds aren't expanded
+        @type max_users: int
+        @param max_users: if given, the crawl stops after expanding that many users
+        @param seen: the set of discovered user-ids, defaults to an L{IdSet}
+        @type checkpoint: str
+        @param checkpoint: the file to save the state of the crawl to, and resume from
+        @type checkpoint_interval: int
+        @param checkpoint_interval: the number of users expanded between checkpoints
+        @param on_edge: invoked with the ids of a user and of a contact for every edge
+               found. It's never invoked concurrently. Exceptions it raises are logged.
+        """
+        self.root = root
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_users = max_users
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.on_edge = on_edge
+        self.expanded = 0
+        self.edges = 0
+        # the users whose contacts couldn't be fetched, with their depths
+        self.failed = []
+        self._in_flight = {}
+        self._stopping = False
+        self._condition = threading.Condition()
+        # the workers checkpoint concurrently
+        self._save_lock = threading.Lock()
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self._load(checkpoint)
+        else:
+            self.seen = seen if seen is not None else IdSet()
+            self.frontier = deque()
+            for id in seeds:
+                if self.seen.add(id):
+                    self.frontier.append((id, 0))
+
+    def _load(self, filename):
+        inf = open(filename)
+        try:
+            state = simplejson.load(inf)
+        finally:
+            inf.close()
+        self.seen = _load_seen(state["seen"])
+        # failed users are retried
+        self.frontier = deque(tuple(entry) for entry in state["failed"] + state["frontier"])
+        self.expanded = state["expanded"]
+        self.edges = state["edges"]
+        logger.info("Resuming the crawl with %i users in the frontier", len(self.frontier))
+
+    def save(self, filename=None):
+        """
+        Write the state of the crawl to the checkpoint. The users being expanded
+        are saved as part of the frontier.
+        """
+        filename = filename or self.checkpoint
+        self._save_lock.acquire()
+        try:
+            self._condition.acquire()
+            try:
+                frontier = sorted(self._in_flight.items(), key=lambda entry: entry[1]) + list(self.frontier)
+                state = dict(seen=self.seen.state(), frontier=frontier, failed=list(self.failed),
+                             expanded=self.expanded, edges=self.edges)
+            finally:
+                self._condition.release()
+            tmp = filename + ".tmp"
+            outf = open(tmp, "w")
+            try:
+                simplejson.dump(state, outf)
+            finally:
+                outf.close()
+            # the old checkpoint is only replaced by a complete new one
+            os.rename(tmp, filename)
+        finally:
+            self._save_lock.release()
+
+    def contacts(self, user_id):
+        """
+        @return: the ids of the user's contacts
+        @rtype: list<int>
+        """
+        user = scapi.User(dict(id=user_id), self.root)
+        return [contact.id for contact in user.contacts(__fields__=["id"]) or ()]
+
+    def crawl(self):
+        """
+        Crawl until there are no more users to expand, or max_users
+        have been expanded.
+
+        @return: the number of users expanded, and of edges found
+        @rtype: dict
+        """
+        threads = [threading.Thread(target=self._work) for _ in xrange(self.workers)]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.checkpoint is not None:
+            self.save()
+        return dict(expanded=self.expanded, edges=self.edges, failed=len(self.failed))
+
+    def _next(self):
+        """
+        @return: the next user to expand and its depth, or None if we are done
+        """
+        self._condition.acquire()
+        try:
+            while not self.frontier and self._in_flight and not self._stopping:
+                # the users being expanded might add to the frontier
+                self._condition.wait()
+            if not self.frontier or self._stopping:
+                return None
+            user_id, depth = self.frontier.popleft()
+            self._in_flight[user_id] = depth
+            return user_id, depth
+        finally:
+            self._condition.release()
+
+    def _work(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            user_id, depth = entry
+            try:
+                contacts = self.contacts(user_id)
+            except Exception:
+                logger.warning("Couldn't fetch the contacts of %i", user_id, exc_info=True)
+                contacts = None
+            checkpoint = False
+            self._condition.acquire()
+            try:
+                del self._in_flight[user_id]
+                if contacts is None:
+                    self.failed.append((user_id, depth))
+                else:
+                    self._expanded(user_id, depth, contacts)
+                    checkpoint = self.checkpoint is not None and not self.expanded % self.checkpoint_interval
+            finally:
+                # the other workers might wait for this user's contacts
+                self._condition.notifyAll()
+                self._condition.release()
+            if checkpoint:
+                try:
+                    self.save()
+                except Exception:
+                    # the next checkpoint might succeed, so keep crawling
+                    logger.warning("Couldn't write the checkpoint %s", self.checkpoint, exc_info=True)
+
+    def _expanded(self, user_id, depth, contacts):
+        # invoked with the condition held
+        for contact_id in contacts:
+            self.edges += 1
+            if self.on_edge is not None:
+                try:
+                    self.on_edge(user_id, contact_id)
+                except Exception:
+                    # the edge is counted anyway, so don't lose the contact
+                    logger.warning("on_edge failed for %i -> %i", user_id, contact_id, exc_info=True)
+            if self.seen.add(contact_id) and (self.max_depth is None or depth < self.max_depth):
+                self.frontier.append((contact_id, depth + 1))
+        self.expanded += 1
+        if self.max_users is not None and self.expanded >= self.max_users:
+            self._stopping = True
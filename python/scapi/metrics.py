@@ -0,0 +1,302 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Instrumentation of API-calls.
+
+Every L{scapi.ApiConnector} has an L{Instrumentation}. As long as no sink
+is added to it, nothing is measured. Otherwise, a L{CallRecord} is created
+for every call and passed to all sinks:
+
+>>> histograms = HistogramSink()
+>>> connector.instrumentation.add_sink(histograms)
+>>> sca.me()
+>>> histograms.histogram("me/", "GET", "total").percentile(95)
+"""
+
+import time
+import socket
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class CallRecord(object):
+    """
+    The measurements of a single API-call.
+
+    The timings are in seconds, and contain the phases
+
+     - signing: creating and signing the request
+     - connect: establishing the connection
+     - ttfb: from sending the request until the response-headers arrived,
+       including possible redirects
+     - read: reading the body
+     - decode: decoding the JSON
+     - map: creating our domain-objects
+    """
+
+    PHASES = ("signing", "connect", "ttfb", "read", "decode", "map")
+
+    def __init__(self):
+        self.started = time.time()
+        self.endpoint = None
+        self.http_method = None
+        self.status = None
+        self.redirects = 0
+        self.retries = 0
+        # whether the result was shared with identical concurrent calls
+        self.coalesced = False
+        # the bytes on the wire, and after decompression
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.error = None
+        self.timings = {}
+        self.total = None
+
+    def add_timing(self, phase, started):
+        """
+        Add the time elapsed since started to the given phase.
+
+        @return: the current time, to be used as start of the next phase
+        @rtype: float
+        """
+        now = time.time()
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - started
+        return now
+
+    def finish(self):
+        self.total = time.time() - self.started
+
+    def __repr__(self):
+        return "<CallRecord %s %s status=%r total=%r>" % (self.http_method, self.endpoint,
+                                                          self.status, self.total)
+
+
+class Instrumentation(object):
+    """
+    The registry of sinks of a connector. Sinks are objects with a
+    method record(call_record).
+    """
+
+    def __init__(self):
+        self.sinks = []
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def start(self):
+        """
+        @return: a new CallRecord if there are sinks, None otherwise.
+        @rtype: CallRecord
+        """
+        if self.sinks:
+            return CallRecord()
+        return None
+
+    def emit(self, record):
+        record.finish()
+        for sink in self.sinks:
+            try:
+                sink.record(record)
+            except Exception:
+                logger.exception("Sink %r failed", sink)
+
+    def state_changed(self, component, key, state):
+        """
+        Report the state-change of a component like a circuit-breaker to the
+        sinks having a method state_changed(component, key, state).
+        """
+        for sink in self.sinks:
+            state_changed = getattr(sink, "state_changed", None)
+            if state_changed is None:
+                continue
+            try:
+                state_changed(component, key, state)
+            except Exception:
+                logger.exception("Sink %r failed", sink)
+
+
+class Histogram(object):
+    """
+    A simple in-memory histogram, keeping the last max_samples values.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.values = deque(maxlen=max_samples)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.values.append(value)
+
+    def percentile(self, p):
+        """
+        @param p: the percentile, between 0 and 100
+        @return: the value below which p percent of the kept values fall, or None
+        """
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        index = int(round((len(values) - 1) * p / 100.0))
+        return values[index]
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.sum / self.count
+
+    def summary(self):
+        return dict(count=self.count, mean=self.mean, p50=self.percentile(50),
+                    p95=self.percentile(95), p99=self.percentile(99))
+
+
+class HistogramSink(object):
+    """
+    Collects the timings, the received bytes and the status codes per
+    endpoint and HTTP-method in memory.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._histograms = {}
+        self.statuses = {}
+        # the current states of components, per component and key
+        self.states = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        key = record.endpoint, record.http_method
+        self._lock.acquire()
+        try:
+            for phase, value in record.timings.iteritems():
+                self._add(key + (phase,), value)
+            self._add(key + ("total",), record.total)
+            self._add(key + ("bytes",), record.bytes_received)
+            self._add(key + ("bytes_decoded",), record.bytes_decoded)
+            self._add(key + ("redirects",), record.redirects)
+            self._add(key + ("retries",), record.retries)
+            statuses = self.statuses.setdefault(key, {})
+            statuses[record.status] = statuses.get(record.status, 0) + 1
+        finally:
+            self._lock.release()
+
+    def state_changed(self, component, key, state):
+        self.states[component, key] = state
+
+    def _add(self, key, value):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.max_samples)
+        histogram.add(value)
+
+    def histogram(self, endpoint, http_method, name):
+        """
+        @param name: either one of the phases of L{CallRecord}, or "total", "bytes", "bytes_decoded",
+               "redirects" or "retries"
+        @rtype: Histogram
+        """
+        return self._histograms.get((endpoint, http_method, name))
+
+    def summary(self):
+        """
+        @return: the summaries of all histograms
+        @rtype: dict<tuple(str, str, str), dict>
+        """
+        return dict((key, h.summary()) for key, h in self._histograms.iteritems())
+
+
+class CallbackSink(object):
+    """
+    Passes every record to a callback.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, record):
+        self.callback(record)
+
+
+class StatsdSink(object):
+    """
+    Emits the records as StatsD-lines over UDP, e.g.
+
+      scapi.users._.contacts.GET.ttfb:12|ms
+      scapi.users._.contacts.GET.status.200:1|c
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="scapi"):
+        self.address = host, port
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def lines(self, record):
+        endpoint = (record.endpoint or "unknown").strip("/").replace("/", ".").replace("*", "_")
+        base = "%s.%s.%s" % (self.prefix, endpoint, record.http_method)
+        res = ["%s.%s:%i|ms" % (base, phase, value * 1000) for phase, value in sorted(record.timings.items())]
+        res.append("%s.total:%i|ms" % (base, record.total * 1000))
+        res.append("%s.bytes:%i|c" % (base, record.bytes_received))
+        res.append("%s.bytes_decoded:%i|c" % (base, record.bytes_decoded))
+        if record.retries:
+            res.append("%s.retries:%i|c" % (base, record.retries))
+        res.append("%s.status.%s:1|c" % (base, record.status))
+        return res
+
+    def record(self, record):
+        try:
+            self._socket.sendto("\n".join(self.lines(record)), self.address)
+        except socket.error:
+            logger.debug("Couldn't send to statsd", exc_info=True)
+
+    def state_changed(self, component, key, state):
+        """
+        Count the state-changes, e.g. scapi.circuit.tracks._.open:1|c
+        """
+        name = str(key[-1]).strip("/").replace("/", ".").replace("*", "_")
+        try:
+            self._socket.sendto("%s.%s.%s.%s:1|c" % (self.prefix, component, name, state), self.address)
+        except socket.error:
+            logger.debug("Couldn't send to statsd", exc_info=True)
+
+    def gauge(self, name, value):
+        """
+        Emit a gauge, e.g. the current concurrency-limit.
+        """
+        try:
+            self._socket.sendto("%s.%s:%s|g" % (self.prefix, name, value), self.address)
+        except socket.error:
+            logger.debug("Couldn't send to statsd", exc_info=True)
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,233 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+A profiler attributing the time spent in the SCAPI to its subsystems:
+
+ - call: Scope._call, which contains everything else - including the network
+ - authentication: signing requests
+ - MultipartPostHandler: encoding uploads
+ - decode: decoding JSON
+ - _map: creating domain-objects from the decoded JSON, including the
+   nested resources hydrated on attribute-access
+ - __getattr__: attribute-access on resources
+
+Use it like this:
+
+>>> profiler = Profiler()
+>>> profiler.start()
+>>> ... # do the work
+>>> profiler.stop()
+>>> print profiler.format_summary()
+>>> profiler.dump_collapsed("scapi.folded")
+
+The collapsed-stack file can be turned into a flame graph, e.g. using
+flamegraph.pl.
+
+In the deterministic mode (the default), the subsystems' functions are
+wrapped while the profiler runs, and the time spent in them is measured. In
+the sampling mode, the stacks of all threads are inspected periodically
+instead, which has less overhead but is less precise.
+
+Profiling is global - there can only be one profiler running at a time.
+"""
+
+import sys
+import time
+import threading
+import logging
+
+import scapi
+import scapi.authentication
+
+logger = logging.getLogger(__name__)
+
+
+def patch_points():
+    """
+    @return: the functions attributed to subsystems, as tuples (owner, attribute-name, subsystem)
+    @rtype: list<tuple(type, str, str)>
+    """
+    from scapi.MultipartPostHandler import MultipartPostHandler
+    return [
+        (scapi.Scope, "_call", "call"),
+        (scapi.authentication.OAuthAuthenticator, "augment_request", "authentication"),
+        (scapi.authentication.BasicAuthenticator, "augment_request", "authentication"),
+        (MultipartPostHandler, "http_request", "MultipartPostHandler"),
+        (scapi.Scope, "_decode", "decode"),
+        (scapi.Scope, "_map", "_map"),
+        # every resource is created here, also those hydrated later on
+        (scapi.ApiConnector, "_resource", "_map"),
+        (scapi.RESTBase, "__getattr__", "__getattr__"),
+        ]
+
+
+_active = None
+
+
+class Profiler(object):
+
+    DETERMINISTIC = "deterministic"
+    SAMPLING = "sampling"
+
+    def __init__(self, mode=DETERMINISTIC, interval=0.005, clock=time.time):
+        """
+        @param mode: either L{DETERMINISTIC} or L{SAMPLING}
+        @type interval: float
+        @param interval: the seconds between two samples, in the sampling-mode
+        @param clock: the clock used in the deterministic mode. time.clock
+               measures CPU-time, but only for single-threaded processes.
+        """
+        if mode not in (self.DETERMINISTIC, self.SAMPLING):
+            raise ValueError("Unknown profiler mode: %s" % mode)
+        self.mode = mode
+        self.interval = interval
+        self.clock = clock
+        # the self-time (or samples) of each stack of subsystems
+        self.stacks = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = []
+        self._sampler = None
+        self._running = False
+
+    def start(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError("There is already a profiler running")
+        _active = self
+        self._running = True
+        points = patch_points()
+        if self.mode == self.DETERMINISTIC:
+            for owner, name, subsystem in points:
+                original = owner.__dict__[name]
+                self._originals.append((owner, name, original))
+                setattr(owner, name, self._wrap(original, subsystem))
+        else:
+            codes = dict((owner.__dict__[name].func_code, subsystem) for owner, name, subsystem in points)
+            self._sampler = threading.Thread(target=self._sample, args=(codes,))
+            self._sampler.setDaemon(True)
+            self._sampler.start()
+
+    def stop(self):
+        global _active
+        self._running = False
+        for owner, name, original in self._originals:
+            setattr(owner, name, original)
+        self._originals = []
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        _active = None
+
+    def _wrap(self, func, subsystem):
+        profiler = self
+        def wrapper(*args, **kwargs):
+            return profiler._measure(subsystem, func, args, kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    def _measure(self, subsystem, func, args, kwargs):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        # the entries are [subsystem, time spent in nested subsystems]
+        entry = [subsystem, 0.0]
+        stack.append(entry)
+        path = tuple([e[0] for e in stack])
+        started = self.clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = self.clock() - started
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            self._add(path, elapsed - entry[1])
+
+    def _add(self, path, value):
+        self._lock.acquire()
+        try:
+            self.stacks[path] = self.stacks.get(path, 0) + value
+            self.calls[path] = self.calls.get(path, 0) + 1
+        finally:
+            self._lock.release()
+
+    def _sample(self, codes):
+        own = threading.currentThread().ident
+        while self._running:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                path = []
+                while frame is not None:
+                    subsystem = codes.get(frame.f_code)
+                    if subsystem is not None:
+                        path.append(subsystem)
+                    frame = frame.f_back
+                if path:
+                    path.reverse()
+                    self._add(tuple(path), 1)
+            time.sleep(self.interval)
+
+    def summary(self):
+        """
+        @return: per subsystem the self-time (or number of samples), and the
+                 number of calls (or samples again)
+        @rtype: dict<str, dict>
+        """
+        res = {}
+        for path, value in self.stacks.items():
+            entry = res.setdefault(path[-1], dict(self=0, calls=0))
+            entry["self"] += value
+            entry["calls"] += self.calls[path]
+        return res
+
+    def format_summary(self):
+        unit = {self.DETERMINISTIC : "seconds", self.SAMPLING : "samples"}[self.mode]
+        summary = self.summary()
+        total = sum(entry["self"] for entry in summary.values()) or 1
+        lines = ["%-24s %12s %8s %10s" % ("subsystem", unit, "%", "calls")]
+        for subsystem, entry in sorted(summary.items(), key=lambda item: -item[1]["self"]):
+            lines.append("%-24s %12.6g %8.1f %10i" % (subsystem, entry["self"],
+                                                      100.0 * entry["self"] / total, entry["calls"]))
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """
+        @return: the stacks in the collapsed format understood by flamegraph.pl, with
+                 microseconds (or samples) as values.
+        @rtype: list<str>
+        """
+        factor = 1
+        if self.mode == self.DETERMINISTIC:
+            factor = 1000000
+        return ["%s %i" % (";".join(("scapi",) + path), value * factor)
+                for path, value in sorted(self.stacks.items())]
+
+    def dump_collapsed(self, filename):
+        outf = open(filename, "w")
+        try:
+            for line in self.collapsed():
+                outf.write(line + "\n")
+        finally:
+            outf.close()
@@ -0,0 +1,281 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Client-side rate-limiting of API-calls.
+
+Pass a L{RateLimiter} to the L{scapi.ApiConnector}, and calls wait for
+their turn before they are sent:
+
+>>> limiter = RateLimiter(read=(10.0, 20), write=(2.0, 5), upload=(0.1, 1))
+>>> sca = scapi.Scope(scapi.ApiConnector(host=API_HOST, authenticator=authenticator,
+...                                      rate_limiter=limiter))
+
+The budgets are token-buckets per identity - the consumer and token, or user -
+with separate ones for reads, writes and uploads. Several processes working
+for the same identity can share their budgets by using the same directory:
+
+>>> limiter = RateLimiter(directory="/var/run/scapi")
+
+When the server throttles us anyway (429 or 503), the rate is halved, and
+afterwards slowly raised again up to the configured one.
+"""
+
+import os
+import time
+import urllib2
+import hashlib
+import threading
+import logging
+
+from scapi.retry import _retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """
+    Raised by non-blocking L{RateLimiter}s if a call would have to wait.
+    """
+
+    def __init__(self, delay):
+        Exception.__init__(self, "Rate limited, retry in %.2f seconds" % delay)
+        self.delay = delay
+
+
+class TokenBucket(object):
+    """
+    A token-bucket, filling up with rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate, capacity, clock=time.time):
+        self.base_rate = self.rate = float(rate)
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+        # no tokens are handed out before this time
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def _synchronized(self, func):
+        self._lock.acquire()
+        try:
+            return func()
+        finally:
+            self._lock.release()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1, block=True):
+        """
+        Take tokens from the bucket.
+
+        If there aren't enough, they are taken in advance if block is True - so
+        callers are served in the order they arrived. Otherwise nothing is taken.
+
+        @return: the seconds to wait until the tokens are available
+        @rtype: float
+        """
+        def reserve():
+            now = self.clock()
+            self._refill(now)
+            delay = max(0.0, self.resume_at - now)
+            if self.tokens < tokens:
+                delay = max(delay, (tokens - self.tokens) / self.rate)
+            if block or not delay:
+                self.tokens -= tokens
+            return delay
+        return self._synchronized(reserve)
+
+    def throttle(self, factor, min_rate, pause=None):
+        """
+        Lower the rate, and empty the bucket.
+
+        @param pause: if given, the seconds no tokens are handed out at all
+        """
+        def throttle():
+            now = self.clock()
+            self._refill(now)
+            self.rate = max(min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, 0.0)
+            if pause is not None:
+                self.resume_at = max(self.resume_at, now + pause)
+        self._synchronized(throttle)
+
+    def recover(self, step):
+        """
+        Raise the rate by step, up to the initial rate.
+        """
+        def recover():
+            self.rate = min(self.base_rate, self.rate + step)
+        if self.rate < self.base_rate:
+            self._synchronized(recover)
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    A L{TokenBucket} whose state lives in a file, so that it can be shared
+    between processes. The file is locked while it's used.
+    """
+
+    def __init__(self, filename, rate, capacity, clock=time.time):
+        TokenBucket.__init__(self, rate, capacity, clock)
+        self.filename = filename
+
+    def _synchronized(self, func):
+        import fcntl
+        self._lock.acquire()
+        try:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                state = os.read(fd, 256).split()
+                if len(state) == 4:
+                    self.tokens, self.updated, self.rate, self.resume_at = [float(v) for v in state]
+                res = func()
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, "%r %r %r %r" % (self.tokens, self.updated, self.rate, self.resume_at))
+                return res
+            finally:
+                # closing releases the lock
+                os.close(fd)
+        finally:
+            self._lock.release()
+
+    def recover(self, step):
+        # the rate might have been lowered by another process
+        self._synchronized(lambda: setattr(self, "rate", min(self.base_rate, self.rate + step)))
+
+
+class RateLimiter(object):
+    """
+    Limits the rate of calls per identity, with separate budgets for
+    reads, writes and uploads.
+    """
+
+    READ = "read"
+    WRITE = "write"
+    UPLOAD = "upload"
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, read=(10.0, 20), write=(2.0, 5), upload=(0.2, 1), directory=None,
+                 block=True, min_rate_factor=0.1, recovery=0.05, sleep=time.sleep, clock=time.time):
+        """
+        @param read: the budget for GETs, as tuple (calls per second, burst)
+        @param write: the budget for POSTs, PUTs and DELETEs
+        @param upload: the budget for calls uploading files
+        @type directory: str
+        @param directory: if given, the budgets are kept in files in this
+               directory, and shared with all processes using it
+        @type block: bool
+        @param block: if True, calls wait for their turn. Otherwise they
+               raise L{RateLimited}.
+        @type min_rate_factor: float
+        @param min_rate_factor: throttling never lowers a rate below this fraction of the configured one
+        @type recovery: float
+        @param recovery: the fraction of the configured rate a throttled rate is raised by per successful call
+        """
+        self.budgets = {self.READ : read, self.WRITE : write, self.UPLOAD : upload}
+        self.directory = directory
+        self.block = block
+        self.min_rate_factor = min_rate_factor
+        self.recovery = recovery
+        self.sleep = sleep
+        self.clock = clock
+        self.waited = 0.0
+        self.throttled = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def budget(self, http_method, use_multipart):
+        """
+        @return: the budget a call is charged to
+        """
+        if use_multipart:
+            return self.UPLOAD
+        if http_method == "GET":
+            return self.READ
+        return self.WRITE
+
+    def bucket(self, identity, budget):
+        """
+        @return: the bucket of the identity's budget
+        @rtype: TokenBucket
+        """
+        key = identity, budget
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._lock.acquire()
+            try:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate, capacity = self.budgets[budget]
+                    if self.directory is None:
+                        bucket = TokenBucket(rate, capacity, self.clock)
+                    else:
+                        name = "%s-%s.bucket" % (hashlib.md5(str(identity)).hexdigest(), budget)
+                        bucket = FileTokenBucket(os.path.join(self.directory, name), rate, capacity,
+                                                 self.clock)
+                    self._buckets[key] = bucket
+            finally:
+                self._lock.release()
+        return bucket
+
+    def acquire(self, identity, budget):
+        """
+        Wait until a call may be made.
+
+        @raise RateLimited: if the limiter doesn't block, and the call would have to wait
+        """
+        delay = self.bucket(identity, budget).reserve(1, self.block)
+        if delay > 0:
+            if not self.block:
+                raise RateLimited(delay)
+            logger.debug("Waiting %.2f seconds for the %s-budget", delay, budget)
+            self._lock.acquire()
+            try:
+                self.waited += delay
+            finally:
+                self._lock.release()
+            self.sleep(delay)
+
+    def succeeded(self, identity, budget):
+        rate = self.budgets[budget][0]
+        self.bucket(identity, budget).recover(rate * self.recovery)
+
+    def failed(self, identity, budget, exception):
+        """
+        Lower the rate if the server throttled us.
+        """
+        if not isinstance(exception, urllib2.HTTPError) or exception.code not in self.THROTTLE_STATUSES:
+            return
+        rate = self.budgets[budget][0]
+        logger.info("Throttled by the server with %i, lowering the %s-rate", exception.code, budget)
+        self.bucket(identity, budget).throttle(0.5, rate * self.min_rate_factor, _retry_after(exception))
+        self._lock.acquire()
+        try:
+            self.throttled += 1
+        finally:
+            self._lock.release()
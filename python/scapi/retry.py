@@ -0,0 +1,192 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Retrying failed API-calls.
+
+Pass a L{RetryPolicy} to the L{scapi.ApiConnector}, and transient failures -
+server-errors, throttling and dropped connections - are retried:
+
+>>> policy = RetryPolicy(max_attempts=5)
+>>> sca = scapi.Scope(scapi.ApiConnector(host=API_HOST, authenticator=authenticator,
+...                                      retry=policy))
+>>> ... # do the work
+>>> policy.counters()
+{'retries': 3, 'recovered': 2, 'gave_up': 0, 'reasons': {503: 2, 'URLError': 1}}
+
+Every attempt is a freshly signed request, so OAuth-nonces and -timestamps
+aren't reused.
+"""
+
+import time
+import random
+import socket
+import httplib
+import urllib2
+import threading
+import logging
+from email.utils import parsedate_tz, mktime_tz
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when to retry a failed call.
+
+    Only idempotent methods are retried, which for the API are GET, PUT and
+    DELETE. POSTs create resources, and retrying them might create duplicates.
+    Uploads are never retried, as the files they send might have been consumed
+    already.
+
+    The delays grow exponentially with the attempts, and are randomized
+    ("full jitter") so that clients failing together don't retry together.
+    A Retry-After-header of the server takes precedence.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30.0, max_retry_after=120.0,
+                 statuses=RETRY_STATUSES, methods=IDEMPOTENT_METHODS,
+                 sleep=time.sleep, random=random.random):
+        """
+        @type max_attempts: int
+        @param max_attempts: the maximum number of attempts per call, including the first one
+        @type backoff: float
+        @param backoff: the base of the delays, in seconds. The n-th retry waits up to backoff * 2 ** (n - 1).
+        @type max_backoff: float
+        @param max_backoff: the upper bound of the computed delays
+        @type max_retry_after: float
+        @param max_retry_after: the upper bound of delays requested by the server
+        @param statuses: the HTTP-statuses worth retrying
+        @param methods: the HTTP-methods that are safe to retry
+        @param sleep: the function used to wait
+        @param random: the source of randomness for the jitter, returning floats in [0, 1)
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.statuses = statuses
+        self.methods = methods
+        self.sleep = sleep
+        self.random = random
+        self.retries = 0
+        self.recovered = 0
+        self.gave_up = 0
+        self.reasons = {}
+        self._lock = threading.Lock()
+
+    def _reason(self, exception):
+        """
+        @return: the status for HTTP-errors, the exception's class-name for other
+                 transient errors, or None if the exception isn't transient.
+        """
+        if isinstance(exception, urllib2.HTTPError):
+            if exception.code in self.statuses:
+                return exception.code
+            return None
+        if isinstance(exception, (urllib2.URLError, httplib.HTTPException, socket.error)):
+            return exception.__class__.__name__
+        return None
+
+    def delay(self, attempt, exception):
+        """
+        @param attempt: the number of the failed attempt, starting with 1
+        @return: the seconds to wait before the next attempt
+        @rtype: float
+        """
+        retry_after = _retry_after(exception)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return self.random() * min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+
+    def retry(self, http_method, use_multipart, exception, attempt):
+        """
+        Decide whether to retry a failed attempt. If so, wait accordingly.
+
+        @param http_method: the HTTP-method of the call
+        @param use_multipart: whether the call uploads files
+        @param exception: the exception the attempt failed with
+        @param attempt: the number of the failed attempt, starting with 1
+        @return: True if the call should be attempted again
+        @rtype: bool
+        """
+        reason = self._reason(exception)
+        if reason is None or use_multipart or http_method not in self.methods:
+            return False
+        self._lock.acquire()
+        try:
+            if attempt >= self.max_attempts:
+                self.gave_up += 1
+                return False
+            self.retries += 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        finally:
+            self._lock.release()
+        delay = self.delay(attempt, exception)
+        logger.info("Attempt %i of a %s failed with %s, retrying in %.2f seconds",
+                    attempt, http_method, reason, delay)
+        self.sleep(delay)
+        return True
+
+    def succeeded(self, attempts):
+        """
+        Called after a call succeeded in the given number of attempts.
+        """
+        if attempts > 1:
+            self._lock.acquire()
+            try:
+                self.recovered += 1
+            finally:
+                self._lock.release()
+
+    def counters(self):
+        """
+        @return: the number of retries, of calls that succeeded after retrying, of calls
+                 that failed despite retrying, and the retries per reason
+        @rtype: dict
+        """
+        self._lock.acquire()
+        try:
+            return dict(retries=self.retries, recovered=self.recovered, gave_up=self.gave_up,
+                        reasons=dict(self.reasons))
+        finally:
+            self._lock.release()
+
+
+def _retry_after(exception):
+    """
+    @return: the seconds the server asked us to wait, or None
+    """
+    headers = getattr(exception, "hdrs", None)
+    if headers is None:
+        return None
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
@@ -0,0 +1,346 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Incremental mirroring of users' tracks, favorites and playlists, and the
+comments of their tracks, into a SQLite-database:
+
+>>> mirror = Mirror("mirror.db")
+>>> synchronizer = Synchronizer(sca, mirror)
+>>> outcomes = synchronizer.sync_users(user_ids, workers=4)
+>>> mirror.tombstones(since=last_night)
+[('users/1234', 'tracks', 4711, 1262304000.0)]
+
+Lists are served newest-first, so a sync walks them only until it meets
+a few records it already knows, unchanged. New records show up in front,
+so only if records were deleted, the number of records then doesn't add up
+to the counts of the user. In that case the whole list is walked, and the
+records missing from it are marked as deleted (tombstones). So a sync costs
+about one request per list that didn't change.
+
+Changes to older records go unnoticed, as the walk stops before reaching
+them. A full sync, which should be run now and then, catches them:
+
+>>> synchronizer.sync_user(1234, full=True)
+"""
+
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+from scapi.util import LazyModule
+from scapi.concurrency import run_concurrently, DEFAULT_WORKERS
+
+simplejson = LazyModule("simplejson")
+
+logger = logging.getLogger(__name__)
+
+INSERTED = "inserted"
+UPDATED = "updated"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    deleted_at REAL,
+    PRIMARY KEY (kind, id)
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    owner TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    synced_at REAL NOT NULL,
+    deleted_at REAL,
+    PRIMARY KEY (owner, collection, id)
+);
+CREATE INDEX IF NOT EXISTS memberships_deleted_at ON memberships (deleted_at);
+"""
+
+
+class Mirror(object):
+    """
+    The database of mirrored resources, and of the lists they are members of,
+    like the favorites of a user. A list is identified by its owner, e.g.
+    "users/1234", and its name.
+
+    Nothing is ever removed; deleted resources and memberships are kept as
+    tombstones, with the time of their deletion.
+    """
+
+    def __init__(self, filename, clock=time.time):
+        self.clock = clock
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.RLock()
+
+    def close(self):
+        self._db.close()
+
+    def transaction(self, func):
+        """
+        Invoke func in a transaction, which is committed if it succeeds,
+        and rolled back otherwise.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                res = func()
+            except:
+                self._db.rollback()
+                raise
+            self._db.commit()
+            return res
+        finally:
+            self._lock.release()
+
+    def _query(self, sql, *args):
+        self._lock.acquire()
+        try:
+            return self._db.execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+
+    def resource(self, kind, id):
+        """
+        @return: the data of the resource, or None if it's unknown or deleted
+        @rtype: dict
+        """
+        rows = self._query("SELECT data FROM resources WHERE kind = ? AND id = ? AND deleted_at IS NULL",
+                           kind, id)
+        if rows:
+            return simplejson.loads(rows[0][0])
+        return None
+
+    def members(self, owner, collection):
+        """
+        @return: the ids of the resources in the list, except the deleted ones
+        @rtype: list<int>
+        """
+        return [row[0] for row in self._query("SELECT id FROM memberships WHERE owner = ? AND "
+                                              "collection = ? AND deleted_at IS NULL ORDER BY id",
+                                              owner, collection)]
+
+    def tombstones(self, since=None):
+        """
+        @param since: if given, only deletions after this time are returned
+        @return: the deleted memberships, as tuples (owner, collection, id, deleted_at)
+        @rtype: list<tuple>
+        """
+        return self._query("SELECT owner, collection, id, deleted_at FROM memberships "
+                           "WHERE deleted_at > ? ORDER BY deleted_at, owner, collection, id", since or 0.0)
+
+    def put(self, kind, id, data, fingerprint):
+        """
+        Store the data of a resource.
+
+        @return: L{INSERTED}, L{UPDATED}, or None if the fingerprint didn't change
+        """
+        now = self.clock()
+        rows = self._db.execute("SELECT fingerprint, deleted_at FROM resources WHERE kind = ? AND id = ?",
+                                (kind, id)).fetchall()
+        encoded = simplejson.dumps(data)
+        if not rows:
+            self._db.execute("INSERT INTO resources VALUES (?, ?, ?, ?, ?, NULL)",
+                             (kind, id, encoded, fingerprint, now))
+            return INSERTED
+        # the data is refreshed in any case, as it includes ignored fields like counters
+        self._db.execute("UPDATE resources SET data = ?, fingerprint = ?, synced_at = ?, deleted_at = NULL "
+                         "WHERE kind = ? AND id = ?", (encoded, fingerprint, now, kind, id))
+        if rows[0][0] != fingerprint or rows[0][1] is not None:
+            return UPDATED
+        return None
+
+    def add_member(self, owner, collection, id):
+        """
+        @return: True if the resource wasn't a member of the list before
+        @rtype: bool
+        """
+        now = self.clock()
+        rows = self._db.execute("SELECT deleted_at FROM memberships WHERE owner = ? AND collection = ? AND id = ?",
+                                (owner, collection, id)).fetchall()
+        if not rows:
+            self._db.execute("INSERT INTO memberships VALUES (?, ?, ?, ?, NULL)", (owner, collection, id, now))
+            return True
+        self._db.execute("UPDATE memberships SET synced_at = ?, deleted_at = NULL WHERE owner = ? AND "
+                         "collection = ? AND id = ?", (now, owner, collection, id))
+        return rows[0][0] is not None
+
+    def remove_member(self, owner, collection, id, kind=None):
+        """
+        Mark the membership as deleted.
+
+        @param kind: if given, the resource itself is marked as deleted, too
+        """
+        now = self.clock()
+        self._db.execute("UPDATE memberships SET deleted_at = ? WHERE owner = ? AND collection = ? AND id = ?",
+                         (now, owner, collection, id))
+        if kind is not None:
+            self.remove(kind, id)
+
+    def remove(self, kind, id):
+        """
+        Mark the resource as deleted.
+        """
+        self._db.execute("UPDATE resources SET deleted_at = ? WHERE kind = ? AND id = ? AND deleted_at IS NULL",
+                         (self.clock(), kind, id))
+
+
+class Synchronizer(object):
+    """
+    Brings the L{Mirror} up to date with the API.
+    """
+
+    # the lists of a user, with the fields of the user counting their members,
+    # and whether the user owns the resources in them
+    COLLECTIONS = (("tracks", "track_count", True),
+                   ("playlists", "playlist_count", True),
+                   ("favorites", "public_favorites_count", False))
+
+    # fields changing all the time, which don't make a resource count as changed
+    IGNORED_FIELDS = ("playback_count", "download_count", "favoritings_count", "comment_count",
+                      "followers_count", "followings_count", "online")
+
+    def __init__(self, root, mirror, overlap=3, comments=True, ignored_fields=IGNORED_FIELDS):
+        """
+        @param root: the root-scope
+        @type root: scapi.Scope
+        @type mirror: Mirror
+        @type overlap: int
+        @param overlap: the number of known, unchanged resources in a row ending a walk
+        @type comments: bool
+        @param comments: if True, the comments of the users' tracks are mirrored, too
+        @param ignored_fields: the fields not considered when comparing resources
+        """
+        self.root = root
+        self.mirror = mirror
+        self.overlap = overlap
+        self.comments = comments
+        self.ignored_fields = frozenset(ignored_fields)
+
+    def fingerprint(self, data):
+        data = dict((key, value) for key, value in data.iteritems() if key not in self.ignored_fields)
+        return hashlib.md5(simplejson.dumps(data, sort_keys=True)).hexdigest()
+
+    def sync_users(self, user_ids, workers=DEFAULT_WORKERS, full=False):
+        """
+        Sync several users concurrently.
+
+        @return: the outcomes, with the results of L{sync_user}
+        @rtype: list<scapi.concurrency.Outcome>
+        """
+        return run_concurrently(lambda user_id: self.sync_user(user_id, full), user_ids, workers)
+
+    def sync_user(self, user_id, full=False):
+        """
+        Sync the tracks, playlists and favorites of a user. If the user
+        was deleted, so are the lists, and the tracks and playlists in them.
+
+        @type full: bool
+        @param full: if True, all lists are walked completely
+        @return: the number of resources fetched, inserted, updated and deleted,
+                 and of lists walked completely
+        @rtype: dict
+        """
+        stats = dict(fetched=0, inserted=0, updated=0, deleted=0, full_walks=0)
+        user = self.root.User.get(user_id)
+        if user is None:
+            self.mirror.transaction(lambda: self._remove_user(user_id, stats))
+            logger.info("User %i was deleted: %r", user_id, stats)
+            return stats
+        data = user._as_dict()
+        self.mirror.transaction(lambda: self.mirror.put("users", user_id, data, self.fingerprint(data)))
+        for collection, count_field, owned in self.COLLECTIONS:
+            changed = self._sync_list(user, collection, "users/%i" % user_id, data.get(count_field),
+                                      owned, full, stats)
+            for track, comment_count in changed:
+                self._sync_list(track, "comments", track._scope(), comment_count, True, full, stats)
+        logger.info("Synced user %i: %r", user_id, stats)
+        return stats
+
+    def _remove_user(self, user_id, stats):
+        mirror = self.mirror
+        owner_key = "users/%i" % user_id
+        mirror.remove("users", user_id)
+        for collection, _, owned in self.COLLECTIONS:
+            for id in mirror.members(owner_key, collection):
+                if collection == "tracks":
+                    for comment_id in mirror.members("tracks/%i" % id, "comments"):
+                        mirror.remove_member("tracks/%i" % id, "comments", comment_id, "comments")
+                        stats["deleted"] += 1
+                mirror.remove_member(owner_key, collection, id, owned and collection or None)
+                stats["deleted"] += 1
+
+    def _sync_list(self, owner, collection, owner_key, count, owned, full, stats):
+        """
+        Sync one list of the owner.
+
+        @param count: the number of resources the list should contain, or None
+        @param owned: whether the resources are deleted along with their membership
+        @return: the tracks fetched whose comments need to be synced, with their comment-counts
+        """
+        complete, changed = self._walk(owner, collection, owner_key, owned, full, stats)
+        if not complete and count is not None and len(self.mirror.members(owner_key, collection)) != count:
+            logger.debug("%s of %s don't add up to %i, walking them completely", collection, owner_key, count)
+            complete, changed = self._walk(owner, collection, owner_key, owned, True, stats)
+        return changed
+
+    def _walk(self, owner, collection, owner_key, owned, full, stats):
+        """
+        @return: whether the list was walked completely, and the tracks
+                 whose comments need to be synced
+        """
+        mirror = self.mirror
+        seen = set()
+        changed = []
+        unchanged = 0
+        for resource in getattr(owner, collection)() or ():
+            stats["fetched"] += 1
+            data = resource._as_dict()
+            seen.add(resource.id)
+            fingerprint = self.fingerprint(data)
+            # the database isn't locked while fetching the next page
+            state, added = mirror.transaction(lambda: (mirror.put(resource.KIND, resource.id, data, fingerprint),
+                                                       mirror.add_member(owner_key, collection, resource.id)))
+            if state is not None:
+                stats[state] += 1
+            comment_count = data.get("comment_count", 0)
+            if self.comments and collection == "tracks" and \
+                   (full or len(mirror.members(resource._scope(), "comments")) != comment_count):
+                changed.append((resource, comment_count))
+            if state is None and not added:
+                unchanged += 1
+                if not full and unchanged >= self.overlap:
+                    return False, changed
+            else:
+                unchanged = 0
+        stats["full_walks"] += 1
+        def remove():
+            for id in mirror.members(owner_key, collection):
+                if id not in seen:
+                    # owned lists are named like the kind of their resources
+                    mirror.remove_member(owner_key, collection, id, owned and collection or None)
+                    stats["deleted"] += 1
+        mirror.transaction(remove)
+        return True, changed
@@ -0,0 +1,215 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Tailing the events of the authenticated user:
+
+>>> def handle(event):
+...     print event.type, event.id
+>>> tailer = EventTailer(sca, handler=handle, cursor="events.cursor")
+>>> tailer.run()
+
+Or, to process them in other threads, into a queue:
+
+>>> events = Queue.Queue(maxsize=100)
+>>> tailer = EventTailer(sca, queue=events, cursor="events.cursor")
+>>> threading.Thread(target=tailer.run).start()
+
+Events are listed newest-first, so every poll only fetches pages until it
+reaches the newest event delivered before - the cursor. Without a cursor,
+tailing starts with the newest event. New events are delivered
+oldest-first. If the queue is full, or the handler slow, polling waits -
+so a slow consumer isn't flooded.
+
+The cursor is written to its file after the events are delivered. If the
+process dies in between, the events are delivered again after a restart.
+
+The interval between polls adapts to the traffic: it's shortened down to
+min_interval while there are new events, and lengthened up to
+max_interval while there aren't, or polling fails.
+"""
+
+import os
+import threading
+import logging
+from collections import deque
+
+from scapi.util import LazyModule
+
+simplejson = LazyModule("simplejson")
+
+logger = logging.getLogger(__name__)
+
+
+class EventTailer(object):
+    """
+    Polls the events of a scope, and delivers the new ones.
+    """
+
+    def __init__(self, scope, handler=None, queue=None, cursor=None, min_interval=5.0, max_interval=300.0,
+                 factor=2.0, page_size=None, remember=1000, sleep=None):
+        """
+        @param scope: the scope listing the events, usually the root-scope
+        @type scope: scapi.Scope
+        @param handler: invoked with every new event
+        @type queue: Queue.Queue
+        @param queue: if given instead of the handler, the new events are put into it
+        @type cursor: str
+        @param cursor: the file the cursor is persisted in. If it exists,
+               tailing continues after the event it points to.
+        @type min_interval: float
+        @param min_interval: the minimum seconds between polls
+        @type max_interval: float
+        @param max_interval: the maximum seconds between polls
+        @type factor: float
+        @param factor: the factor the interval is changed by after every poll
+        @type page_size: int
+        @param page_size: if given, the number of events fetched per request
+        @type remember: int
+        @param remember: the number of delivered event-ids kept for deduplication
+        @param sleep: the function used to wait between polls. By default,
+               waiting ends early if L{stop} is invoked.
+        """
+        if (handler is None) == (queue is None):
+            raise ValueError("Pass either a handler or a queue")
+        if handler is None:
+            handler = queue.put
+        self.scope = scope
+        self.handler = handler
+        self.cursor_file = cursor
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.page_size = page_size
+        self._stopped = threading.Event()
+        self.sleep = sleep or self._stopped.wait
+        self.interval = min_interval
+        self.delivered = 0
+        self.polls = 0
+        self.cursor = None
+        self._recent = deque(maxlen=remember)
+        self._recent_ids = set()
+        if cursor is not None and os.path.exists(cursor):
+            inf = open(cursor)
+            try:
+                self.cursor = simplejson.load(inf)
+            finally:
+                inf.close()
+            self._remember(self.cursor["id"])
+
+    def _remember(self, id):
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_ids.discard(self._recent[0])
+        self._recent.append(id)
+        self._recent_ids.add(id)
+
+    def _save_cursor(self):
+        tmp = self.cursor_file + ".tmp"
+        outf = open(tmp, "w")
+        try:
+            simplejson.dump(self.cursor, outf)
+        finally:
+            outf.close()
+        os.rename(tmp, self.cursor_file)
+
+    def _is_old(self, event):
+        if self.cursor is None:
+            return False
+        created_at = self.cursor.get("created_at")
+        if created_at is not None and event.get("created_at") is not None:
+            # the API lists events by their creation, not their ids
+            return event["created_at"] < created_at or \
+                   (event["created_at"] == created_at and event["id"] <= self.cursor["id"])
+        return event["id"] <= self.cursor["id"]
+
+    def fetch(self):
+        """
+        @return: the events newer than the cursor, newest first
+        @rtype: list<scapi.Event>
+        """
+        kwargs = {}
+        if self.page_size is not None:
+            kwargs["__limit__"] = self.page_size
+        new = []
+        ids = set()
+        for event in self.scope.events(**kwargs) or ():
+            data = event._as_dict()
+            if self._is_old(data):
+                # the remaining pages aren't fetched at all
+                break
+            # events arriving while paging push the ones already seen onto the next page
+            if event.id in ids or event.id in self._recent_ids:
+                continue
+            ids.add(event.id)
+            new.append(event)
+            if self.cursor is None:
+                # without a cursor, tailing starts with the newest event
+                break
+        return new
+
+    def poll(self):
+        """
+        Fetch and deliver the new events, and advance the cursor.
+
+        @return: the number of events delivered
+        @rtype: int
+        """
+        self.polls += 1
+        events = self.fetch()
+        for event in reversed(events):
+            # blocks while a bounded queue is full
+            self.handler(event)
+            self._remember(event.id)
+            self.delivered += 1
+        if events:
+            newest = events[0]._as_dict()
+            self.cursor = dict(id=newest["id"], created_at=newest.get("created_at"))
+            if self.cursor_file is not None:
+                self._save_cursor()
+        return len(events)
+
+    def run(self, polls=None):
+        """
+        Poll until L{stop} is invoked. If it was invoked before, return right away.
+
+        @type polls: int
+        @param polls: if given, the number of polls after which to return
+        """
+        while not self._stopped.isSet():
+            try:
+                new = self.poll()
+            except Exception:
+                logger.warning("Polling the events failed", exc_info=True)
+                new = 0
+            if new:
+                self.interval = max(self.min_interval, self.interval / self.factor)
+            else:
+                self.interval = min(self.max_interval, self.interval * self.factor)
+            if polls is not None and self.polls >= polls:
+                return
+            logger.debug("%i new events, polling again in %.2f seconds", new, self.interval)
+            self.sleep(self.interval)
+
+    def stop(self):
+        """
+        Make L{run} return after the current poll, or right away if it's waiting.
+        A stopped tailer stays stopped, even if L{run} hasn't been invoked yet.
+        """
+        self._stopped.set()
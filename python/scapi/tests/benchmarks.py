@@ -0,0 +1,422 @@
+"""
+Benchmarks for the SCAPI. Besides micro-benchmarks for the hot paths,
+there are end-to-end benchmarks (prefixed with e2e_) running against a
+L{FixtureAPI} on localhost, so no network or API-server is needed.
+
+Run them like this::
+
+  host:~/SoundCloudAPI deets$ python -m scapi.tests.benchmarks
+
+or only some of them by passing their names::
+
+  host:~/SoundCloudAPI deets$ python -m scapi.tests.benchmarks resource_hashing e2e_me
+
+The results can be saved as JSON, and compared with an earlier run. Regressions
+beyond the threshold are reported, and make the run fail::
+
+  host:~/SoundCloudAPI deets$ python -m scapi.tests.benchmarks --output=before.json
+  host:~/SoundCloudAPI deets$ python -m scapi.tests.benchmarks --compare=before.json --threshold=0.2
+
+Measurements ending with _per_sec, and speedups, are better when higher, all
+others are times in seconds.
+"""
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import urllib2
+from optparse import OptionParser
+
+import simplejson
+
+import scapi
+from scapi.metrics import Histogram
+from scapi.tests.stubserver import FixtureAPI
+
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """
+    Decorator to register a benchmark. A benchmark is a callable
+    returning a dict of measurements.
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def measure(func, number=1, repeat=3):
+    """
+    Invoke func number times, repeat times, and return the best
+    time per invocation in seconds.
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            func()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class _LegacyUser(scapi.User):
+    """
+    A User hashing & comparing the way RESTBase used to, as
+    baseline for L{resource_hashing}.
+    """
+
+    def __hash__(self):
+        return hash("%s%i" % (self.KIND, self.id))
+
+    def __eq__(self, other):
+        if not isinstance(other, scapi.RESTBase):
+            return False
+        return self.KIND == other.KIND and self.id == other.id
+
+
+@benchmark
+def resource_hashing(count=100000):
+    """
+    Put count users - half of them duplicates - into a set and a dict, and
+    look them up again.
+    """
+    root = scapi.Scope(scapi.ApiConnector(host="localhost"))
+    result = {}
+    for name, cls in (("legacy", _LegacyUser), ("current", scapi.User)):
+        users = [cls(dict(id=i % (count / 2)), root) for i in xrange(count)]
+        def run():
+            seen = set(users)
+            index = dict.fromkeys(users)
+            for user in users:
+                user in seen
+                index[user]
+        result[name] = measure(run)
+    result["speedup"] = result["legacy"] / result["current"]
+    return result
+
+
+def _legacy_url(scope, method, args, queryparams):
+    """
+    The way Scope._call used to create urls, as baseline for L{url_construction}.
+    """
+    connector = scope._get_connector()
+    if method[-1] != "/":
+        method = method + "/"
+    if args:
+        method = "%s%s" % (method, "/".join(str(a) for a in args))
+    sc_str = ''
+    if scope._scope:
+        scopes = scope._scope
+        if connector.collapse_scope:
+            scopes = scopes[-1:]
+        sc_str = "/".join([sc._scope() for sc in scopes]) + "/"
+    url = "http://%(host)s/%(base)s%(scope)s%(method)s%(queryparams)s" % dict(host=connector.host, method=method, base=connector._base, scope=sc_str, queryparams=scope._create_query_string(queryparams))
+    return url, method
+
+
+@benchmark
+def url_construction(count=20000):
+    """
+    Create urls for the contacts of a user, and for fetching a single track.
+    """
+    root = scapi.Scope(scapi.ApiConnector(host="localhost"))
+    user = scapi.User(dict(id=1234), root)
+    scope = scapi.Scope(root._get_connector(), scope=user, parent=root)
+    calls = [(scope, "contacts", (), dict(offset=50)), (root, "tracks", (5678,), {})]
+    result = {}
+    for name, create in (("legacy", _legacy_url), ("current", lambda sc, *args: sc._url(*args))):
+        def run():
+            for _ in xrange(count):
+                for sc, method, args, queryparams in calls:
+                    create(sc, method, args, queryparams)
+        result[name + "_per_sec"] = count * len(calls) / measure(run)
+    result["speedup"] = result["current_per_sec"] / result["legacy_per_sec"]
+    return result
+
+
+class _NoAuthenticator(object):
+    """
+    An authenticator that doesn't sign, so benchmarks only measure
+    the cost of constructing requests.
+    """
+
+    def augment_request(self, req, parameters, use_multipart=False):
+        pass
+
+
+def _legacy_create_request(url, connector, parameters, queryparams, alternate_http_method=None, use_multipart=False):
+    """
+    The way Scope._create_request used to create requests, as baseline
+    for L{request_construction}.
+    """
+    class MyRequest(urllib2.Request):
+        def get_method(self):
+            if alternate_http_method is not None:
+                return alternate_http_method
+            return urllib2.Request.get_method(self)
+
+        def has_data(self):
+            return parameters is not None
+
+        def augment_request(self, params, use_multipart=False):
+            connector.authenticator.augment_request(self, params, use_multipart)
+
+        @classmethod
+        def recreate_request(cls, location):
+            return _legacy_create_request(location, connector, None, None)
+
+    req = MyRequest(url)
+    all_params = {}
+    if parameters is not None:
+        all_params.update(parameters)
+    if queryparams is not None:
+        all_params.update(queryparams)
+    if not all_params:
+        all_params = None
+    req.augment_request(all_params, use_multipart)
+    req.add_header("Accept", "application/json")
+    return req
+
+
+@benchmark
+def request_construction(count=20000):
+    """
+    Create requests for a GET and a PUT.
+    """
+    connector = scapi.ApiConnector(host="localhost", authenticator=_NoAuthenticator())
+    calls = [("http://localhost/tracks/1", None, dict(offset=50), None),
+             ("http://localhost/tracks/1", {"track[title]" : "foo"}, None, "PUT")]
+    result = {}
+    for name, create in (("legacy", _legacy_create_request), ("current", scapi.SCRequest.create)):
+        def run():
+            for _ in xrange(count):
+                for url, parameters, queryparams, method in calls:
+                    create(url, connector, parameters, queryparams, method)
+        result[name + "_per_sec"] = count * len(calls) / measure(run)
+    result["speedup"] = result["current_per_sec"] / result["legacy_per_sec"]
+    return result
+
+
+IMPORT_SCRIPT = """
+import sys, time
+before = set(sys.modules)
+start = time.time()
+import scapi
+elapsed = time.time() - start
+print repr((elapsed, sorted(m for m in set(sys.modules) - before if sys.modules[m] is not None)))
+"""
+
+
+def import_scapi():
+    """
+    Import the SCAPI in a fresh interpreter.
+
+    @return: the time the import took, and the modules it loaded
+    @rtype: tuple(float, list<str>)
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen([sys.executable, "-c", IMPORT_SCRIPT], stdout=subprocess.PIPE,
+                               cwd=package_dir)
+    output = process.communicate()[0]
+    return eval(output)
+
+
+@benchmark
+def import_time(repeat=5):
+    """
+    The time it takes to import the SCAPI.
+    """
+    times = [import_scapi()[0] for _ in xrange(repeat)]
+    return dict(best=min(times), worst=max(times))
+
+
+def latencies(func, count, prefix=""):
+    """
+    Invoke func count times.
+
+    @return: the invocations per second, and percentiles of the latency
+    @rtype: dict
+    """
+    histogram = Histogram(count)
+    started = time.time()
+    for _ in xrange(count):
+        start = time.time()
+        func()
+        histogram.add(time.time() - start)
+    elapsed = time.time() - started
+    return {prefix + "ops_per_sec" : count / elapsed,
+            prefix + "p50" : histogram.percentile(50),
+            prefix + "p95" : histogram.percentile(95)}
+
+
+class fixture_scope(object):
+    """
+    Runs a L{FixtureAPI}, and returns the root-scope for it.
+
+    >>> with fixture_scope() as (api, root):
+    ...     root.me()
+    """
+
+    def __init__(self, **kwargs):
+        self.api = FixtureAPI(**kwargs)
+
+    def __enter__(self):
+        self.api.start()
+        connector = scapi.ApiConnector(host=self.api.host, authenticator=self.api.authenticator())
+        return self.api, scapi.Scope(connector)
+
+    def __exit__(self, *args):
+        self.api.stop()
+
+
+@benchmark
+def e2e_me(count=200):
+    """
+    Fetch the authenticated user, which involves a redirect.
+    """
+    with fixture_scope() as (api, root):
+        return latencies(root.me, count)
+
+
+@benchmark
+def e2e_tracks_pagination(track_count=1000, count=5):
+    """
+    Walk through a large paginated list of tracks.
+    """
+    with fixture_scope(track_count=track_count) as (api, root):
+        res = latencies(lambda: list(root.tracks()), count)
+        res["tracks_per_sec"] = res["ops_per_sec"] * track_count
+        return res
+
+
+@benchmark
+def e2e_upload(sizes=(16 * 1024, 256 * 1024, 2 * 1024 * 1024), count=10):
+    """
+    Create tracks with assets of the given sizes.
+    """
+    res = {}
+    with fixture_scope(track_count=1) as (api, root):
+        for size in sizes:
+            asset = tempfile.NamedTemporaryFile(suffix=".mp3")
+            try:
+                asset.write("\0" * size)
+                asset.flush()
+                asset_data = open(asset.name, "rb")
+                try:
+                    res.update(latencies(lambda: root.Track.new(title="Knaster", asset_data=asset_data),
+                                         count, prefix="%ik_" % (size / 1024)))
+                finally:
+                    asset_data.close()
+            finally:
+                asset.close()
+        return res
+
+
+@benchmark
+def e2e_property_put(count=200):
+    """
+    Set the title of a track, each time with a PUT.
+    """
+    with fixture_scope(track_count=1) as (api, root):
+        track = root.Track.get(FixtureAPI.TRACK_ID)
+        def put():
+            track.title = "Knaster"
+        return latencies(put, count)
+
+
+@benchmark
+def e2e_contacts(count=100):
+    """
+    Add contacts to the authenticated user, and remove them again.
+    """
+    with fixture_scope(track_count=1, contact_count=count) as (api, root):
+        me = root.me()
+        contacts = [scapi.User(dict(id=id), root) for id in api.contact_ids]
+        res = latencies(lambda: me.contacts.append(contacts.pop()), count, prefix="append_")
+        contacts = [scapi.User(dict(id=id), root) for id in api.contact_ids]
+        res.update(latencies(lambda: me.contacts.remove(contacts.pop()), count, prefix="remove_"))
+        return res
+
+
+def higher_is_better(key):
+    return key.endswith("_per_sec") or key == "speedup"
+
+
+def compare(baseline, results, threshold=0.2):
+    """
+    Compare results with those of an earlier run.
+
+    @param threshold: the tolerated relative deviation
+    @type threshold: float
+    @return: the regressions, as tuples (benchmark, measurement, baseline-value, value)
+    @rtype: list<tuple>
+    """
+    regressions = []
+    for name, measurements in sorted(results.items()):
+        for key, value in sorted(measurements.items()):
+            old = baseline.get(name, {}).get(key)
+            if old is None or value is None:
+                continue
+            if higher_is_better(key):
+                regressed = value < old * (1 - threshold)
+            else:
+                regressed = value > old * (1 + threshold)
+            if regressed:
+                regressions.append((name, key, old, value))
+    return regressions
+
+
+def run(names=None):
+    """
+    Run the benchmarks with the given names, or all of them.
+
+    @return: the results per benchmark
+    @rtype: dict<str, dict>
+    """
+    results = {}
+    for bench in BENCHMARKS:
+        if names and bench.__name__ not in names:
+            continue
+        results[bench.__name__] = res = bench()
+        print "%s:" % bench.__name__
+        for key, value in sorted(res.items()):
+            print "  %s: %r" % (key, value)
+    return results
+
+
+def main(args=None):
+    parser = OptionParser(usage="%prog [options] [benchmark...]")
+    parser.add_option("--output", help="save the results as JSON to this file")
+    parser.add_option("--compare", help="compare the results to those saved in this file")
+    parser.add_option("--threshold", type="float", default=0.2,
+                      help="the relative deviation regarded as regression [default: %default]")
+    options, names = parser.parse_args(args)
+    results = run(names)
+    if options.output:
+        outf = open(options.output, "w")
+        try:
+            simplejson.dump(results, outf, indent=2, sort_keys=True)
+        finally:
+            outf.close()
+    if options.compare:
+        inf = open(options.compare)
+        try:
+            baseline = simplejson.load(inf)
+        finally:
+            inf.close()
+        regressions = compare(baseline, results, options.threshold)
+        for name, key, old, value in regressions:
+            print "REGRESSION %s.%s: %r -> %r" % (name, key, old, value)
+        if regressions:
+            sys.exit(1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
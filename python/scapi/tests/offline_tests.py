@@ -0,0 +1,1537 @@
+"""
+Tests that don't need a running SoundCloud API-server.
+"""
+from __future__ import with_statement
+
+import os
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import Queue
+from StringIO import StringIO
+import urllib2
+from unittest import TestCase
+
+import scapi
+from scapi import metrics, profiler, transport
+from scapi.retry import RetryPolicy
+from scapi.breaker import CircuitBreaker, CircuitOpen
+from scapi.ratelimit import RateLimiter, RateLimited, TokenBucket, FileTokenBucket
+from scapi.concurrency import run_concurrently, AdaptiveLimit
+from scapi.crawler import Crawler, IdSet, BloomFilter
+from scapi.sync import Mirror, Synchronizer
+from scapi.tailer import EventTailer
+from scapi.tests.stubserver import StubAPI, FixtureAPI, paginated
+from scapi.tests import benchmarks
+
+
+class RESTBaseTests(TestCase):
+
+    def setUp(self):
+        self.connector = scapi.ApiConnector(host="localhost")
+        self.root = scapi.Scope(self.connector)
+
+
+    def test_nested_resources_are_memoized(self):
+        track = scapi.Track(dict(id=1, user=dict(id=2, username="foo"),
+                                 permissions=[dict(id=3), dict(id=4)]),
+                            self.root)
+        user = track.user
+        assert isinstance(user, scapi.User)
+        assert track.user is user
+        assert track.permissions is track.permissions
+        assert [u.id for u in track.permissions] == [3, 4]
+
+
+    def test_child_scope_is_memoized(self):
+        user = scapi.User(dict(id=1), self.root)
+        user.contacts
+        scope = user._RESTBase__child_scope
+        assert isinstance(scope, scapi.Scope)
+        user.tracks
+        assert user._RESTBase__child_scope is scope
+
+
+    def test_invalidate(self):
+        track = scapi.Track(dict(id=1, user=dict(id=2)), self.root)
+        user = track.user
+        track._invalidate()
+        assert track.user is not user
+        assert track.user == user
+
+
+    def test_hashing_and_equality(self):
+        a = scapi.User(dict(id=1), self.root)
+        b = scapi.User(dict(id=1, username="foo"), self.root)
+        assert a == b and hash(a) == hash(b)
+        assert len(set([a, b, scapi.User(dict(id=2), self.root)])) == 2
+        assert a != scapi.Track(dict(id=1), self.root)
+        # the id can also come from the path
+        assert scapi.User({}, self.root, ["1", "users"]) == a
+        comment = scapi.Comment(dict(body="foo"), self.root)
+        assert comment == comment
+        assert comment != scapi.Comment(dict(body="foo"), self.root)
+
+
+class IdentityMapTests(TestCase):
+
+    def setUp(self):
+        self.connector = scapi.ApiConnector(host="localhost", identity_map=True)
+        self.root = scapi.Scope(self.connector)
+
+
+    def test_same_kind_and_id_share_one_instance(self):
+        a = self.connector._resource(scapi.User, dict(id=1, username="foo"), self.root)
+        # contacts is an alias of users
+        cls = scapi.RESTBase.REGISTRY["contacts"]
+        b = self.connector._resource(cls, dict(id=1, city="Berlin"), self.root)
+        assert a is b
+        assert b.username == "foo"
+        assert b.city == "Berlin"
+        track = self.connector._resource(scapi.Track, dict(id=1), self.root)
+        assert track is not a
+
+
+    def test_hydrated_resources_use_identity_map(self):
+        user = self.connector._resource(scapi.User, dict(id=2), self.root)
+        track = scapi.Track(dict(id=1, user=dict(id=2, username="bar")), self.root)
+        assert track.user is user
+        assert user.username == "bar"
+
+
+    def test_merge_keeps_unsaved_changes(self):
+        user = self.connector._resource(scapi.User, dict(id=4, username="foo", city="Berlin"), self.root)
+        user.edit()
+        user.username = "bar"
+        self.connector._resource(scapi.User, dict(id=4, username="baz", city="Hamburg"), self.root)
+        assert user.username == "bar" and user.city == "Hamburg"
+        assert user.is_dirty()
+        user.discard()
+        assert user.username == "baz"
+
+
+    def test_merge_refreshes_the_scope(self):
+        connector = scapi.ApiConnector(host="localhost", identity_map=True, collapse_scope=False)
+        root = scapi.Scope(connector)
+        group = scapi.Scope(connector, scope=scapi.Track(dict(id=5), root), parent=root)
+        user = connector._resource(scapi.User, dict(id=6), root)
+        assert connector._resource(scapi.User, dict(id=6), group) is user
+        assert user._RESTBase__scope is group
+
+
+    def test_entries_are_weak(self):
+        self.connector._resource(scapi.User, dict(id=3), self.root)
+        assert ("users", 3) not in self.connector._identity_map
+
+
+    def test_disabled_by_default(self):
+        connector = scapi.ApiConnector(host="localhost")
+        a = connector._resource(scapi.User, dict(id=1), self.root)
+        b = connector._resource(scapi.User, dict(id=1), self.root)
+        assert a is not b
+        assert a == b
+
+
+class StubTestCase(TestCase):
+    """
+    Base for tests running against a L{StubAPI}.
+    """
+
+    def setUp(self):
+        self.stub = StubAPI()
+        self.stub.start()
+        self.connector = scapi.ApiConnector(host=self.stub.host,
+                                            authenticator=self.stub.authenticator())
+        self.root = scapi.Scope(self.connector)
+
+
+    def tearDown(self):
+        self.stub.stop()
+
+
+class EditSessionTests(StubTestCase):
+
+    def setUp(self):
+        super(EditSessionTests, self).setUp()
+        for id in xrange(1, 4):
+            self.stub.route("PUT", "/tracks/%i" % id)
+
+
+    def test_edit_session_sends_one_put(self):
+        track = scapi.Track(dict(id=1, title="foo"), self.root)
+        with track.edit():
+            track.title = "bar"
+            track.genre = "rock"
+            assert track.title == "bar"
+            assert not self.stub.requests
+        puts = self.stub.requests_for("PUT", "/tracks/1")
+        assert len(puts) == 1
+        assert puts[0].params == {"track[title]" : ["bar"], "track[genre]" : ["rock"]}
+        assert not track.is_dirty()
+
+
+    def test_explicit_save(self):
+        track = scapi.Track(dict(id=1, title="foo"), self.root)
+        track.edit()
+        track.title = "bar"
+        assert track.is_dirty()
+        track.save()
+        assert len(self.stub.requests) == 1
+        # after saving, properties are sent immediately again
+        track.title = "baz"
+        assert len(self.stub.requests) == 2
+
+
+    def test_failing_block_discards_changes(self):
+        track = scapi.Track(dict(id=1, title="foo"), self.root)
+        try:
+            with track.edit():
+                track.title = "bar"
+                track.genre = "rock"
+                raise ValueError
+        except ValueError:
+            pass
+        assert track.title == "foo"
+        assert "genre" not in track._RESTBase__data
+        assert not self.stub.requests
+
+
+    def test_save_all(self):
+        tracks = [scapi.Track(dict(id=id), self.root) for id in xrange(1, 5)]
+        for track in tracks:
+            track.edit()
+            track.title = "title %i" % track.id
+        outcomes = scapi.save_all(tracks, workers=2)
+        assert [o.item for o in outcomes] == tracks
+        # there is no route for track 4
+        assert [o.ok for o in outcomes] == [True, True, True, False]
+        assert tracks[3].is_dirty()
+        assert len(self.stub.requests) == 4
+
+
+    def test_save_all_ends_clean_sessions(self):
+        self.stub.route("PUT", "/tracks/1")
+        track = scapi.Track(dict(id=1), self.root)
+        track.edit()
+        assert scapi.save_all([track]) == []
+        track.title = "after save_all"
+        assert len(self.stub.requests_for("PUT", "/tracks/1")) == 1
+
+
+class BulkMembershipTests(StubTestCase):
+
+    def setUp(self):
+        super(BulkMembershipTests, self).setUp()
+        self.me = scapi.User(dict(id=1), self.root)
+        self.stub.route("GET", "/users/1/contacts", body=[dict(id=2), dict(id=3)])
+        for id in xrange(2, 6):
+            self.stub.route("PUT", "/users/1/contacts/%i" % id)
+            self.stub.route("DELETE", "/users/1/contacts/%i" % id)
+        self.users = [scapi.User(dict(id=id), self.root) for id in xrange(2, 7)]
+
+
+    def test_extend(self):
+        outcomes = self.me.contacts.extend(self.users, workers=3)
+        assert [o.item for o in outcomes] == self.users
+        # there is no route for user 6
+        assert [o.ok for o in outcomes] == [True] * 4 + [False]
+        assert len(self.stub.requests_for("PUT", "/users/1/contacts/4")) == 1
+
+
+    def test_remove_many(self):
+        outcomes = self.me.contacts.remove_many(self.users[:2])
+        assert all(o.ok for o in outcomes)
+        assert len(self.stub.requests) == 2
+        assert all(r.method == "DELETE" for r in self.stub.requests)
+
+
+    def test_sync_to(self):
+        added, removed = self.me.contacts.sync_to(self.users[1:3] + self.users[1:2])
+        assert [o.item.id for o in added] == [4]
+        assert [o.item.id for o in removed] == [2]
+        assert all(o.ok for o in added + removed)
+
+
+class RedirectCacheTests(StubTestCase):
+
+    def setUp(self):
+        super(RedirectCacheTests, self).setUp()
+        self.connector.cache_redirects = True
+        self.redirect_to(1)
+        for id in (1, 2):
+            self.stub.route("GET", "/users/%i" % id, body=dict(id=id))
+
+
+    def redirect_to(self, id):
+        self.stub.route("GET", "/me", status=303,
+                        headers={"Location" : "http://%s/users/%i" % (self.stub.host, id)})
+
+
+    def test_redirects_are_cached(self):
+        for _ in xrange(3):
+            me = self.root.me()
+            assert isinstance(me, scapi.User) and me.id == 1
+        assert len(self.stub.requests_for("GET", "/me")) == 1
+        assert len(self.stub.requests_for("GET", "/users/1")) == 3
+        assert self.connector.redirect_round_trips_saved == 2
+
+
+    def test_authentication_change_invalidates(self):
+        self.root.me()
+        self.connector.authenticator = self.stub.authenticator()
+        self.root.me()
+        assert len(self.stub.requests_for("GET", "/me")) == 2
+        assert self.connector.redirect_round_trips_saved == 0
+
+
+    def test_stale_redirect(self):
+        self.root.me()
+        self.redirect_to(2)
+        self.stub.route("GET", "/users/1", status=404)
+        assert self.root.me().id == 2
+        assert self.root.me().id == 2
+        assert len(self.stub.requests_for("GET", "/me")) == 2
+
+
+    def test_stale_redirect_is_recorded_once(self):
+        self.root.me()
+        records = []
+        self.connector.instrumentation.add_sink(metrics.CallbackSink(records.append))
+        self.redirect_to(2)
+        self.stub.route("GET", "/users/1", status=404)
+        assert self.root.me().id == 2
+        assert [(r.status, r.error) for r in records] == [(200, None)], records
+
+
+    def test_disabled_by_default(self):
+        self.connector.cache_redirects = False
+        self.root.me()
+        self.root.me()
+        assert len(self.stub.requests_for("GET", "/me")) == 2
+
+
+class ConcurrencyTests(StubTestCase):
+
+    THREADS = 16
+    CALLS = 10
+
+    def setUp(self):
+        super(ConcurrencyTests, self).setUp()
+        self.connector.cache_redirects = True
+        for id in xrange(self.THREADS):
+            self.stub.route("GET", "/tracks/%i/user" % id, status=303,
+                            headers={"Location" : "http://%s/users/%i" % (self.stub.host, id + 100)})
+            self.stub.route("GET", "/users/%i" % (id + 100), body=dict(id=id + 100))
+
+
+    def test_shared_connector(self):
+        def fetch(id):
+            res = []
+            for _ in xrange(self.CALLS):
+                user = self.root.tracks(id, "user")
+                res.append((user.__class__, user.id))
+            return res
+        outcomes = run_concurrently(fetch, range(self.THREADS), workers=self.THREADS)
+        for outcome in outcomes:
+            assert outcome.ok, outcome
+            assert outcome.result == [(scapi.User, outcome.item + 100)] * self.CALLS
+        assert len(self.stub.requests) < self.THREADS * self.CALLS * 2
+
+
+    def test_connector_settings(self):
+        connector = scapi.ApiConnector(host="localhost", proxy="http://127.0.0.1:10000/",
+                                       authorization_url="http://localhost/authorize")
+        assert connector.get_request_token_authorization_url("foo") == "http://localhost/authorize?oauth_token=foo"
+        assert connector.request_token_url == scapi.REQUEST_TOKEN_URL
+        context = scapi.RequestContext(connector)
+        assert isinstance(context.handlers()[0], scapi.SCRedirectHandler)
+        assert isinstance(context.handlers()[1], urllib2.ProxyHandler)
+        assert scapi.RequestContext(self.connector).proxy_handlers() == []
+
+
+    def test_adaptive_limit(self):
+        changes = []
+        limit = AdaptiveLimit(initial=2, max_limit=4, window=4, on_change=changes.append)
+        def invocations(count, latency, ok=True):
+            for _ in xrange(count):
+                limit.acquire()
+            for _ in xrange(count):
+                limit.release(latency, ok)
+        # flat latency, and the limit was used: raise it
+        invocations(2, 0.1)
+        invocations(2, 0.1)
+        assert limit.limit == 3
+        invocations(3, 0.1)
+        invocations(1, 0.1)
+        assert limit.limit == 4
+        # never beyond max_limit
+        invocations(4, 0.1)
+        assert limit.limit == 4
+        # latency rises: back off
+        invocations(4, 0.5)
+        assert limit.limit == 2
+        # as do errors
+        invocations(2, 0.1, ok=False)
+        invocations(2, 0.1)
+        assert limit.limit == 1
+        assert changes == [3, 4, 2, 1]
+
+
+    def test_adaptive_limit_latency_shift(self):
+        limit = AdaptiveLimit(initial=12, max_limit=16, window=20)
+        def window(latency):
+            # a window of invocations using the whole limit
+            limit._latencies = [latency] * limit.window
+            limit._max_in_flight = limit.limit
+            limit._adapt()
+        for _ in xrange(3):
+            window(0.1)
+        assert limit.limit == 15
+        # the latency doubles, and stays there
+        limits = []
+        for _ in xrange(20):
+            window(0.2)
+            limits.append(limit.limit)
+        assert min(limits) > 1, limits
+        # it backs off at first, but settles again at the new level
+        assert limits[0] < 15 and limits[-1] > limits[0], limits
+        assert limit.baseline > 0.15
+
+
+    def test_run_with_adaptive_limit(self):
+        limit = AdaptiveLimit(initial=2, max_limit=8, window=5)
+        lock = threading.Lock()
+        running = [0, 0]
+        def invoke(item):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return item
+        outcomes = run_concurrently(invoke, range(40), limit)
+        assert [o.result for o in outcomes] == range(40)
+        assert running[1] <= limit.max_limit
+        assert limit.limit > 2
+        assert limit.in_flight == 0
+
+
+class ImportTests(TestCase):
+
+    # these are only imported when needed
+    DEFERRED_MODULES = ["simplejson", "cgi", "inspect", "mimetypes",
+                        "scapi.MultipartPostHandler", "scapi.authentication"]
+
+    IMPORT_BUDGET = 0.5
+
+
+    def test_import(self):
+        elapsed, modules = benchmarks.import_scapi()
+        for name in self.DEFERRED_MODULES:
+            assert name not in modules, name
+        assert elapsed < self.IMPORT_BUDGET, elapsed
+
+
+    def test_domain_classes_are_registered(self):
+        assert scapi.RESTBase.REGISTRY["favorites"] is scapi.Track
+        assert scapi.RESTBase.ALL_DOMAIN_CLASSES["User"] is scapi.User
+        assert "Playlist" in scapi.__all__
+
+
+class RouteTests(TestCase):
+
+    def setUp(self):
+        self.connector = scapi.ApiConnector(host="localhost:3000")
+        self.root = scapi.Scope(self.connector)
+        self.user = scapi.User(dict(id=1), self.root)
+        self.user_scope = scapi.Scope(self.connector, scope=self.user, parent=self.root)
+        self.track = scapi.Track(dict(id=2), self.user_scope)
+        self.track_scope = scapi.Scope(self.connector, scope=self.track, parent=self.user_scope)
+
+
+    def test_urls(self):
+        for scope, method, args, queryparams in [
+            (self.root, "me", (), None),
+            (self.root, "tracks", (2,), {}),
+            (self.root, "tracks", (2, "user"), dict(offset=50)),
+            (self.user_scope, "contacts", (), dict(offset=50, q=u"f\xfc/")),
+            (self.track_scope, "comments", (3,), None),
+            ]:
+            url, m, _ = scope._url(method, args, queryparams)
+            legacy_url, legacy_m = benchmarks._legacy_url(scope, method, args, queryparams)
+            assert (url, m) == (legacy_url, legacy_m), (url, legacy_url)
+
+
+    def test_routes_are_shared(self):
+        other = scapi.Scope(self.connector, scope=scapi.User(dict(id=3), self.root), parent=self.root)
+        assert self.user_scope._url("contacts", (), None)[0] == "http://localhost:3000/users/1/contacts/"
+        assert other._url("contacts", (), None)[0] == "http://localhost:3000/users/3/contacts/"
+        route = self.user_scope._routes["contacts", 0]
+        assert other._routes["contacts", 0] is route
+        assert route.name == "users/*/contacts/"
+
+
+    def test_uncollapsed_scopes(self):
+        self.track_scope._url("comments", (), None)
+        self.connector.collapse_scope = False
+        url, _, _ = self.track_scope._url("comments", (), None)
+        assert url == "http://localhost:3000/users/1/tracks/2/comments/"
+
+
+class SCRequestTests(TestCase):
+
+    def test_request(self):
+        connector = scapi.ApiConnector(host="localhost", authenticator=benchmarks._NoAuthenticator())
+        req = scapi.SCRequest.create("http://localhost/tracks/1", connector, {"track[title]" : "foo"},
+                                     alternate_http_method="PUT")
+        assert req.get_method() == "PUT"
+        assert req.has_data()
+        assert req.get_header("Accept") == "application/json"
+        redirected = req.recreate_request("http://localhost/tracks/2")
+        assert isinstance(redirected, scapi.SCRequest)
+        assert redirected.get_method() == "GET"
+        assert redirected.connector is connector
+
+
+class InstrumentationTests(StubTestCase):
+
+    def setUp(self):
+        super(InstrumentationTests, self).setUp()
+        self.stub.route("GET", "/me", status=303,
+                        headers={"Location" : "http://%s/users/1" % self.stub.host})
+        self.stub.route("GET", "/users/1", body=dict(id=1, username="foo"))
+        self.stub.route("GET", "/users/1/contacts", body=[dict(id=2)])
+        self.records = []
+        self.connector.instrumentation.add_sink(metrics.CallbackSink(self.records.append))
+
+
+    def test_map_timing_of_lists(self):
+        self.stub.route("GET", "/users/1/contacts", body=[dict(id=id) for id in xrange(2, 42)])
+        create = self.connector._resource
+        def slow_resource(*args):
+            time.sleep(0.002)
+            return create(*args)
+        self.connector._resource = slow_resource
+        contacts = scapi.User(dict(id=1), self.root).contacts()
+        assert len(self.records) == 1
+        # the page was mapped before the record was emitted
+        assert self.records[0].timings["map"] >= 0.07, self.records[0].timings
+        assert len(list(contacts)) == 40
+
+
+    def test_records(self):
+        me = self.root.me()
+        list(me.contacts())
+        self.root.tracks(1)
+        me_record, contacts_record, tracks_record = self.records
+        assert me_record.endpoint == "me/"
+        assert me_record.http_method == "GET"
+        assert me_record.status == 200
+        assert me_record.redirects == 1
+        assert me_record.bytes_received > 0
+        for phase in metrics.CallRecord.PHASES:
+            assert phase in me_record.timings, phase
+        assert me_record.total >= sum(me_record.timings.values())
+        assert contacts_record.endpoint == "users/*/contacts/"
+        assert contacts_record.redirects == 0
+        assert tracks_record.endpoint == "tracks/*"
+        assert tracks_record.status == 404
+
+
+    def test_histograms(self):
+        histograms = self.connector.instrumentation.add_sink(metrics.HistogramSink())
+        for _ in xrange(5):
+            self.root.me()
+        histogram = histograms.histogram("me/", "GET", "total")
+        assert histogram.count == 5
+        assert histogram.percentile(95) >= histogram.percentile(50) > 0
+        assert histograms.statuses["me/", "GET"] == {200 : 5}
+        assert ("me/", "GET", "ttfb") in histograms.summary()
+
+
+    def test_statsd(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        sink = metrics.StatsdSink(*receiver.getsockname())
+        self.connector.instrumentation.add_sink(sink)
+        try:
+            list(scapi.User(dict(id=1), self.root).contacts())
+            lines = receiver.recv(4096).split("\n")
+        finally:
+            sink.close()
+            receiver.close()
+        assert "scapi.users._.contacts.GET.status.200:1|c" in lines
+        assert [l for l in lines if l.startswith("scapi.users._.contacts.GET.decode:")]
+
+
+    def test_disabled(self):
+        self.connector.instrumentation.sinks = []
+        context = scapi.RequestContext(self.connector)
+        assert context.record is None
+        assert not [h for h in context.handlers() if isinstance(h, scapi.TimingHTTPHandler)]
+
+
+class ProfilerTests(StubTestCase):
+
+    def setUp(self):
+        super(ProfilerTests, self).setUp()
+        self.stub.route("GET", "/tracks", body=[dict(id=id, user=dict(id=id)) for id in xrange(10)])
+
+
+    def work(self):
+        for track in self.root.tracks():
+            track.user
+
+
+    def test_deterministic(self):
+        original = scapi.Scope.__dict__["_map"]
+        p = profiler.Profiler()
+        p.start()
+        try:
+            self.work()
+        finally:
+            p.stop()
+        assert scapi.Scope.__dict__["_map"] is original
+        summary = p.summary()
+        for subsystem in ("call", "authentication", "decode", "_map", "__getattr__"):
+            assert subsystem in summary, subsystem
+        assert summary["__getattr__"]["calls"] == 10
+        assert "scapi;call;authentication" in [line.split()[0] for line in p.collapsed()]
+        assert "authentication" in p.format_summary()
+
+
+    def test_hydration_is_charged_to_map(self):
+        init = scapi.RESTBase.__dict__["__init__"]
+        def slow_init(*args, **kwargs):
+            time.sleep(0.002)
+            init(*args, **kwargs)
+        scapi.RESTBase.__init__ = slow_init
+        p = profiler.Profiler()
+        p.start()
+        try:
+            self.work()
+        finally:
+            p.stop()
+            scapi.RESTBase.__init__ = init
+        assert scapi.ApiConnector.__dict__["_resource"].__module__ == "scapi"
+        summary = p.summary()
+        # 10 tracks and their users
+        assert summary["_map"]["self"] >= 0.035, summary
+        assert p.stacks[("__getattr__", "_map")] >= 0.015, p.stacks
+
+
+    def test_sampling(self):
+        p = profiler.Profiler(mode=profiler.Profiler.SAMPLING, interval=0.001)
+        p.start()
+        try:
+            deadline = time.time() + 5
+            while not p.stacks and time.time() < deadline:
+                self.work()
+        finally:
+            p.stop()
+        assert p.stacks
+        subsystems = set(subsystem for _, _, subsystem in profiler.patch_points())
+        assert all(set(path) <= subsystems for path in p.stacks)
+
+
+    def test_only_one_profiler(self):
+        p = profiler.Profiler()
+        p.start()
+        try:
+            self.assertRaises(RuntimeError, profiler.Profiler().start)
+        finally:
+            p.stop()
+
+
+class BenchmarkTests(TestCase):
+
+    def test_e2e_benchmarks(self):
+        for bench, kwargs in [(benchmarks.e2e_me, dict(count=2)),
+                              (benchmarks.e2e_tracks_pagination, dict(track_count=120, count=1)),
+                              (benchmarks.e2e_upload, dict(sizes=(1024,), count=1)),
+                              (benchmarks.e2e_property_put, dict(count=2)),
+                              (benchmarks.e2e_contacts, dict(count=2))]:
+            res = bench(**kwargs)
+            assert res and all(value > 0 for value in res.values()), (bench, res)
+
+
+    def test_fixture_pagination(self):
+        with benchmarks.fixture_scope(track_count=120) as (api, root):
+            tracks = list(root.tracks())
+            assert [t.id for t in tracks] == [t["id"] for t in api.tracks]
+            assert len(api.requests_for("GET", "/tracks")) == 3
+
+
+    def test_compare(self):
+        baseline = dict(e2e_me=dict(ops_per_sec=100.0, p95=0.01), other=dict(p50=1.0))
+        results = dict(e2e_me=dict(ops_per_sec=70.0, p95=0.0125), new=dict(p50=1.0))
+        assert benchmarks.compare(baseline, results, 0.2) == [("e2e_me", "ops_per_sec", 100.0, 70.0),
+                                                              ("e2e_me", "p95", 0.01, 0.0125)]
+        assert benchmarks.compare(baseline, results, 0.5) == []
+
+
+class TransportTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, "session.log.gz")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def record(self, track_count=60):
+        api = FixtureAPI(track_count=track_count, contact_count=1)
+        api.start()
+        recorder = transport.RecordingTransport(self.log)
+        try:
+            connector = scapi.ApiConnector(host=api.host, authenticator=api.authenticator(),
+                                           transport=recorder)
+            root = scapi.Scope(connector)
+            me = root.me()
+            tracks = list(root.tracks())
+            track = root.Track.get(FixtureAPI.TRACK_ID)
+            track.title = "Knaster"
+            me.contacts.append(scapi.User(dict(id=api.contact_ids[0]), root))
+            assert root.Track.get(4711) is None
+        finally:
+            recorder.close()
+            api.stop()
+        return me, tracks
+
+
+    def test_record_and_replay(self):
+        me, tracks = self.record()
+        entries = transport.load_log(self.log)
+        assert [(e["method"], e["status"]) for e in entries] == [("GET", 200), ("GET", 200), ("GET", 200),
+                                                                ("GET", 200), ("PUT", 200), ("PUT", 200),
+                                                                ("GET", 404)]
+        assert entries[0]["redirects"][0].endswith("/users/1")
+        assert entries[4]["body"] == "track%5Btitle%5D=Knaster"
+
+        connector = scapi.ApiConnector(host="replay.invalid", authenticator=StubAPI().authenticator(),
+                                       transport=transport.ReplayTransport(entries))
+        root = scapi.Scope(connector)
+        assert root.me().username == me.username
+        assert [t.id for t in root.tracks()] == [t.id for t in tracks]
+        assert root.Track.get(4711) is None
+        self.assertRaises(transport.NotRecorded, root.Track.get, 4712)
+
+
+    def test_replayer(self):
+        self.record()
+        res = transport.Replayer(transport.load_log(self.log), speed=None, workers=3).run()
+        assert res["calls"] == 7 and res["errors"] == 0 and res["skipped"] == 0, res
+        assert res["cpu_per_call"] >= 0
+        res = transport.Replayer(transport.load_log(self.log), speed=1000.0, workers=1).run()
+        assert res["errors"] == 0, res
+
+
+class RetryTests(StubTestCase):
+
+    def setUp(self):
+        super(RetryTests, self).setUp()
+        self.delays = []
+        self.policy = RetryPolicy(max_attempts=3, sleep=self.delays.append, random=lambda: 0.5)
+        self.connector.retry = self.policy
+        self.failures = []
+
+
+    def flaky(self, status, body, headers=None):
+        """
+        A handler failing with the queued failures first.
+        """
+        def handler(request):
+            if self.failures:
+                return self.failures.pop(0)
+            return status, headers or {}, body
+        return handler
+
+
+    def test_retries_get(self):
+        self.stub.route("GET", "/tracks/1", handler=self.flaky(200, dict(id=1)))
+        self.failures = [(503, {}, ""), (500, {}, "")]
+        assert self.root.Track.get(1).id == 1
+        assert self.delays == [0.25, 0.5]
+        assert self.policy.counters() == dict(retries=2, recovered=1, gave_up=0, reasons={503 : 1, 500 : 1})
+        # every attempt is signed anew
+        nonces = [r.headers["Authorization"] for r in self.stub.requests]
+        assert len(set(nonces)) == 3
+
+
+    def test_gives_up(self):
+        self.stub.route("GET", "/tracks/1", handler=self.flaky(200, dict(id=1)))
+        self.failures = [(503, {}, "")] * 3
+        try:
+            self.root.Track.get(1)
+        except urllib2.HTTPError, e:
+            assert e.code == 503
+        else:
+            assert False
+        assert self.policy.gave_up == 1
+        assert len(self.stub.requests) == 3
+
+
+    def test_honours_retry_after(self):
+        self.stub.route("PUT", "/users/1/contacts/2", handler=self.flaky(200, ""))
+        self.failures = [(429, {"Retry-After" : "7"}, "")]
+        user = scapi.User(dict(id=1), self.root)
+        user.contacts.append(scapi.User(dict(id=2), self.root))
+        assert self.delays == [7.0]
+
+
+    def test_no_retry_for_posts_and_client_errors(self):
+        self.stub.route("POST", "/tracks", handler=self.flaky(201, dict(id=1)))
+        self.failures = [(503, {}, "")]
+        self.assertRaises(urllib2.HTTPError, self.root.Track.new, title="foo")
+        self.stub.route("GET", "/tracks/2", status=403)
+        self.assertRaises(urllib2.HTTPError, self.root.Track.get, 2)
+        assert self.delays == []
+        assert len(self.stub.requests) == 2
+
+
+    def test_connection_errors(self):
+        policy = RetryPolicy(max_attempts=2, sleep=self.delays.append)
+        connector = scapi.ApiConnector(host="127.0.0.1:1", authenticator=self.stub.authenticator(),
+                                       retry=policy)
+        self.assertRaises(urllib2.URLError, scapi.Scope(connector).Track.get, 1)
+        assert policy.counters() == dict(retries=1, recovered=0, gave_up=1, reasons={"URLError" : 1})
+
+
+class FakeClock(object):
+    """
+    A clock that only advances when sleeping.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+
+    def __call__(self):
+        return self.now
+
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTests(StubTestCase):
+
+    def setUp(self):
+        super(RateLimiterTests, self).setUp()
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(read=(2.0, 2), write=(1.0, 1), sleep=self.clock.sleep, clock=self.clock)
+        self.connector.rate_limiter = self.limiter
+        self.stub.route("GET", "/tracks/1", body=dict(id=1))
+
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(1.0, 2, self.clock)
+        assert [bucket.reserve() for _ in xrange(4)] == [0.0, 0.0, 1.0, 2.0]
+        self.clock.now += 3.0
+        assert bucket.reserve(block=False) == 0.0
+        assert bucket.reserve(block=False) == 1.0
+        assert bucket.reserve(block=False) == 1.0
+
+
+    def test_file_token_bucket_is_shared(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "shared.bucket")
+            a = FileTokenBucket(filename, 1.0, 2, self.clock)
+            b = FileTokenBucket(filename, 1.0, 2, self.clock)
+            assert a.reserve() == 0.0
+            assert b.reserve() == 0.0
+            assert a.reserve() == 1.0
+            b.throttle(0.5, 0.1)
+            assert a.reserve() == 4.0
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def test_calls_wait(self):
+        for _ in xrange(4):
+            self.root.Track.get(1)
+        assert self.clock.slept == [0.5, 0.5]
+        # writes have their own budget
+        self.stub.route("PUT", "/users/1/contacts/2")
+        scapi.User(dict(id=1), self.root).contacts.append(scapi.User(dict(id=2), self.root))
+        assert self.clock.slept == [0.5, 0.5]
+
+
+    def test_non_blocking(self):
+        self.limiter.block = False
+        self.root.Track.get(1)
+        self.root.Track.get(1)
+        self.assertRaises(RateLimited, self.root.Track.get, 1)
+        assert len(self.stub.requests) == 2
+
+
+    def test_adapts_to_throttling(self):
+        responses = [(429, {"Retry-After" : "5"}, "")]
+        self.stub.route("GET", "/tracks/2", handler=lambda request: responses.pop() if responses else (200, {}, dict(id=2)))
+        self.assertRaises(urllib2.HTTPError, self.root.Track.get, 2)
+        assert self.limiter.throttled == 1
+        bucket = self.limiter.bucket(self.connector.authenticator.identity, RateLimiter.READ)
+        assert bucket.rate == 1.0
+        self.root.Track.get(2)
+        assert self.clock.slept == [5.0]
+        assert bucket.rate == 1.1
+
+
+class CircuitBreakerTests(StubTestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTests, self).setUp()
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0, clock=self.clock)
+        self.connector = scapi.ApiConnector(host=self.stub.host, authenticator=self.stub.authenticator(),
+                                            circuit_breaker=self.breaker)
+        self.sink = self.connector.instrumentation.add_sink(metrics.HistogramSink())
+        self.root = scapi.Scope(self.connector)
+        self.responses = []
+        self.stub.route("GET", "/tracks/1",
+                        handler=lambda request: self.responses.pop(0) if self.responses else (200, {}, dict(id=1)))
+        self.key = self.stub.host, "tracks/*"
+
+
+    def test_opens_and_closes(self):
+        self.responses = [(500, {}, "")] * 3
+        for _ in xrange(2):
+            self.assertRaises(urllib2.HTTPError, self.root.Track.get, 1)
+        assert self.breaker.state(self.key) == "open"
+        self.assertRaises(CircuitOpen, self.root.Track.get, 1)
+        assert len(self.stub.requests) == 2
+        # other routes aren't affected
+        self.stub.route("GET", "/users/1", body=dict(id=1))
+        assert self.root.User.get(1).id == 1
+        # the probe fails, so the circuit stays open
+        self.clock.now += 10.0
+        self.assertRaises(urllib2.HTTPError, self.root.Track.get, 1)
+        assert self.breaker.state(self.key) == "open"
+        self.assertRaises(CircuitOpen, self.root.Track.get, 1)
+        # the next one succeeds
+        self.clock.now += 10.0
+        assert self.root.Track.get(1).id == 1
+        assert self.breaker.state(self.key) == "closed"
+        assert self.sink.states[("circuit", self.key)] == "closed"
+        assert self.sink.histogram("tracks/*", "GET", "total").count == 6
+        assert self.sink.statuses[("tracks/*", "GET")] == {500 : 3, None : 2, 200 : 1}
+
+
+    def test_client_errors_dont_count(self):
+        self.responses = [(403, {}, "")] * 3
+        for _ in xrange(3):
+            self.assertRaises(urllib2.HTTPError, self.root.Track.get, 1)
+        assert self.breaker.state(self.key) == "closed"
+
+
+    def test_half_open_probes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0, clock=self.clock)
+        changes = []
+        breaker.add_listener(lambda key, state: changes.append(state))
+        breaker.failure("key", socket.error())
+        self.clock.now += 1.0
+        breaker.before("key")
+        # only one probe at a time
+        self.assertRaises(CircuitOpen, breaker.before, "key")
+        breaker.success("key")
+        breaker.before("key")
+        assert changes == ["open", "half-open", "closed"]
+
+
+    def test_rate_limited_probe(self):
+        self.connector.rate_limiter = RateLimiter(read=(1.0, 1), block=False, clock=self.clock)
+        self.responses = [(500, {}, "")] * 2
+        for _ in xrange(2):
+            self.clock.now += 1.0
+            self.assertRaises(urllib2.HTTPError, self.root.Track.get, 1)
+        self.clock.now += 10.0
+        self.connector.rate_limiter.bucket(self.connector.authenticator.identity, "read").reserve(1, False)
+        self.assertRaises(RateLimited, self.root.Track.get, 1)
+        # the probe wasn't used up by the call that wasn't made
+        self.clock.now += 1.0
+        assert self.root.Track.get(1).id == 1
+        assert self.breaker.state(self.key) == "closed"
+
+
+class CoalescingTests(StubTestCase):
+
+    CALLERS = 8
+
+    def setUp(self):
+        super(CoalescingTests, self).setUp()
+        self.connector = scapi.ApiConnector(host=self.stub.host, authenticator=self.stub.authenticator(),
+                                            coalesce_gets=True)
+        self.root = scapi.Scope(self.connector)
+        self.release = threading.Event()
+        def slow(response):
+            def handler(request):
+                self.release.wait(5)
+                return response
+            return handler
+        self.stub.route("GET", "/me", handler=slow((303, {"Location" : "http://%s/users/1" % self.stub.host}, "")))
+        self.stub.route("GET", "/users/1", body=dict(id=1, username="foo", tracks=[dict(id=2)]))
+        self.stub.route("GET", "/tracks/3", handler=slow((404, {}, "")))
+        self.stub.route("GET", "/tracks/4", handler=slow((500, {}, "")))
+        self.stub.route("GET", "/tracks/5", handler=slow((503, {}, "")))
+        self.stub.route("GET", "/tracks/6", handler=slow((429, {}, "")))
+
+
+    def concurrently(self, func):
+        def invoke(_):
+            return func()
+        # let all callers join the flight before the response arrives
+        threading.Timer(0.2, self.release.set).start()
+        return run_concurrently(invoke, range(self.CALLERS), self.CALLERS)
+
+
+    def test_identical_gets_share_a_request(self):
+        outcomes = self.concurrently(self.root.me)
+        users = [o.result for o in outcomes]
+        assert all(o.ok for o in outcomes), outcomes
+        assert len(self.stub.requests_for("GET", "/me")) == 1
+        assert len(set(id(u) for u in users)) == self.CALLERS
+        assert all(u.username == "foo" for u in users)
+        self.stub.route("PUT", "/users/1")
+        users[0].username = "bar"
+        assert users[1].username == "foo"
+
+
+    def test_missing_and_failing(self):
+        outcomes = self.concurrently(lambda: self.root.Track.get(3))
+        assert [o.result for o in outcomes] == [None] * self.CALLERS
+        self.release.clear()
+        outcomes = self.concurrently(lambda: self.root.Track.get(4))
+        assert all(isinstance(o.exception, urllib2.HTTPError) for o in outcomes)
+        assert len(self.stub.requests) == 2
+
+
+    def test_only_the_leader_is_accounted(self):
+        self.connector.circuit_breaker = CircuitBreaker(failure_threshold=5)
+        self.connector.rate_limiter = limiter = RateLimiter(read=(100.0, 100))
+        self.connector.retry = policy = RetryPolicy(max_attempts=1)
+        outcomes = self.concurrently(lambda: self.root.Track.get(5))
+        assert all(isinstance(o.exception, urllib2.HTTPError) for o in outcomes)
+        # one failure doesn't open the circuit, no matter how many callers shared it
+        assert self.connector.circuit_breaker.state((self.stub.host, "tracks/*")) == "closed"
+        assert policy.counters()["gave_up"] == 1
+        assert limiter.throttled == 1
+        self.release.clear()
+        self.concurrently(lambda: self.root.Track.get(6))
+        # halved once per response, not per caller
+        assert limiter.throttled == 2
+        assert limiter.bucket(self.connector.authenticator.identity, "read").rate == 25.0
+
+
+    def test_other_identities_dont_share(self):
+        other = scapi.ApiConnector(host=self.stub.host, coalesce_gets=True,
+                                   authenticator=scapi.authentication.OAuthAuthenticator("consumer", "consumer_secret",
+                                                                                         "other", "secret"))
+        assert other.authenticator.identity != self.connector.authenticator.identity
+        threading.Timer(0.2, self.release.set).start()
+        outcomes = run_concurrently(lambda scope: scope.me(), [self.root, scapi.Scope(other)], 2)
+        assert all(o.ok for o in outcomes)
+        assert len(self.stub.requests_for("GET", "/me")) == 2
+
+
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        self.api = FixtureAPI(track_count=60, compress=True)
+        self.api.start()
+        self.connector = scapi.ApiConnector(host=self.api.host, authenticator=self.api.authenticator())
+        self.sink = self.connector.instrumentation.add_sink(metrics.HistogramSink())
+        self.root = scapi.Scope(self.connector)
+
+
+    def tearDown(self):
+        self.api.stop()
+
+
+    def test_gzipped_responses(self):
+        tracks = list(self.root.tracks())
+        assert [t.id for t in tracks] == [t["id"] for t in self.api.tracks]
+        received = self.sink.histogram("tracks/", "GET", "bytes").sum
+        decoded = self.sink.histogram("tracks/", "GET", "bytes_decoded").sum
+        assert received * 5 < decoded, (received, decoded)
+        for request in self.api.requests:
+            assert request.headers["accept-encoding"] == "gzip, deflate"
+
+
+    def test_redirects_accept_compression(self):
+        assert self.root.me().id == FixtureAPI.USER_ID
+        assert self.api.requests_for("GET", "/users/1")[0].headers["accept-encoding"] == "gzip, deflate"
+
+
+    def test_compression_can_be_disabled(self):
+        self.connector.compression = False
+        assert self.root.Track.get(FixtureAPI.TRACK_ID).id == FixtureAPI.TRACK_ID
+        assert "gzip" not in self.api.requests[0].headers.get("accept-encoding", "")
+        histogram = self.sink.histogram("tracks/*", "GET", "bytes")
+        assert histogram.sum == self.sink.histogram("tracks/*", "GET", "bytes_decoded").sum
+
+
+    def test_read_body(self):
+        import zlib
+        body = "[%s]" % ",".join(["{}"] * 10000)
+        for encoding, compressed in [("deflate", zlib.compress(body)),
+                                     ("deflate", zlib.compress(body)[2:-4]),
+                                     (None, body)]:
+            content, received = scapi.util.read_body(StringIO(compressed), encoding, chunk_size=100)
+            assert content == body
+            assert received == len(compressed)
+
+
+class ProjectionTests(TestCase):
+
+    def setUp(self):
+        self.api = FixtureAPI(track_count=60)
+        self.api.start()
+        self.connector = scapi.ApiConnector(host=self.api.host, authenticator=self.api.authenticator())
+        self.root = scapi.Scope(self.connector)
+
+
+    def tearDown(self):
+        self.api.stop()
+
+
+    def data(self, resource):
+        return resource._RESTBase__data
+
+
+    def test_call_projection(self):
+        tracks = list(self.root.tracks(__fields__=["title", "user_id"]))
+        assert len(tracks) == 60
+        assert all(sorted(self.data(t)) == ["id", "title", "user_id"] for t in tracks)
+        assert tracks[-1].title == "Knaster 59"
+        # not supported by the server, so nothing is sent
+        assert all(r.query in ("", "offset=50") for r in self.api.requests), self.api.requests
+
+
+    def test_scope_projection(self):
+        scope = self.root.with_fields("title")
+        track = scope.Track.get(FixtureAPI.TRACK_ID)
+        assert sorted(self.data(track)) == ["id", "title"]
+        assert len(self.data(self.root.Track.get(FixtureAPI.TRACK_ID))) > 2
+
+
+    def test_fields_parameter(self):
+        self.connector.fields_parameter = "fields"
+        list(self.root.with_fields("title", "user_id").tracks())
+        assert [r.query for r in self.api.requests] == ["fields=id%2Ctitle%2Cuser_id",
+                                                        "fields=id%2Ctitle%2Cuser_id&offset=50"], self.api.requests
+
+
+class PageSizeTests(TestCase):
+
+    def start(self, **kwargs):
+        self.api = FixtureAPI(**kwargs)
+        self.api.start()
+        self.connector = scapi.ApiConnector(host=self.api.host, authenticator=self.api.authenticator())
+        self.root = scapi.Scope(self.connector)
+
+
+    def tearDown(self):
+        self.api.stop()
+
+
+    def walk(self, **kwargs):
+        del self.api.requests[:]
+        ids = [t.id for t in self.root.tracks(**kwargs)]
+        assert ids == [t["id"] for t in self.api.tracks]
+        return [r.query for r in self.api.requests]
+
+
+    def test_connector_page_size(self):
+        self.start(track_count=45)
+        self.connector.page_size = 20
+        assert self.walk() == ["limit=20", "limit=20&offset=20", "limit=20&offset=40"]
+
+
+    def test_call_page_size(self):
+        self.start(track_count=20)
+        assert self.walk(__limit__=7) == ["limit=7", "limit=7&offset=7", "limit=7&offset=14"]
+        # the default sends nothing
+        assert self.walk() == [""]
+
+
+    def test_learns_page_cap(self):
+        self.start(track_count=120, page_cap=50)
+        self.connector.page_size = 200
+        assert self.walk() == ["limit=200", "limit=200&offset=50", "limit=50&offset=100"]
+        assert self.connector._page_caps == {"tracks/" : 50}
+        assert self.walk() == ["limit=50", "limit=50&offset=50", "limit=50&offset=100"]
+
+
+    def test_large_pages(self):
+        self.start(track_count=120)
+        self.connector.page_size = 200
+        assert self.walk() == ["limit=200", "limit=200&offset=120"]
+        assert self.connector._page_caps == {}
+
+
+    def test_short_lists_arent_probed(self):
+        self.start(track_count=3)
+        self.connector.page_size = 200
+        # the probe shows the route serves at least 3 items per page
+        assert self.walk() == ["limit=200", "limit=200&offset=3"]
+        assert self.connector._page_sizes_served == {"tracks/" : 3}
+        del self.api.tracks[2:]
+        self.api._pages.clear()
+        for _ in xrange(3):
+            assert self.walk() == ["limit=200"]
+
+
+    def test_learns_cap_below_list_limit(self):
+        self.start(track_count=100, page_cap=40)
+        self.connector.page_size = 50
+        # the short first page isn't mistaken for the last one
+        assert self.walk() == ["limit=50", "limit=50&offset=40", "limit=40&offset=80"]
+        assert self.connector._page_caps == {"tracks/" : 40}
+
+
+    def test_served_page_size_isnt_probed(self):
+        self.start(track_count=320)
+        self.connector.page_size = 200
+        # the full first page shows the size isn't capped
+        assert self.walk() == ["limit=200", "limit=200&offset=200"]
+        assert self.connector._page_sizes_served == {"tracks/" : 200}
+
+
+class CrawlerTests(StubTestCase):
+
+    GRAPH = {1 : [2, 3], 2 : [1, 4], 3 : [4, 5], 4 : [6], 5 : [], 6 : [1]}
+
+    def setUp(self):
+        super(CrawlerTests, self).setUp()
+        for user_id, contacts in self.GRAPH.iteritems():
+            self.stub.route("GET", "/users/%i/contacts" % user_id,
+                            [dict(id=id, username="user%i" % id) for id in contacts])
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmpdir, "crawl.json")
+        self.edges = []
+
+
+    def tearDown(self):
+        super(CrawlerTests, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+
+    def crawler(self, **kwargs):
+        return Crawler(self.root, [1], workers=3,
+                       on_edge=lambda *edge: self.edges.append(edge), **kwargs)
+
+
+    def all_edges(self):
+        return sorted((a, b) for a, contacts in self.GRAPH.iteritems() for b in contacts)
+
+
+    def test_crawl(self):
+        res = self.crawler().crawl()
+        assert res == dict(expanded=6, edges=8, failed=0), res
+        assert sorted(self.edges) == self.all_edges()
+        # every user is fetched once
+        assert len(self.stub.requests) == 6
+
+
+    def test_failing_on_edge(self):
+        def on_edge(user_id, contact_id):
+            self.edges.append((user_id, contact_id))
+            if user_id in (1, 3):
+                raise ValueError
+        crawler = Crawler(self.root, [1], workers=3, on_edge=on_edge)
+        res = crawler.crawl()
+        # the edges are followed anyway, and the other workers don't hang
+        assert res == dict(expanded=6, edges=8, failed=0), res
+        assert sorted(self.edges) == self.all_edges()
+
+
+    def test_max_depth(self):
+        res = self.crawler(max_depth=1).crawl()
+        assert res["expanded"] == 3
+        assert sorted(self.edges) == [(1, 2), (1, 3), (2, 1), (2, 4), (3, 4), (3, 5)]
+
+
+    def test_failures(self):
+        self.stub.route("GET", "/users/3/contacts", status=500)
+        res = self.crawler().crawl()
+        assert res == dict(expanded=4, edges=6, failed=1), res
+
+
+    def test_concurrent_checkpoints(self):
+        for user_id in xrange(10, 210):
+            self.stub.route("GET", "/users/%i/contacts" % user_id,
+                            [dict(id=10 + (user_id - 10 + i) % 200) for i in xrange(1, 4)])
+        res = Crawler(self.root, [10], workers=16, checkpoint=self.checkpoint, checkpoint_interval=1).crawl()
+        assert res == dict(expanded=200, edges=600, failed=0), res
+
+
+    def test_failing_checkpoints(self):
+        crawler = self.crawler(checkpoint=os.path.join(self.tmpdir, "missing", "crawl.json"),
+                               checkpoint_interval=1)
+        # the workers keep crawling, only the final checkpoint raises
+        self.assertRaises(IOError, crawler.crawl)
+        assert crawler.expanded == 6
+
+
+    def test_failed_users_are_retried_after_resume(self):
+        self.stub.route("GET", "/users/3/contacts", status=500)
+        res = self.crawler(checkpoint=self.checkpoint).crawl()
+        assert res["failed"] == 1
+        self.stub.route("GET", "/users/3/contacts", [dict(id=4), dict(id=5)])
+        res = self.crawler(checkpoint=self.checkpoint).crawl()
+        assert res == dict(expanded=6, edges=8, failed=0), res
+        assert sorted(set(self.edges)) == self.all_edges()
+
+
+    def test_resume(self):
+        res = self.crawler(max_users=2, checkpoint=self.checkpoint, checkpoint_interval=1).crawl()
+        assert res["expanded"] >= 2 and os.path.exists(self.checkpoint)
+        assert not os.path.exists(self.checkpoint + ".tmp")
+        res = self.crawler(checkpoint=self.checkpoint).crawl()
+        assert res["expanded"] == 6, res
+        assert sorted(set(self.edges)) == self.all_edges()
+
+
+    def test_id_sets(self):
+        for seen in IdSet(), BloomFilter(1000):
+            assert seen.add(4711) and seen.add(0)
+            assert not seen.add(4711)
+            assert 4711 in seen and 4712 not in seen
+            restored = seen.__class__.from_state(seen.state())
+            assert 4711 in restored and 4712 not in restored
+
+
+class SyncTests(StubTestCase):
+
+    USER_ID = 7
+
+    def setUp(self):
+        super(SyncTests, self).setUp()
+        self.connector.page_size = 10
+        # newest first, like the API-server lists them
+        self.tracks = [dict(id=i, title="Track %i" % i, comment_count=0, playback_count=i)
+                       for i in xrange(130, 100, -1)]
+        self.playlists = [dict(id=201, title="Set"), dict(id=200, title="Other set")]
+        self.favorites = [dict(id=301, title="Fav"), dict(id=300, title="Old fav")]
+        self.comments = [dict(id=401, body="Knaster"), dict(id=400, body="Rauschen")]
+        self.tracks[0]["comment_count"] = 2
+        self.user = dict(id=self.USER_ID, username="seven")
+        base = "/users/%i" % self.USER_ID
+        self.stub.route("GET", base, handler=lambda request: (200, {}, self.counted_user()))
+        self.stub.route("GET", base + "/tracks", handler=paginated(self.tracks))
+        self.stub.route("GET", base + "/playlists", handler=paginated(self.playlists))
+        self.stub.route("GET", base + "/favorites", handler=paginated(self.favorites))
+        self.stub.route("GET", "/tracks/130/comments", handler=paginated(self.comments))
+        self.clock = FakeClock()
+        self.mirror = Mirror(":memory:", clock=self.clock)
+        self.synchronizer = Synchronizer(self.root, self.mirror)
+
+
+    def tearDown(self):
+        super(SyncTests, self).tearDown()
+        self.mirror.close()
+
+
+    def counted_user(self):
+        return dict(self.user, track_count=len(self.tracks), playlist_count=len(self.playlists),
+                    public_favorites_count=len(self.favorites))
+
+
+    def sync(self, **kwargs):
+        del self.stub.requests[:]
+        self.clock.now += 1
+        return self.synchronizer.sync_user(self.USER_ID, **kwargs)
+
+
+    def test_initial_sync(self):
+        stats = self.sync()
+        assert stats == dict(fetched=36, inserted=36, updated=0, deleted=0, full_walks=4), stats
+        assert self.mirror.members("users/7", "tracks") == range(101, 131)
+        assert self.mirror.members("users/7", "favorites") == [300, 301]
+        assert self.mirror.members("tracks/130", "comments") == [400, 401]
+        assert self.mirror.resource("tracks", 130)["title"] == "Track 130"
+        assert self.mirror.resource("users", 7)["username"] == "seven"
+
+
+    def test_unchanged(self):
+        self.sync()
+        self.tracks[1]["playback_count"] += 1
+        stats = self.sync()
+        assert stats["inserted"] == stats["updated"] == stats["deleted"] == 0, stats
+        # the short lists are walked completely anyway
+        assert stats["full_walks"] == 2, stats
+        # the user, and the first page of every list - the short ones are
+        # probed, as the server might cap pages at their length
+        assert len(self.stub.requests) == 6, self.stub.requests
+        assert self.mirror.resource("tracks", 129)["playback_count"] == 130
+
+
+    def test_changes(self):
+        self.sync()
+        self.tracks.insert(0, dict(id=131, title="Track 131", comment_count=0))
+        self.tracks[1]["title"] = "Renamed"
+        self.tracks[1]["comment_count"] = 3
+        self.comments.insert(0, dict(id=402, body="Brummen"))
+        stats = self.sync()
+        assert stats == dict(fetched=12, inserted=2, updated=1, deleted=0, full_walks=3), stats
+        assert self.mirror.resource("tracks", 130)["title"] == "Renamed"
+        assert self.mirror.members("tracks/130", "comments") == [400, 401, 402]
+
+
+    def test_deletions(self):
+        self.sync()
+        del self.tracks[-1]
+        del self.favorites[0]
+        del self.comments[1]
+        self.tracks[0]["comment_count"] = 1
+        stats = self.sync()
+        assert stats["deleted"] == 3, stats
+        assert self.mirror.tombstones() == [("tracks/130", "comments", 400, 1002.0),
+                                            ("users/7", "favorites", 301, 1002.0),
+                                            ("users/7", "tracks", 101, 1002.0)]
+        assert self.mirror.tombstones(since=1002.0) == []
+        assert self.mirror.resource("tracks", 101) is None
+        # favorites aren't owned by the user
+        assert self.mirror.resource("tracks", 301) is not None
+
+
+    def test_full_sync(self):
+        self.sync()
+        # the walk stops before reaching the change, only a full sync notices
+        self.tracks[-1]["title"] = "Renamed"
+        assert self.sync()["updated"] == 0
+        stats = self.sync(full=True)
+        # including the comments of every track
+        assert stats["updated"] == 1 and stats["full_walks"] == 3 + 30, stats
+        assert self.mirror.resource("tracks", 101)["title"] == "Renamed"
+
+
+    def test_sync_users(self):
+        self.stub.route("GET", "/users/8", status=500)
+        outcomes = self.synchronizer.sync_users([self.USER_ID, 8], workers=2)
+        assert outcomes[0].ok and outcomes[0].result["inserted"] == 36
+        assert not outcomes[1].ok
+
+
+    def test_deleted_user(self):
+        self.sync()
+        self.stub.route("GET", "/users/%i" % self.USER_ID, status=404)
+        stats = self.sync()
+        # 30 tracks with 2 comments, 2 playlists and 2 favorites
+        assert stats["deleted"] == 36, stats
+        assert self.mirror.resource("users", self.USER_ID) is None
+        assert self.mirror.resource("tracks", 130) is None
+        assert self.mirror.resource("tracks", 301) is not None
+        assert self.mirror.members("users/7", "favorites") == []
+        assert self.mirror.members("tracks/130", "comments") == []
+
+
+class EventTailerTests(StubTestCase):
+
+    def setUp(self):
+        super(EventTailerTests, self).setUp()
+        self.events = []
+        self.add_events(3)
+        self.stub.route("GET", "/events", handler=paginated(self.events))
+        self.tmpdir = tempfile.mkdtemp()
+        self.cursor = os.path.join(self.tmpdir, "events.cursor")
+        self.delivered = []
+
+
+    def tearDown(self):
+        super(EventTailerTests, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+
+    def add_events(self, count):
+        # newest first
+        for _ in xrange(count):
+            id = len(self.events) + 1
+            self.events.insert(0, dict(id=id, type=1, created_at="2009/01/01 00:00:%02i +0000" % id))
+
+
+    def tailer(self, **kwargs):
+        kwargs.setdefault("handler", lambda event: self.delivered.append(event.id))
+        return EventTailer(self.root, cursor=self.cursor, page_size=2, **kwargs)
+
+
+    def test_poll(self):
+        tailer = self.tailer()
+        # tailing starts with the newest event
+        assert tailer.poll() == 1 and self.delivered == [3]
+        del self.stub.requests[:]
+        assert tailer.poll() == 0
+        assert len(self.stub.requests) == 1
+        self.add_events(3)
+        del self.stub.requests[:]
+        assert tailer.poll() == 3
+        assert self.delivered == [3, 4, 5, 6]
+        # the third page isn't fetched
+        assert [r.query for r in self.stub.requests] == ["limit=2", "limit=2&offset=2"]
+
+
+    def test_cursor(self):
+        self.tailer().poll()
+        self.add_events(2)
+        tailer = self.tailer()
+        assert tailer.cursor["id"] == 3
+        assert tailer.poll() == 2 and self.delivered == [3, 4, 5]
+        assert not os.path.exists(self.cursor + ".tmp")
+
+
+    def test_duplicates(self):
+        tailer = self.tailer()
+        tailer.poll()
+        self.add_events(3)
+        # a new event arriving while paging shows up twice
+        self.events.insert(2, self.events[1])
+        assert tailer.poll() == 3 and self.delivered == [3, 4, 5, 6]
+
+
+    def test_queue(self):
+        events = Queue.Queue(maxsize=2)
+        tailer = self.tailer(handler=None, queue=events)
+        tailer.poll()
+        self.add_events(2)
+        delivered = []
+        # the second event waits for the consumer
+        poller = threading.Thread(target=tailer.poll)
+        poller.start()
+        poller.join(0.2)
+        assert poller.isAlive() and tailer.delivered == 2
+        while len(delivered) < 3:
+            delivered.append(events.get(timeout=1.0).id)
+        poller.join()
+        assert delivered == [3, 4, 5]
+        self.assertRaises(ValueError, EventTailer, self.root)
+
+
+    def test_adaptive_interval(self):
+        clock = FakeClock()
+        tailer = self.tailer(sleep=clock.sleep, min_interval=5.0, max_interval=30.0)
+        tailer.run(polls=5)
+        assert clock.slept == [5.0, 10.0, 20.0, 30.0], clock.slept
+        self.add_events(1)
+        tailer.run(polls=6)
+        assert tailer.interval == 15.0
+        self.stub.route("GET", "/events", status=500)
+        tailer.run(polls=7)
+        assert tailer.interval == 30.0
+
+
+    def test_stop_before_run(self):
+        clock = FakeClock()
+        tailer = self.tailer(sleep=clock.sleep)
+        tailer.stop()
+        tailer.run()
+        assert tailer.polls == 0 and clock.slept == []
+        assert not self.stub.requests
@@ -14,6 +14,7 @@ from validate import Validator
 
 import scapi
 import scapi.authentication
+import scapi.transport
 
 logger = logging.getLogger("scapi.tests")
 
@@ -31,6 +32,9 @@ class SCAPITests(TestCase):
     USER = None 
     PASSWORD = None 
     AUTHENTICATOR = None 
+    PROXY = None
+    RECORD = None
+    REPLAY = None
     RUN_INTERACTIVE_TESTS = False
 
     
@@ -61,6 +65,10 @@ class SCAPITests(TestCase):
 
     [test]
     run_interactive_tests=boolean(default=false)
+
+    [transport]
+    record=string(default=None)
+    replay=string(default=None)
     """)
 
 
@@ -116,21 +124,18 @@ class SCAPITests(TestCase):
         self.AUTHENTICATOR = api.get("authenticator")
         
 
-        # reset the hard-coded values in the api
-        if self.API_HOST:
-            scapi.AUTHORIZATION_URL = "http://%s/oauth/authorize" % self.API_HOST
-            scapi.REQUEST_TOKEN_URL = 'http://%s/oauth/request_token' % self.API_HOST
-            scapi.ACCESS_TOKEN_URL = 'http://%s/oauth/access_token' % self.API_HOST
-
         if "proxy" in parser and parser["proxy"]["use_proxy"]:
-            scapi.USE_PROXY = True
-            scapi.PROXY = parser["proxy"]["proxy"]
+            self.PROXY = parser["proxy"]["proxy"]
 
         if "logging" in parser:
             logger.setLevel(getattr(logging, parser["logging"]["test_logger"]))
             api_logger.setLevel(getattr(logging, parser["logging"]["api_logger"]))
 
         self.RUN_INTERACTIVE_TESTS = parser["test"]["run_interactive_tests"]
+
+        # record the requests to a log, or run offline by replaying one
+        self.RECORD = parser["transport"]["record"]
+        self.REPLAY = parser["transport"]["replay"]
         
 
     @property
@@ -148,13 +153,39 @@ class SCAPITests(TestCase):
         else:
             raise Exception("Unknown authenticator setting: %s", self.AUTHENTICATOR)
 
-        connector = scapi.ApiConnector(host=self.API_HOST, 
-                                        authenticator=authenticator)
+        connector = self.connector(authenticator)
 
         logger.debug("RootScope: %s authenticator: %s", self.API_HOST, self.AUTHENTICATOR)
         return scapi.Scope(connector)
 
 
+    def transport(self):
+        """
+        Return the transport to use, according to the transport-section
+        of the configuration.
+        """
+        if self.REPLAY:
+            return scapi.transport.ReplayTransport(scapi.transport.load_log(self.REPLAY))
+        if self.RECORD:
+            transport = scapi.transport.RecordingTransport(self.RECORD)
+            self.addCleanup(transport.close)
+            return transport
+        return None
+
+
+    def connector(self, authenticator):
+        """
+        Return a connector configured to use our host and proxy.
+        """
+        return scapi.ApiConnector(host=self.API_HOST, 
+                                  authenticator=authenticator,
+                                  proxy=self.PROXY,
+                                  transport=self.transport(),
+                                  request_token_url="http://%s/oauth/request_token" % self.API_HOST,
+                                  access_token_url="http://%s/oauth/access_token" % self.API_HOST,
+                                  authorization_url="http://%s/oauth/authorize" % self.API_HOST)
+
+
     def test_connect(self):
         """
         test_connect
@@ -192,7 +223,7 @@ class SCAPITests(TestCase):
                                                                       None, 
                                                                       None)
 
-        sca = scapi.ApiConnector(host=self.API_HOST, authenticator=oauth_authenticator)
+        sca = self.connector(oauth_authenticator)
         token, secret = sca.fetch_request_token()
         authorization_url = sca.get_request_token_authorization_url(token)
         webbrowser.open(authorization_url)
@@ -202,7 +233,7 @@ class SCAPITests(TestCase):
                                                                       token, 
                                                                       secret)
 
-        sca = scapi.ApiConnector(self.API_HOST, authenticator=oauth_authenticator)
+        sca = self.connector(oauth_authenticator)
         token, secret = sca.fetch_access_token()
         logger.info("Access token: '%s'", token)
         logger.info("Access token secret: '%s'", secret)
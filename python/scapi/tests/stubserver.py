@@ -0,0 +1,246 @@
+"""
+A local HTTP-server standing in for the SoundCloud API-server, so that
+tests and benchmarks can run without network access.
+
+>>> stub = StubAPI()
+>>> stub.start()
+>>> stub.route("GET", "/me", status=303, headers={"Location" : "/users/1"})
+>>> stub.route("GET", "/users/1", body=dict(id=1, username="foo"))
+>>> connector = scapi.ApiConnector(host=stub.host, authenticator=stub.authenticator())
+>>> scapi.Scope(connector).me()
+>>> stub.stop()
+"""
+import os
+import copy
+import gzip
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from StringIO import StringIO
+
+import simplejson
+
+import scapi
+import scapi.authentication
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class StubRequest(object):
+    """
+    A request the stub received.
+    """
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    @property
+    def params(self):
+        """
+        The urlencoded body-parameters.
+        """
+        return urlparse.parse_qs(self.body, keep_blank_values=True)
+
+    def __repr__(self):
+        return "<StubRequest %s %s?%s>" % (self.method, self.path, self.query)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.0"
+
+    def _handle(self):
+        path, _, query = self.path.partition("?")
+        body = ""
+        if "content-length" in self.headers:
+            body = self.rfile.read(int(self.headers["content-length"]))
+        request = StubRequest(self.command, path, query, self.headers, body)
+        status, headers, body = self.server.stub.handle(request)
+        if body and self.server.stub.compress and "gzip" in self.headers.get("accept-encoding", ""):
+            buf = StringIO()
+            outf = gzip.GzipFile(fileobj=buf, mode="wb")
+            outf.write(body)
+            outf.close()
+            body = buf.getvalue()
+            headers = dict(headers, **{"Content-Encoding" : "gzip"})
+        self.send_response(status)
+        for key, value in headers.iteritems():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class StubAPI(object):
+    """
+    The stub API-server. Responses are registered with L{route}. Every
+    request received is recorded in L{requests}.
+
+    If compress is True, responses are gzipped for clients accepting it.
+    """
+
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.requests = []
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.stub = self
+        thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def host(self):
+        return "%s:%i" % self._server.server_address
+
+    def authenticator(self):
+        return scapi.authentication.OAuthAuthenticator("consumer", "consumer_secret",
+                                                       "token", "secret")
+
+    def route(self, method, path, body=None, status=200, headers=None, handler=None):
+        """
+        Register a response for a method and path.
+
+        @param body: the response body. Anything but a string is encoded as JSON.
+        @param handler: if given, a callable receiving the L{StubRequest} and
+               returning a tuple (status, headers, body), overriding the other
+               arguments.
+        """
+        if handler is None:
+            headers = dict(headers or {})
+            headers.setdefault("Content-Type", "application/json; charset=utf-8")
+            if body is not None and not isinstance(body, str):
+                body = simplejson.dumps(body)
+            if body is None:
+                body = ""
+            response = status, headers, body
+            handler = lambda request: response
+        self._routes[method, _normalize(path)] = handler
+
+    def handle(self, request):
+        self._lock.acquire()
+        try:
+            self.requests.append(request)
+        finally:
+            self._lock.release()
+        handler = self._routes.get((request.method, _normalize(request.path)))
+        if handler is None:
+            return 404, {}, ""
+        status, headers, body = handler(request)
+        headers = dict(headers)
+        headers.setdefault("Content-Type", "application/json; charset=utf-8")
+        if body is not None and not isinstance(body, str):
+            body = simplejson.dumps(body)
+        return status, headers, body or ""
+
+    def requests_for(self, method, path):
+        path = _normalize(path)
+        return [r for r in self.requests if r.method == method and _normalize(r.path) == path]
+
+
+def _normalize(path):
+    # the API doesn't care about trailing slashes
+    return path.rstrip("/") or "/"
+
+
+def paginated(items):
+    """
+    A handler serving the items like the API-server serves lists, honoring
+    offset and limit. Changes to the list are visible in later requests.
+    """
+    def handler(request):
+        query = urlparse.parse_qs(request.query)
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(scapi.ApiConnector.LIST_LIMIT)])[0])
+        return 200, {}, items[offset:offset + limit]
+    return handler
+
+
+def load_fixture(name):
+    """
+    Load one of the recorded JSON-responses in the fixtures-directory.
+    """
+    inf = open(os.path.join(FIXTURES, "%s.json" % name))
+    try:
+        return simplejson.load(inf)
+    finally:
+        inf.close()
+
+
+class FixtureAPI(StubAPI):
+    """
+    A StubAPI serving the recorded fixtures. It knows
+
+     - the authenticated user, 1, reachable through /me
+     - a catalog of tracks, paginated like the API-server does. If page_cap
+       is given, larger pages are capped to it.
+     - creating, fetching and updating the track 1001
+     - adding and removing contacts of the user
+    """
+
+    USER_ID = 1
+    TRACK_ID = 1001
+
+    def __init__(self, track_count=500, contact_count=100, compress=False, page_cap=None):
+        StubAPI.__init__(self, compress)
+        self.page_cap = page_cap
+        self.user = load_fixture("user")
+        self.track = load_fixture("track")
+        self.tracks = []
+        for i in xrange(track_count):
+            track = copy.deepcopy(self.track)
+            track["id"] = self.TRACK_ID + i
+            track["title"] = "Knaster %i" % i
+            self.tracks.append(track)
+        self.contact_ids = range(self.USER_ID + 1, self.USER_ID + 1 + contact_count)
+        self._pages = {}
+
+    def start(self):
+        StubAPI.start(self)
+        user_url = "http://%s/users/%i" % (self.host, self.USER_ID)
+        track_url = "http://%s/tracks/%i" % (self.host, self.TRACK_ID)
+        self.route("GET", "/me", status=303, headers={"Location" : user_url})
+        self.route("GET", "/users/%i" % self.USER_ID, body=self.user)
+        self.route("GET", "/tracks", handler=self._tracks)
+        self.route("POST", "/tracks", status=201, headers={"Location" : track_url}, body=self.track)
+        self.route("GET", "/tracks/%i" % self.TRACK_ID, body=self.track)
+        self.route("PUT", "/tracks/%i" % self.TRACK_ID, body=self.track)
+        for id in self.contact_ids:
+            self.route("PUT", "/users/%i/contacts/%i" % (self.USER_ID, id))
+            self.route("DELETE", "/users/%i/contacts/%i" % (self.USER_ID, id))
+
+    def _tracks(self, request):
+        query = urlparse.parse_qs(request.query)
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(scapi.ApiConnector.LIST_LIMIT)])[0])
+        if self.page_cap is not None:
+            limit = min(limit, self.page_cap)
+        key = offset, limit
+        page = self._pages.get(key)
+        if page is None:
+            page = self._pages[key] = simplejson.dumps(self.tracks[offset:offset + limit])
+        return 200, {}, page
@@ -0,0 +1,365 @@
+##    SouncCloudAPI implements a Python wrapper around the SoundCloud RESTful
+##    API
+##
+##    Copyright (C) 2008  Diez B. Roggisch
+##    Contact mailto:deets@soundcloud.com
+##
+##    This library is free software; you can redistribute it and/or
+##    modify it under the terms of the GNU Lesser General Public
+##    License as published by the Free Software Foundation; either
+##    version 2.1 of the License, or (at your option) any later version.
+##
+##    This library is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##    Lesser General Public License for more details.
+##
+##    You should have received a copy of the GNU Lesser General Public
+##    License along with this library; if not, write to the Free Software
+##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Transports perform the HTTP-requests of an L{scapi.ApiConnector}.
+
+Besides the L{HTTPTransport} talking to the API-server, there is a
+L{RecordingTransport} which logs every request and its response, and a
+L{ReplayTransport} serving the recorded responses again - without any
+network. Record a session like this:
+
+>>> transport = RecordingTransport("session.log.gz")
+>>> sca = scapi.Scope(scapi.ApiConnector(host=API_HOST, authenticator=authenticator,
+...                                      transport=transport))
+>>> ... # do the work
+>>> transport.close()
+
+The log can then be used to run the SCAPI offline, or a L{Replayer} re-issues
+the recorded calls - at the original speed, or accelerated, and with as many
+threads as you like:
+
+>>> print Replayer(load_log("session.log.gz"), speed=10.0, workers=8).run()
+
+The log contains one JSON-object per line, and is gzipped if its name
+ends with .gz.
+"""
+
+import os
+import time
+import types
+import base64
+import urllib2
+import urlparse
+import threading
+import itertools
+import logging
+from StringIO import StringIO
+from collections import deque
+
+from scapi.util import LazyModule
+from scapi.concurrency import run_concurrently, DEFAULT_WORKERS
+
+simplejson = LazyModule("simplejson")
+
+logger = logging.getLogger(__name__)
+
+
+class NotRecorded(Exception):
+    """
+    Raised by the L{ReplayTransport} for requests that aren't in the log.
+    """
+
+
+class HTTPTransport(object):
+    """
+    Performs requests using urllib2. This is the default transport.
+    """
+
+    def open(self, context, req, data, handlers):
+        """
+        Perform a request.
+
+        @param context: the state of the request
+        @type context: scapi.RequestContext
+        @param req: the signed request
+        @type req: scapi.SCRequest
+        @param data: the urlencoded body, or the parameters of a multipart-request
+        @param handlers: the urllib2-handlers to use
+        @return: the response
+        @raise urllib2.HTTPError: for error-responses
+        """
+        return urllib2.build_opener(*handlers).open(req, data)
+
+
+def _open_log(filename, mode):
+    if filename.endswith(".gz"):
+        import gzip
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+def _pack(body):
+    """
+    Make a body JSON-compatible.
+    """
+    try:
+        return body.decode("utf-8"), False
+    except UnicodeDecodeError:
+        return base64.b64encode(body), True
+
+
+def _unpack(body, is_base64):
+    if is_base64:
+        return base64.b64decode(body)
+    return body.encode("utf-8")
+
+
+def _response(url, code, msg, headers, body):
+    import mimetools
+    info = mimetools.Message(StringIO(headers))
+    res = urllib2.addinfourl(StringIO(body), info, url, code)
+    res.msg = msg
+    return res
+
+
+def _key(method, url):
+    # the host differs between recording and replaying, and
+    # the API doesn't care about trailing slashes
+    _, _, path, _, query, _ = urlparse.urlparse(url)
+    return method, path.rstrip("/") or "/", query
+
+
+class RecordingTransport(object):
+    """
+    Performs the requests using another transport, and appends them
+    together with their responses and redirects to a log.
+
+    The entries of the log have the keys
+
+     - time: when the request was started
+     - elapsed: the seconds it took
+     - method, url, body: the request. The body is None for multipart-requests,
+       which are flagged with multipart instead.
+     - status, msg, headers, response: the final response
+     - redirects: the locations the request was redirected to
+     - error: the reason if the request failed without response, None otherwise
+    """
+
+    def __init__(self, filename, transport=None):
+        """
+        @param filename: the log. If it exists, the entries are appended.
+        @type filename: str
+        @param transport: the transport performing the requests, defaults to L{HTTPTransport}
+        """
+        self.filename = filename
+        self.transport = transport or HTTPTransport()
+        self._outf = _open_log(filename, "a")
+        self._lock = threading.Lock()
+
+    def open(self, context, req, data, handlers):
+        multipart = data is not None and not isinstance(data, basestring)
+        entry = dict(time=time.time(), method=req.get_method(), url=req.get_full_url(),
+                     body=None if multipart else data, multipart=multipart, error=None)
+        try:
+            handle = self.transport.open(context, req, data, handlers)
+        except urllib2.HTTPError, e:
+            body = e.read()
+            self._record(entry, context, e.code, e.msg, e.hdrs, body)
+            raise urllib2.HTTPError(e.filename, e.code, e.msg, e.hdrs, StringIO(body))
+        except urllib2.URLError, e:
+            entry["error"] = str(e.reason)
+            self._record(entry, context, None, None, None, "")
+            raise
+        try:
+            body = handle.read()
+        finally:
+            handle.close()
+        code = getattr(handle, "code", None)
+        msg = getattr(handle, "msg", "")
+        self._record(entry, context, code, msg, handle.info(), body)
+        return _response(handle.geturl(), code, msg, "".join(handle.info().headers), body)
+
+    def _record(self, entry, context, code, msg, info, body):
+        entry["elapsed"] = time.time() - entry["time"]
+        entry["status"] = code
+        entry["msg"] = msg
+        entry["headers"] = "".join(info.headers) if info is not None else ""
+        entry["response"], entry["base64"] = _pack(body)
+        entry["redirects"] = list(context.redirects)
+        line = simplejson.dumps(entry, separators=(",", ":"))
+        self._lock.acquire()
+        try:
+            self._outf.write(line + "\n")
+            self._outf.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._outf.close()
+
+
+def load_log(filename):
+    """
+    Load the entries written by a L{RecordingTransport}.
+
+    @rtype: list<dict>
+    """
+    inf = _open_log(filename, "r")
+    try:
+        return [simplejson.loads(line) for line in inf if line.strip()]
+    finally:
+        inf.close()
+
+
+class ReplayTransport(object):
+    """
+    Serves the responses of a log instead of performing requests.
+
+    Requests are matched by method and url, disregarding the host. If the
+    same request was recorded several times, the responses are served in the
+    recorded order, and the last one over and over again after that.
+    """
+
+    def __init__(self, entries, speed=None):
+        """
+        @param entries: the log, see L{load_log}
+        @type entries: list<dict>
+        @param speed: if given, the recorded latency divided by speed is
+               simulated. Otherwise the responses are served immediately.
+        @type speed: float
+        """
+        self.speed = speed
+        self._responses = {}
+        for entry in entries:
+            self._responses.setdefault(_key(entry["method"], entry["url"]), deque()).append(entry)
+        self._lock = threading.Lock()
+
+    def _entry(self, req):
+        key = _key(req.get_method(), req.get_full_url())
+        self._lock.acquire()
+        try:
+            responses = self._responses.get(key)
+            if not responses:
+                raise NotRecorded("%s %s" % (req.get_method(), req.get_full_url()))
+            if len(responses) > 1:
+                return responses.popleft()
+            return responses[0]
+        finally:
+            self._lock.release()
+
+    def open(self, context, req, data, handlers):
+        entry = self._entry(req)
+        if self.speed:
+            time.sleep(entry["elapsed"] / self.speed)
+        context.redirects.extend(entry["redirects"])
+        if entry["error"] is not None:
+            raise urllib2.URLError(entry["error"])
+        url = req.get_full_url()
+        if entry["redirects"]:
+            url = entry["redirects"][-1]
+        handle = _response(url, entry["status"], entry["msg"], entry["headers"],
+                           _unpack(entry["response"], entry["base64"]))
+        if entry["status"] >= 400:
+            raise urllib2.HTTPError(url, entry["status"], entry["msg"], handle.info(), handle)
+        return handle
+
+
+class Replayer(object):
+    """
+    Re-issues the calls of a log through the SCAPI, with a L{ReplayTransport}
+    serving the responses. This exercises everything but the network - signing,
+    building urls, decoding and mapping - which makes it suitable for load-tests
+    and measuring the CPU-time spent per request.
+
+    Multipart-requests can't be re-issued, as the uploaded files aren't part
+    of the log. They are skipped.
+    """
+
+    def __init__(self, entries, speed=1.0, workers=DEFAULT_WORKERS, authenticator=None, base=""):
+        """
+        @param entries: the log, see L{load_log}
+        @type speed: float
+        @param speed: the factor by which the replay is accelerated. If None,
+               the calls are made as fast as possible.
+        @type workers: int
+        @param workers: the number of threads issuing calls
+        @param authenticator: the authenticator signing the requests. Defaults to
+               an OAuthAuthenticator with dummy credentials.
+        @param base: the base of the recorded connector
+        """
+        self.entries = sorted(entries, key=lambda entry: entry["time"])
+        self.speed = speed
+        self.workers = workers
+        if authenticator is None:
+            from scapi.authentication import OAuthAuthenticator
+            authenticator = OAuthAuthenticator("consumer", "consumer_secret", "token", "secret")
+        self.authenticator = authenticator
+        self.base = base
+
+    def connector(self):
+        """
+        @return: a connector using a L{ReplayTransport} for our entries
+        @rtype: scapi.ApiConnector
+        """
+        import scapi
+        return scapi.ApiConnector(host="replay.invalid", authenticator=self.authenticator,
+                                  base=self.base, transport=ReplayTransport(self.entries, self.speed))
+
+    def _arguments(self, connector, entry):
+        """
+        @return: the arguments for Scope._call reproducing the entry
+        @rtype: tuple(str, dict)
+        """
+        import scapi
+        _, _, path, _, query, _ = urlparse.urlparse(entry["url"])
+        kwargs = {}
+        if entry["body"]:
+            for name, values in urlparse.parse_qs(entry["body"], keep_blank_values=True).iteritems():
+                kwargs[name] = values[0] if len(values) == 1 else values
+        query = urlparse.parse_qs(query)
+        offset = query.get(scapi.ApiConnector.LIST_OFFSET_PARAMETER)
+        if offset:
+            kwargs["__offset__"] = int(offset[0])
+        limit = query.get(scapi.ApiConnector.LIST_LIMIT_PARAMETER)
+        if limit:
+            kwargs["__limit__"] = int(limit[0])
+        if entry["method"] in ("PUT", "DELETE"):
+            kwargs["_alternate_http_method"] = entry["method"]
+        return connector.normalize_method(path), kwargs
+
+    def run(self):
+        """
+        Replay the entries.
+
+        @return: the number of calls made, failed and skipped, the elapsed
+                 wall-clock- and CPU-time, and the CPU-time per call
+        @rtype: dict
+        """
+        import scapi
+        root = scapi.Scope(self.connector())
+        entries = [entry for entry in self.entries if not entry["multipart"]]
+        if not entries:
+            return dict(calls=0, errors=0, skipped=len(self.entries), elapsed=0.0,
+                        cpu=0.0, cpu_per_call=None)
+        first = entries[0]["time"]
+        started = time.time()
+        cpu_started = sum(os.times()[:2])
+
+        def call(entry):
+            if self.speed:
+                delay = started + (entry["time"] - first) / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            method, kwargs = self._arguments(root._get_connector(), entry)
+            res = root._call(method, **kwargs)
+            if isinstance(res, types.GeneratorType):
+                # only the recorded page, the following ones are entries of their own
+                list(itertools.islice(res, kwargs.get("__limit__", scapi.ApiConnector.LIST_LIMIT)))
+            return res
+
+        outcomes = run_concurrently(call, entries, self.workers)
+        cpu = sum(os.times()[:2]) - cpu_started
+        return dict(calls=len(entries),
+                    errors=len([o for o in outcomes if not o.ok]),
+                    skipped=len(self.entries) - len(entries),
+                    elapsed=time.time() - started,
+                    cpu=cpu,
+                    cpu_per_call=cpu / len(entries))
@@ -18,8 +18,83 @@
 ##    License along with this library; if not, write to the Free Software
 ##    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import zlib
 import urllib
+import logging
 
 def escape(s):
     # escape '/' too
     return urllib.quote(s, safe='')
+
+
+class LazyModule(object):
+    """
+    A stand-in for a module, which is only imported when
+    one of its attributes is accessed for the first time.
+
+    >>> simplejson = LazyModule("simplejson")
+    >>> simplejson.loads("{}")
+    {}
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, name):
+        module = self.__dict__['_module']
+        if module is None:
+            module = __import__(self._name, {}, {}, ['__name__'])
+            self._module = module
+        return getattr(module, name)
+
+
+class NullHandler(logging.Handler):
+    """
+    A logging-handler that does nothing, so that using the SCAPI
+    doesn't produce "No handlers could be found"-warnings.
+    Configuring logging is left to the application.
+    """
+
+    def emit(self, record):
+        pass
+
+
+def read_body(fp, content_encoding=None, chunk_size=64 * 1024):
+    """
+    Read a response-body, decompressing it on the fly if it's gzip- or
+    deflate-encoded. The compressed body is never kept as a whole.
+
+    @param fp: the file-like response
+    @param content_encoding: the value of the Content-Encoding-header
+    @return: the decompressed body, and the number of bytes read
+    @rtype: tuple(str, int)
+    """
+    encoding = (content_encoding or "").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        decompressor = None
+    else:
+        content = fp.read()
+        return content, len(content)
+    chunks = []
+    received = 0
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        if decompressor is None:
+            # deflate is supposed to be zlib-wrapped, but some servers send it raw
+            try:
+                decompressor = zlib.decompressobj()
+                chunks.append(decompressor.decompress(chunk))
+            except zlib.error:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                chunks.append(decompressor.decompress(chunk))
+        else:
+            chunks.append(decompressor.decompress(chunk))
+    if decompressor is not None:
+        chunks.append(decompressor.flush())
+    return "".join(chunks), received